@@ -7,6 +7,9 @@ from prompts import (
     coding_testing_agent_prompt,
     coding_documentation_agent_prompt,
     coding_optimization_agent_prompt,
+    coding_integration_followup_prompt,
+    coding_testing_followup_prompt,
+    coding_optimization_followup_prompt,
     feedback_prompt  
 )
 from config_loader import load_config
@@ -14,12 +17,50 @@ from language_detector import detect_language
 from execution_manager import execute_code, run_tests
 from file_manager import save_code
 from search_manager import SearchManager
-from logger_config import setup_logging
+from logger_config import setup_logging, payload
+from llm_client import LLMClient
+from pipeline import StageGraph
+from workspace import Workspace
+from runner_pool import TestRunnerPool
+from dependency_manager import DependencyManager
+from build_cache import BuildCache
+from profiler import Profiler
+from journal import RunJournal, current_journal, new_run_id, prune_journals, record_event
+from generation_options import GenerationOptions
+from reference_index import ReferenceIndex
+from query_memory import QueryMemory
+from prompt_builder import PromptBuilder, FeedbackLog
+from metrics import get_recorder, query_scope
+from response_cache import ResponseCache, cache_key
+from ndjson_stream import consume_stream
 import os
 import time
+import uuid
+import argparse
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+LANGUAGE_EXTENSIONS = {
+    'python': 'py',
+    'javascript': 'js',
+    'html': 'html',
+    'css': 'css',
+    'java': 'java',
+    'c++': 'cpp',
+    'c#': 'cs',
+    'ruby': 'rb',
+    'go': 'go',
+    'php': 'php',
+}
+# Ollama contexts returned by the finished generations of the current query,
+# by stage; follow-up requests can continue from them instead of re-sending.
+# "last_prompts" holds the query's last prompt per model.
+stage_contexts = contextvars.ContextVar("stage_contexts", default=None)
 
 class CoderAgent:
-    def __init__(self, model, model_tool, model_qa, model_endpoint, planning_agent_prompt, integration_agent_prompt, testing_agent_prompt, documentation_agent_prompt, optimization_agent_prompt, verbose=False, iterations=1, max_retries=3, retry_delay=5):
+    def __init__(self, model, model_tool, model_qa, model_endpoint, planning_agent_prompt, integration_agent_prompt, testing_agent_prompt, documentation_agent_prompt, optimization_agent_prompt, verbose=False, iterations=1, max_retries=3, retry_delay=5, pool_maxsize=16, max_concurrency=4, endpoint_limits=None, stage_workers=4, use_cache=True, cache_path='.agent_cache/responses.sqlite', cache_bypass=False, workspace_dir=None, use_tmpfs=False, test_workers=2, test_preload=(), test_timeout=15, test_limits=None, test_shards=None, candidates=1, candidate_temperature_step=0.3, stage_budgets=None, stage_options=None, num_ctx=8192, keep_alive="10m", metrics=None, tokenizer=None, context_budgets=None, feedback_budget=512, reuse_context=False, index_path='.agent_cache/index', use_index=True, web_references=False, reference_chars=2000, query_memory_path='.agent_cache/queries.sqlite', plan_reuse_threshold=None, code_reuse_threshold=None, dependency_dir='.agent_cache/envs', wheel_dir='.agent_cache/wheels', index_url=None, find_links=None, offline_dependencies=False, build_dir='.agent_cache/builds', build_flags=None, measure_optimization=True, optimization_rounds=1, benchmark_repeat=5, min_speedup=0.25, journal_dir='.agent_cache/runs', max_journals=200):
         load_config('config.yaml')
         self.api_key = os.getenv("OPENAI_API_KEY")
         self.url = model_endpoint
@@ -29,6 +70,14 @@ class CoderAgent:
         }
         self.temperature = 0
         self.max_tokens = 1000
+        # Maps per-stage budgets and settings onto the backend's options
+        self.generation = GenerationOptions(stage_budgets, stage_options, default_budget=self.max_tokens, num_ctx=num_ctx, keep_alive=keep_alive)
+        # Keeps every prompt within its stage's share of the context window
+        self.prompts = PromptBuilder(self.generation, tokenizer, context_budgets, feedback_budget)
+        # Continue code and test requests from the planning request's context
+        # rather than sending the plan again
+        self.reuse_context = reuse_context
+        self._last_prompts_lock = threading.Lock()
         self.model = model
         self.model_tool = model_tool
         self.model_qa = model_qa
@@ -42,23 +91,79 @@ class CoderAgent:
         self.iterations = iterations
         self.max_retries = max_retries
         self.retry_delay = retry_delay
-        self.search = SearchManager(self.model_qa)
+        self.stage_workers = stage_workers
+        self.metrics = metrics or get_recorder()
+        self.candidates = candidates
+        self.candidate_temperature_step = candidate_temperature_step
+        self.workspace_dir = workspace_dir
+        self.use_tmpfs = use_tmpfs
+        # Local BM25 index of scraped references and tested code from earlier queries
+        self.index = ReferenceIndex(index_path) if use_index else None
+        self.web_references = web_references
+        self.reference_chars = reference_chars
+        self.search = SearchManager(self.model_qa, verbose=self.verbose, index=self.index)
+        # Earlier queries, so paraphrases can start from their plan (and,
+        # above code_reuse_threshold, from their tested code); None disables
+        self.plan_reuse_threshold = plan_reuse_threshold
+        self.code_reuse_threshold = code_reuse_threshold
+        self.query_memory = QueryMemory(query_memory_path, threshold=plan_reuse_threshold) if plan_reuse_threshold is not None else None
+        self.client = LLMClient(
+            headers=self.headers,
+            pool_maxsize=pool_maxsize,
+            max_concurrency=max_concurrency,
+            endpoint_limits=endpoint_limits
+        )
+        self.cache = ResponseCache(cache_path, bypass=cache_bypass) if use_cache else None
+        # Warm interpreters for Python test runs; 0 falls back to a subprocess per attempt.
+        # Runs are killed after test_timeout seconds or past their rlimits.
+        self.test_pool = TestRunnerPool(size=test_workers, timeout=test_timeout, preload=test_preload, limits=test_limits, shards=test_shards) if test_workers else None
+        # Also applied when tests run without the pool
+        self.test_timeout = test_timeout
+        self.test_limits = test_limits
+        # Reusable environments for the generated code's dependencies
+        self.deps = DependencyManager(dependency_dir, wheel_dir, index_url, find_links, offline_dependencies)
+        # Compiled programs keyed by source, compiler and flags
+        self.builds = BuildCache(build_dir, flags=build_flags)
+        # Optimized Python is timed against the code it replaces and only
+        # kept when it still passes and is faster in every paired run, by at
+        # least min_speedup at the median. On identical code the median
+        # ratio of five pairs spreads over roughly 0.8-1.1, so the default
+        # sits well clear of it.
+        self.profiler = Profiler(self.test_pool, self.deps, repeat=benchmark_repeat, timeout=test_timeout, limits=test_limits, workspace_dir=workspace_dir, use_tmpfs=use_tmpfs) if measure_optimization else None
+        self.optimization_rounds = optimization_rounds
+        self.min_speedup = min_speedup
+        # Per-run journals of finished stages, so an interrupted run can be
+        # resumed by its run id; None disables
+        self.journal_dir = journal_dir
+        if journal_dir:
+            prune_journals(journal_dir, max_journals)
 
         # Set up logging
         self.logger = setup_logging(verbose=self.verbose)
 
     def make_request(self, data):
+        response, _ = self.send_request(data)
+        return response
+
+    def send_request(self, data):
+        # Returns the (possibly cached) streamed response and the number of retries it took
+        payload = self.generation.build_payload(data)
+
+        key = None
+        if self.cache is not None:
+            key = cache_key(payload['model'], payload['prompt'], payload['options'], payload.get('context'))
+            cached = self.cache.replay(key)
+            if cached is not None:
+                self.logger.debug(f"Response cache hit for {key[:12]}")
+                return cached, 0
+
         retries = 0
         while retries < self.max_retries:
             try:
-                payload = {
-                    "model": self.model,
-                    "prompt": data['prompt'],
-                    "stream": True 
-                }
-                response = requests.post(self.url, headers=self.headers, json=payload, stream=True, timeout=180)
-                response.raise_for_status()
-                return response
+                response = self.client.post(self.url, payload)
+                if key is not None:
+                    return self.cache.record(key, payload['model'], response), retries
+                return response, retries
             except requests.exceptions.RequestException as e:
                 self.logger.error(f"Request failed: {e}")
                 self.logger.error(f"Request URL: {self.url}")
@@ -67,7 +172,7 @@ class CoderAgent:
                 retries += 1
                 time.sleep(self.retry_delay)
         self.logger.error("Max retries exceeded. Aborting request.")
-        return None
+        return None, retries
 
     def parse_ndjson(self, response_text):
         responses = []
@@ -83,156 +188,337 @@ class CoderAgent:
         return ''.join(responses)
 
     def extract_code(self, content):
-        self.logger.debug("Starting code extraction")
         code_block = []
         in_code_block = False
         for line in content.splitlines():
-            self.logger.debug(f"Processing line: {repr(line)}")
             if line.strip().startswith("```"):
                 in_code_block = not in_code_block
-                self.logger.debug(f"Code block {'started' if in_code_block else 'ended'}")
                 continue
             if in_code_block:
                 code_block.append(line)
-                self.logger.debug(f"Added line to code block: {repr(line)}")
-        
+
         extracted_code = "\n".join(code_block)
-        self.logger.debug(f"Final extracted code:\n{repr(extracted_code)}")
+        self.logger.debug("Extracted %d code lines from %d chars of content:\n%s", len(code_block), len(content), payload(extracted_code, use_repr=True))
         return extracted_code
 
+    def run_generation(self, data, stop_at_code_fence=False, cancel_event=None):
+        started = time.perf_counter()
+        prefill_saved = data.get("prefill_saved")
+        if prefill_saved is None:
+            prefill_saved = self.shared_prefix_tokens(data["model"], data["prompt"])
+        response, retries = self.send_request(data)
+        if response is None:
+            self.metrics.record_generation(data.get("stage"), data["model"], time.perf_counter() - started, retries=retries, failed=True)
+            return None
+
+        stats = {}
+        content, code = self.read_response(response, stop_at_code_fence, cancel_event, stats)
+        wall_time = time.perf_counter() - started
+
+        # Ollama reports token counts in the final chunk; a stream we cut short
+        # has none, so fall back to one token per streamed chunk.
+        final_chunk = stats.get("final_chunk") or {}
+        cache_hit = getattr(response, "from_cache", False)
+        contexts = stage_contexts.get()
+        if data.get("remember_context") and contexts is not None and final_chunk.get("context"):
+            contexts[data["stage"]] = {"model": data["model"], "context": final_chunk["context"], "text": content}
+        completion_tokens = final_chunk.get("eval_count", stats["chunks"])
+        # Likewise the prompt: the stages that stop at the closing fence never
+        # get the server's count, so theirs is estimated with the tokenizer
+        prompt_tokens = final_chunk.get("prompt_eval_count")
+        prompt_tokens_estimated = prompt_tokens is None
+        if prompt_tokens_estimated:
+            prompt_tokens = self.prompts.count(data["prompt"])
+        eval_duration = final_chunk.get("eval_duration")
+        if cache_hit:
+            tokens_per_sec = None
+        elif eval_duration:
+            tokens_per_sec = completion_tokens / (eval_duration / 1e9)
+        else:
+            tokens_per_sec = completion_tokens / wall_time if wall_time else None
+        ttft = stats["first_token_at"] - started if "first_token_at" in stats else None
+        self.metrics.record_generation(
+            data.get("stage"), data["model"], wall_time,
+            ttft=ttft,
+            prompt_tokens=prompt_tokens,
+            prompt_tokens_estimated=prompt_tokens_estimated,
+            completion_tokens=completion_tokens,
+            tokens_per_sec=tokens_per_sec,
+            retries=retries,
+            cache_hit=cache_hit,
+            stopped_early=stats.get("stopped_early", False),
+            prefill_saved=prefill_saved
+        )
+        return content, code
+
+    def shared_prefix_tokens(self, model, prompt):
+        # Estimate of what a prefix-caching server can reuse from the previous
+        # prompt this query sent to the same model; prompts of concurrent
+        # queries are interleaved on the server, so only the query's own
+        # count, and only when the server is asked to keep context
+        contexts = stage_contexts.get()
+        if not self.reuse_context or contexts is None:
+            return 0
+        with self._last_prompts_lock:
+            last_prompts = contexts.setdefault("last_prompts", {})
+            previous = last_prompts.get(model)
+            last_prompts[model] = prompt
+        if not previous:
+            return 0
+        return self.prompts.count(os.path.commonprefix([previous, prompt]))
+
+    def chained_context(self, model, plan):
+        # The planning request's context, and what the plan has gained since
+        # (retry feedback), when the request can continue from it
+        contexts = stage_contexts.get()
+        if not self.reuse_context or not contexts:
+            return None
+        entry = contexts.get("plan")
+        if entry is None or entry["model"] != model or not plan.startswith(entry["text"]):
+            return None
+        return entry, plan[len(entry["text"]):]
+
+    def read_response(self, response, stop_at_code_fence=False, cancel_event=None, stats=None):
+        if self.verbose:
+            self.logger.info("Response Status Code: %s", response.status_code)
+            self.logger.info("Response Headers:\n%s", response.headers)
+
+        if stats is None:
+            stats = {}
+        content, code, stats["final_chunk"] = consume_stream(response, stop_at_code_fence=stop_at_code_fence, cancel_event=cancel_event, stats=stats)
+
+        if self.verbose:
+            self.logger.info("Response Content (first 500 chars):\n%s", payload(content, limit=500))
+        return content, code
+
     def generate_plan(self, query, languages):
-        system_prompt = self.planning_agent_prompt.format(query=query, languages=",".join(languages))
+        references = self.local_references(query, languages[0] if languages else None)
+        if references:
+            query = f"{query}\n\nRelevant code and references from earlier work:\n{references}"
+        system_prompt = self.prompts.build("plan", self.planning_agent_prompt, query=query, languages=",".join(languages))
 
         data = {
+            "stage": "plan",
             "model": self.model,
             "prompt": system_prompt,
-            "temperature": self.temperature,
-            "max_tokens": self.max_tokens,
-            "stop": None
+            "temperature": self.generation.value("plan", "temperature", self.temperature),
+            "max_tokens": self.generation.budget("plan"),
+            "stop": self.generation.value("plan", "stop"),
+            "remember_context": self.reuse_context
         }
 
-        response = self.make_request(data)
-        if response is None:
+        generation = self.run_generation(data)
+        if generation is None:
             return None
 
+        plan, _ = generation
         if self.verbose:
-            self.logger.info(f"Response Status Code: {response.status_code}")
-            self.logger.info(f"Response Headers:\n{response.headers}")
-            self.logger.info(f"Raw Response Content (first 500 chars):\n{response.text[:500]}")
-
-        plan = self.parse_ndjson(response.text)
-        if self.verbose:
-            self.logger.info(f"Generated Plan:\n{plan}")
+            self.logger.info("Generated Plan:\n%s", payload(plan))
         return plan
 
-    def generate_code(self, plan, languages):
-        system_prompt = self.integration_agent_prompt.format(plan=plan, languages=",".join(languages))
+    def generate_code(self, plan, languages, options=None, cancel_event=None):
+        chained = self.chained_context(self.model_tool, plan)
+        if chained:
+            entry, feedback = chained
+            system_prompt = self.prompts.build("code", coding_integration_followup_prompt, used=len(entry["context"]), feedback=feedback, languages=",".join(languages))
+        else:
+            system_prompt = self.prompts.build("code", self.integration_agent_prompt, plan=plan, languages=",".join(languages))
 
         data = {
+            "stage": "code",
             "model": self.model_tool,
             "prompt": system_prompt,
-            "temperature": self.temperature,
-            "max_tokens": self.max_tokens,
-            "stop": None
+            "temperature": self.generation.value("code", "temperature", self.temperature),
+            "max_tokens": self.generation.budget("code"),
+            "stop": self.generation.value("code", "stop")
         }
-
-        response = self.make_request(data)
-        if response is None:
+        if chained:
+            data["context"] = entry["context"]
+            data["prefill_saved"] = self.prompts.count(entry["text"])
+        if options:
+            data.update(options)
+
+        generation = self.run_generation(data, stop_at_code_fence=True, cancel_event=cancel_event)
+        if generation is None:
             return None
 
+        _, code = generation
+        if cancel_event is not None and cancel_event.is_set():
+            return None
         if self.verbose:
-            self.logger.info(f"Response Status Code: {response.status_code}")
-            self.logger.info(f"Response Headers:\n{response.headers}")
-            self.logger.info(f"Raw Response Content (first 500 chars):\n{response.text[:500]}")
-        
-        content = self.parse_ndjson(response.text)
-        code = self.extract_code(content)
-        if self.verbose:
-            self.logger.info(f"Generated Code:\n{code}")
+            self.logger.info("Generated Code:\n%s", payload(code))
         return code
 
     def generate_tests(self, plan, code, languages):
-        system_prompt = self.testing_agent_prompt.format(plan=plan, code=code, languages=",".join(languages))
+        chained = self.chained_context(self.model_tool, plan)
+        if chained:
+            entry, feedback = chained
+            system_prompt = self.prompts.build("tests", coding_testing_followup_prompt, used=len(entry["context"]), feedback=feedback, code=code, languages=",".join(languages))
+        else:
+            system_prompt = self.prompts.build("tests", self.testing_agent_prompt, plan=plan, code=code, languages=",".join(languages))
 
         data = {
+            "stage": "tests",
             "model": self.model_tool,
             "prompt": system_prompt,
-            "temperature": self.temperature,
-            "max_tokens": self.max_tokens,
-            "stop": None
+            "temperature": self.generation.value("tests", "temperature", self.temperature),
+            "max_tokens": self.generation.budget("tests"),
+            "stop": self.generation.value("tests", "stop")
         }
+        if chained:
+            data["context"] = entry["context"]
+            data["prefill_saved"] = self.prompts.count(entry["text"])
 
-        response = self.make_request(data)
-        if response is None:
+        generation = self.run_generation(data, stop_at_code_fence=True)
+        if generation is None:
             return None
 
+        _, tests = generation
         if self.verbose:
-            self.logger.info(f"Response Status Code: {response.status_code}")
-            self.logger.info(f"Response Headers:\n{response.headers}")
-            self.logger.info(f"Raw Response Content (first 500 chars):\n{response.text[:500]}")
-        
-        content = self.parse_ndjson(response.text)
-        tests = self.extract_code(content)
-        if self.verbose:
-            self.logger.info(f"Generated Tests:\n{tests}")
+            self.logger.info("Generated Tests:\n%s", payload(tests))
         return tests
 
     def generate_documentation(self, code, languages):
-        system_prompt = self.documentation_agent_prompt.format(code=code, languages=",".join(languages))
+        system_prompt = self.prompts.build("documentation", self.documentation_agent_prompt, code=code, languages=",".join(languages))
 
         data = {
+            "stage": "documentation",
             "model": self.model_tool,
             "prompt": system_prompt,
-            "temperature": self.temperature,
-            "max_tokens": self.max_tokens,
-            "stop": None
+            "temperature": self.generation.value("documentation", "temperature", self.temperature),
+            "max_tokens": self.generation.budget("documentation"),
+            "stop": self.generation.value("documentation", "stop")
         }
 
-        response = self.make_request(data)
-        if response is None:
+        generation = self.run_generation(data, stop_at_code_fence=True)
+        if generation is None:
             return None
 
+        _, documented_code = generation
         if self.verbose:
-            self.logger.info(f"Response Status Code: {response.status_code}")
-            self.logger.info(f"Response Headers:\n{response.headers}")
-            self.logger.info(f"Raw Response Content (first 500 chars):\n{response.text[:500]}")
-        
-        content = self.parse_ndjson(response.text)
-        documented_code = self.extract_code(content)
-        if self.verbose:
-            self.logger.info(f"Generated Documentation:\n{documented_code}")
+            self.logger.info("Generated Documentation:\n%s", payload(documented_code))
         return documented_code
 
-    def optimize_code(self, code, languages):
-        system_prompt = self.optimization_agent_prompt.format(code=code, languages=",".join(languages))
+    def optimize_code(self, code, languages, measurements=None):
+        if measurements:
+            system_prompt = self.prompts.build("optimize", coding_optimization_followup_prompt, code=code, measurements=measurements, languages=",".join(languages))
+        else:
+            system_prompt = self.prompts.build("optimize", self.optimization_agent_prompt, code=code, languages=",".join(languages))
 
         data = {
+            "stage": "optimize",
             "model": self.model_tool,
             "prompt": system_prompt,
-            "temperature": self.temperature,
-            "max_tokens": self.max_tokens,
-            "stop": None
+            "temperature": self.generation.value("optimize", "temperature", self.temperature),
+            "max_tokens": self.generation.budget("optimize"),
+            "stop": self.generation.value("optimize", "stop")
         }
 
-        response = self.make_request(data)
-        if response is None:
+        generation = self.run_generation(data, stop_at_code_fence=True)
+        if generation is None:
             return None
 
+        _, optimized_code = generation
         if self.verbose:
-            self.logger.info(f"Response Status Code: {response.status_code}")
-            self.logger.info(f"Response Headers:\n{response.headers}")
-            self.logger.info(f"Raw Response Content (first 500 chars):\n{response.text[:500]}")
-        
-        content = self.parse_ndjson(response.text)
-        optimized_code = self.extract_code(content)
-        if self.verbose:
-            self.logger.info(f"Optimized Code:\n{optimized_code}")
+            self.logger.info("Optimized Code:\n%s", payload(optimized_code))
         return optimized_code
 
-    def fetch_code_reference(self, query):
+    def measured_optimize(self, code, tests, languages, primary_language, validated_code=None):
+        # Returns {"code": ..., "report": ...}, or None when the model could
+        # not be reached. Each round's rewrite is timed against the best
+        # version so far, pass for pass in one worker, and replaces it only if
+        # it passes the tests and is faster in every pair by at least
+        # min_speedup; the next round is shown those numbers. validated_code
+        # is what to fall back to when `code` itself fails the tests.
+        if self.profiler is None or primary_language != "python" or not tests:
+            optimized_code = self.optimize_code(code, languages)
+            if optimized_code is None:
+                return None
+            if not optimized_code:
+                self.logger.warning("The optimization reply contained no code; keeping the code as it was")
+                return {"code": code, "report": None}
+            return {"code": optimized_code, "report": None}
+
+        best_code = code
+        report = {"baseline": None, "rounds": [], "speedup": 1.0}
+        measurements = None
+        for round_number in range(self.optimization_rounds):
+            candidate_code = self.optimize_code(best_code, languages, measurements)
+            if candidate_code is None:
+                if round_number == 0:
+                    return None
+                break
+            if not candidate_code:
+                self.logger.warning(f"Optimization round {round_number + 1} replied without code")
+                continue
+            comparison = self.profiler.compare(best_code, candidate_code, tests)
+            if not comparison.baseline.passed:
+                # Nothing to time the rewrite against; it is only used if it passes
+                self.logger.warning(f"Optimizing without measurements: the code before optimizing {comparison.baseline.describe()}")
+                if comparison.candidate.passed:
+                    return {"code": candidate_code, "report": None}
+                self.logger.warning(f"The optimized code {comparison.candidate.describe()}; keeping the validated code")
+                return {"code": validated_code or best_code, "report": None}
+            if report["baseline"] is None:
+                report["baseline"] = comparison.baseline.to_dict()
+            kept = comparison.faster(self.min_speedup)
+            speedup = comparison.speedup
+            report["rounds"].append({**comparison.candidate.to_dict(), **comparison.to_dict(), "kept": kept})
+            self.logger.info(
+                f"Optimization round {round_number + 1}: {'kept' if kept else 'discarded'}, "
+                f"{f'{speedup:.2f}x, faster in {comparison.wins:.0%} of paired runs' if speedup is not None else 'not comparable'}; {comparison.candidate.describe()}"
+            )
+            if kept:
+                verdict = "It was kept."
+            elif not comparison.candidate.passed:
+                verdict = "It was discarded because it fails the tests."
+            else:
+                verdict = f"It was discarded because it was not consistently at least {self.min_speedup:.0%} faster."
+            measurements = f"Before the last rewrite: {comparison.baseline.describe()}.\nThe last rewrite: {comparison.candidate.describe()}. {verdict}"
+            if kept:
+                best_code = candidate_code
+                report["speedup"] *= speedup
+
+        report["kept"] = "optimized" if best_code is not code else "original"
+        return {"code": best_code, "report": report}
+
+    def find_similar_query(self, query, languages):
+        if self.query_memory is None:
+            return None
+        started = time.perf_counter()
+        match = self.query_memory.lookup(query, languages)
+        self.metrics.record_timing(
+            "query_lookup", time.perf_counter() - started,
+            hit=match is not None,
+            similarity=round(match["similarity"], 3) if match is not None else None
+        )
+        if match is not None:
+            self.logger.info(f"Query is {match['similarity']:.0%} similar to an earlier one: {match['query']}")
+        return match
+
+    def reuse_validated_code(self, match, primary_language, workspace):
+        # The stored code passed its tests when it was generated; run them
+        # again here before skipping generation altogether
+        test_results = run_tests(match["code"], match["tests"], primary_language, self.verbose, workspace, self.test_pool, deps=self.deps, timeout=self.test_timeout, limits=self.test_limits)
+        if test_results is None or not test_results.passed:
+            self.logger.info("Reused code no longer passes its tests; generating new code")
+            return None
+        return {"plan": match["plan"], "code": match["code"], "tests": match["tests"], "reused": True}
+
+    def fetch_code_reference(self, query, languages=None):
         self.logger.info(f"Fetching code reference for query: {query}")
-        # Replace with actual logic to fetch code references
-        return "Example code reference"
+        language = languages[0] if languages else None
+        references = self.local_references(query, language)
+        if not references and self.web_references:
+            # Scraped pages are indexed by the search manager as they arrive
+            self.search.fetch_code_reference(query)
+            references = self.local_references(query, language)
+        return references or "No code reference found."
+
+    def local_references(self, query, language=None):
+        if self.index is None:
+            return ""
+        return self.index.snippets(query, max_chars=self.reference_chars, language=language)
 
     def collect_feedback(self, code, tests, primary_language):
         print("Generated Code:")
@@ -243,140 +529,317 @@ class CoderAgent:
         return feedback
 
     def refine_code_with_feedback(self, code, feedback, languages):
-        system_prompt = feedback_prompt.format(code=code, feedback=feedback, languages=",".join(languages))
+        system_prompt = self.prompts.build("feedback", feedback_prompt, code=code, feedback=feedback, languages=",".join(languages))
 
         data = {
+            "stage": "feedback",
             "model": self.model_tool,
             "prompt": system_prompt,
-            "temperature": self.temperature,
-            "max_tokens": self.max_tokens,
-            "stop": None
+            "temperature": self.generation.value("feedback", "temperature", self.temperature),
+            "max_tokens": self.generation.budget("feedback"),
+            "stop": self.generation.value("feedback", "stop")
         }
 
-        response = self.make_request(data)
-        if response is None:
+        generation = self.run_generation(data, stop_at_code_fence=True)
+        if generation is None:
             return None
 
-        content = self.parse_ndjson(response.text)
-        refined_code = self.extract_code(content)
+        _, refined_code = generation
         return refined_code
 
-    def execute(self):
-        language_extensions = {
-            'python': 'py',
-            'javascript': 'js',
-            'html': 'html',
-            'css': 'css',
-            'java': 'java',
-            'c++': 'cpp',
-            'c#': 'cs',
-            'ruby': 'rb',
-            'go': 'go',
-            'php': 'php',
-        }
-
-        for i in range(self.iterations):
-            query = input("Enter your coding query: ")
-            
-            detected_language = detect_language(query)
-            languages = [detected_language] if detected_language else input("Enter the programming languages (comma-separated, e.g., python,javascript,html): ").strip().lower().split(',')
-            primary_language = languages[0]
-
-            # Step 1: Generate Plan
-            plan = self.generate_plan(query, languages)
-            if plan is None:
-                self.logger.error("Failed to generate plan. Aborting execution.")
-                continue
-
-            max_attempts = 5
-            for attempt in range(max_attempts):
-                try:
+    def generate_validated_code(self, plan, languages, primary_language, workspace):
+        max_attempts = 5
+        tests = None
+        failing = []
+        # Errors from earlier attempts, deduplicated and compacted so retry
+        # prompts stay roughly the same size however long the chain gets
+        feedback = FeedbackLog()
+        for attempt in range(max_attempts):
+            attempt_plan = self.prompts.with_feedback(plan, feedback)
+            try:
+                if self.candidates > 1:
+                    code, tests, test_results = self.run_speculative_round(attempt_plan, languages, primary_language, workspace, tests)
+                else:
                     # Step 2: Generate Code based on Plan
-                    code = self.generate_code(plan, languages)
-                    self.logger.debug(f"Code after generation (Attempt {attempt + 1}):\n{repr(code)}")
+                    code = self.generate_code(attempt_plan, languages)
+                    self.logger.debug("Code after generation (Attempt %d):\n%s", attempt + 1, payload(code, use_repr=True))
                     if code is None:
                         raise ValueError("Failed to generate code.")
 
-                    # Step 3: Generate Tests for the Code
-                    tests = self.generate_tests(plan, code, languages)
+                    # Step 3: Generate Tests for the Code. They are kept across
+                    # repair attempts so the failing ones can be re-run first.
                     if tests is None:
-                        raise ValueError("Failed to generate tests.")
-
-                    # Save the code to a temporary file for testing
-                    temp_code_filepath = "temp_generated_code.py"
-                    self.logger.debug(f"Code before saving (Attempt {attempt + 1}):\n{repr(code)}")
-                    save_code(code, temp_code_filepath, self.verbose)
-
-                    # Run the tests
-                    test_results = run_tests(code, tests, primary_language, self.verbose)
-
-                    if test_results == 0:
-                        self.logger.info(f"All tests passed on attempt {attempt + 1}")
-                        break
-                    else:
-                        raise ValueError(f"Tests failed: {test_results}")
-
-                except (ValueError, SyntaxError) as e:
-                    self.logger.warning(f"Error on attempt {attempt + 1}: {str(e)}")
-                    if attempt < max_attempts - 1:
-                        self.logger.info("Refining code and retrying...")
-                        plan += f"\nAdditional feedback: {str(e)}"
-                    else:
-                        self.logger.error(f"Failed to generate correct code after {max_attempts} attempts.")
-                        break
+                        tests = self.generate_tests(attempt_plan, code, languages)
+                        failing = []
+                        if tests is None:
+                            raise ValueError("Failed to generate tests.")
+
+                    self.logger.debug("Code before testing (Attempt %d):\n%s", attempt + 1, payload(code, use_repr=True))
+
+                    test_results = self.test_candidate(code, tests, primary_language, workspace, failing)
+
+                if test_results is not None:
+                    # Every candidate and how it fared goes into the run's journal
+                    record_event(
+                        "attempt", attempt=attempt + 1, code=code, tests=tests, passed=test_results.passed,
+                        counts=test_results.counts(), failure=None if test_results.passed else test_results.failure_summary()
+                    )
+                if test_results is not None and test_results.passed:
+                    self.logger.info(f"All tests passed on attempt {attempt + 1}")
+                    return {"plan": plan, "code": code, "tests": tests}
+                if test_results is None:
+                    raise ValueError(f"Tests failed: {test_results}")
+
+                if test_results.tests_broken:
+                    # The tests themselves may be broken; regenerate them next time
+                    tests = None
+                failing = test_results.failing_names
+                raise ValueError(f"Tests failed:\n{test_results.failure_summary()}")
+
+            except (ValueError, SyntaxError) as e:
+                self.logger.warning(f"Error on attempt {attempt + 1}: {str(e)}")
+                if attempt < max_attempts - 1:
+                    self.logger.info("Refining code and retrying...")
+                    feedback.add(str(e))
+                else:
+                    self.logger.error(f"Failed to generate correct code after {max_attempts} attempts.")
+        return None
 
+    def test_candidate(self, code, tests, primary_language, workspace, failing=()):
+        # Run the tests, previously failing ones first
+        if failing:
+            test_results = run_tests(code, tests, primary_language, self.verbose, workspace, self.test_pool, only=list(failing), deps=self.deps, timeout=self.test_timeout, limits=self.test_limits)
+            if test_results is None or not test_results.passed:
+                return test_results
+            self.logger.info("Previously failing tests pass; running the full suite")
+        return run_tests(code, tests, primary_language, self.verbose, workspace, self.test_pool, deps=self.deps, timeout=self.test_timeout, limits=self.test_limits)
+
+    def candidate_options(self, index):
+        # Candidate 0 keeps the deterministic settings; the others spread out
+        temperature = self.temperature if index == 0 else min(1.0, self.temperature + self.candidate_temperature_step * index)
+        return {"seed": index, "temperature": temperature}
+
+    def run_speculative_round(self, plan, languages, primary_language, workspace, tests):
+        # Generates self.candidates code candidates at once and tests each one
+        # as soon as it arrives. The first candidate that passes wins and the
+        # generations still streaming are cancelled.
+        cancel_event = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=self.candidates * 2)
+        candidates = {}
+        generations = set()
+        for index in range(self.candidates):
+            future = executor.submit(contextvars.copy_context().run, self.generate_code, plan, languages, self.candidate_options(index), cancel_event)
+            generations.add(future)
+        pending = set(generations)
+        first_failure = None
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in generations:
+                        code = future.result()
+                        if not code:
+                            continue
+                        if tests is None:
+                            # Tests are generated once, from the first candidate to arrive
+                            tests = self.generate_tests(plan, code, languages)
+                            if tests is None:
+                                raise ValueError("Failed to generate tests.")
+                        test_future = executor.submit(
+                            contextvars.copy_context().run, run_tests, code, tests, primary_language, self.verbose, Workspace(workspace.root), self.test_pool,
+                            deps=self.deps, timeout=self.test_timeout, limits=self.test_limits
+                        )
+                        candidates[test_future] = code
+                        pending.add(test_future)
+                        continue
+
+                    test_results = future.result()
+                    code = candidates[future]
+                    if test_results is not None and test_results.passed:
+                        self.logger.info(f"Candidate passed after {len(candidates)} of {self.candidates} were tested; cancelling the rest")
+                        return code, tests, test_results
+                    if first_failure is None:
+                        first_failure = (code, tests, test_results)
+        finally:
+            cancel_event.set()
+            # Streaming generations stop at the event; test runs already going
+            # are waited for (they are bounded by the test timeout), so none
+            # is left writing into a workspace the caller is about to remove
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        if first_failure is None:
+            raise ValueError("Failed to generate code.")
+        return first_failure
+
+    def apply_feedback(self, validated, languages, primary_language, feedback=None, interactive=True):
+        # Collect user feedback and refine code
+        code = validated["code"]
+        if feedback is None and interactive:
+            feedback = self.collect_feedback(code, validated["tests"], primary_language)
+        if feedback:
+            refined_code = self.refine_code_with_feedback(code, feedback, languages)
+            if refined_code:
+                return {"code": refined_code, "refined": True}
+        return {"code": code, "refined": False}
+
+    def regenerate_tests(self, validated, feedback, languages):
+        if not feedback["refined"]:
+            return validated["tests"]
+        return self.generate_tests(validated["plan"], feedback["code"], languages)
+
+    def process_query(self, query, languages=None, feedback=None, filename=None, interactive=False, run_code=True, run_id=None):
+        # With the run id of an earlier run, its journaled stages are not run again
+        if query is None and not (self.journal_dir and run_id and os.path.exists(RunJournal.path_for(run_id, self.journal_dir))):
+            raise ValueError(f"No journal for run {run_id} to resume")
+        journal = RunJournal(run_id, self.journal_dir) if self.journal_dir else None
+        if journal is not None and journal.resumed:
+            self.logger.info(f"Resuming run {journal.run_id}; completed stages: {', '.join(journal.stages) or 'none'}")
+            query = journal.meta["query"]
+            languages = journal.meta.get("languages") or languages
+            feedback = journal.meta.get("feedback", feedback)
+            filename = journal.meta.get("filename") or filename
+        query_id = uuid.uuid4().hex[:12]
+        with query_scope(query_id):
+            token = stage_contexts.set({})
+            journal_token = current_journal.set(journal)
+            try:
+                result = self._process_query(query, languages, feedback, filename, interactive, run_code, journal)
+            finally:
+                current_journal.reset(journal_token)
+                stage_contexts.reset(token)
+                if journal is not None:
+                    journal.close()
+        result["query_id"] = query_id
+        result["run_id"] = journal.run_id if journal is not None else None
+        result["metrics"] = self.metrics.summary(query_id)
+        self.logger.info(self.metrics.format_summary(query_id))
+        return result
+
+    def _process_query(self, query, languages, feedback, filename, interactive, run_code, journal=None):
+        started = time.perf_counter()
+        if not languages:
+            detected_language = detect_language(query)
+            if detected_language:
+                languages = [detected_language]
+            elif interactive:
+                languages = input("Enter the programming languages (comma-separated, e.g., python,javascript,html): ").strip().lower().split(',')
             else:
-                self.logger.error("All attempts to generate valid code failed. Aborting execution.")
-                continue
-
-            # If we've reached here, we have valid code that passed tests
-            # Collect user feedback and refine code
-            feedback = self.collect_feedback(code, tests, primary_language)
-            if feedback:
-                refined_code = self.refine_code_with_feedback(code, feedback, languages)
-                if refined_code:
-                    code = refined_code
-                    tests = self.generate_tests(plan, code, languages)
-
-            # Step 4: Document the Code
-            documented_code = self.generate_documentation(code, languages)
-            if documented_code is None:
-                self.logger.error("Failed to generate documentation. Aborting execution.")
-                continue
-
-            # Step 5: Optimize the Code
-            optimized_code = self.optimize_code(documented_code, languages)
-            if optimized_code is None:
-                self.logger.error("Failed to optimize code. Aborting execution.")
+                languages = ['python']
+        primary_language = languages[0]
+        result = {"query": query, "languages": languages, "status": "failed", "reused": None}
+        restored = dict(journal.stages) if journal is not None else {}
+        if journal is not None and not journal.resumed:
+            journal.record_meta(query=query, languages=languages, feedback=feedback, filename=filename)
+
+        match = self.find_similar_query(query, languages)
+        reuse_code = match is not None and self.code_reuse_threshold is not None and match["similarity"] >= self.code_reuse_threshold and match["code"]
+        if match is not None:
+            result["reused"] = "code" if reuse_code else "plan"
+            result["similar_query"] = match["query"]
+
+        # Every run writes its generated files to a private directory
+        workspace = Workspace(self.workspace_dir, use_tmpfs=self.use_tmpfs)
+        graph = StageGraph(max_workers=self.stage_workers, on_complete=journal.record_stage if journal is not None else None)
+        graph.add("plan", lambda results: match["plan"] if match is not None else self.generate_plan(query, languages))
+        graph.add("reference", lambda results: self.fetch_code_reference(query, languages))
+        graph.add("validate", lambda results: (reuse_code and self.reuse_validated_code(match, primary_language, workspace)) or self.generate_validated_code(results["plan"], languages, primary_language, workspace), depends_on=("plan",))
+        graph.add("feedback", lambda results: self.apply_feedback(results["validate"], languages, primary_language, feedback, interactive), depends_on=("validate",))
+        # Test regeneration and documentation only need the final code, so they run side by side
+        graph.add("tests", lambda results: self.regenerate_tests(results["validate"], results["feedback"], languages), depends_on=("feedback",))
+        graph.add("documentation", lambda results: self.generate_documentation(results["feedback"]["code"], languages), depends_on=("feedback",))
+        # Optimization is measured with the final tests when there are any, so it waits for them
+        graph.add("optimize", lambda results: self.measured_optimize(results["documentation"], results.get("tests"), languages, primary_language, results["feedback"]["code"]), depends_on=("documentation",), after=("tests",))
+        try:
+            results = graph.run(completed=restored)
+        finally:
+            workspace.cleanup()
+        if "validate" in results and "validate" not in restored:
+            validated = results["validate"]
+            if self.index is not None:
+                # Code that passed its tests becomes a reference for later queries
+                self.index.add(validated["code"], "code", query=query, languages=languages)
+            if self.query_memory is not None and not validated.get("reused"):
+                self.query_memory.remember(query, languages, validated["plan"], validated["code"], validated["tests"])
+        self.logger.info(graph.report())
+        if self.cache is not None:
+            self.logger.info(f"Response cache: {self.cache.stats()}")
+        if self.query_memory is not None:
+            self.logger.info(f"Similar query reuse: {self.query_memory.stats()}")
+        result["stages"] = {name: round(stage.duration, 3) for name, stage in graph.stages.items() if stage.start is not None}
+        result["reference"] = results.get("reference")
+
+        failures = [
+            ("plan", "Failed to generate plan. Aborting execution."),
+            ("validate", "All attempts to generate valid code failed. Aborting execution."),
+            ("documentation", "Failed to generate documentation. Aborting execution."),
+            ("optimize", "Failed to optimize code. Aborting execution."),
+        ]
+        for stage_name, message in failures:
+            if stage_name not in results:
+                self.logger.error(message)
+                result["error"] = message
+                result["elapsed"] = round(time.perf_counter() - started, 3)
+                return result
+
+        optimized_code = results["optimize"]["code"]
+        result["optimization"] = results["optimize"]["report"]
+        result.update({
+            "plan": results["validate"]["plan"],
+            "code": results["feedback"]["code"],
+            "tests": results.get("tests"),
+            "final_code": optimized_code,
+        })
+
+        # Save the final version of the code
+        if filename is None:
+            filename = input("Enter the filename (without extension) for the final code: ") if interactive else "generated_code"
+            if journal is not None:
+                journal.record_meta(filename=filename)
+        extension = LANGUAGE_EXTENSIONS.get(primary_language, 'txt')
+        filepath = f"{filename}.{extension}"
+        save_code(optimized_code, filepath, self.verbose)
+        result["filepath"] = filepath
+
+        # Execute the Generated Code
+        if run_code:
+            execute_code(filepath, primary_language, self.verbose, self.builds)
+
+        result["status"] = "ok"
+        result["elapsed"] = round(time.perf_counter() - started, 3)
+        return result
+
+    def close(self):
+        if self.test_pool is not None:
+            self.test_pool.close()
+        self.client.close()
+        self.search.close()
+        if self.index is not None:
+            self.index.close()
+        if self.query_memory is not None:
+            self.query_memory.close()
+
+    def execute(self, resume=None):
+        for i in range(self.iterations):
+            if resume is not None and i == 0:
+                result = self.process_query(None, interactive=True, run_id=resume)
+            else:
+                query = input("Enter your coding query: ")
+                run_id = new_run_id() if self.journal_dir else None
+                if run_id is not None:
+                    print(colored(f"Run {run_id} (continue it with --resume {run_id} if interrupted)", 'cyan'))
+                result = self.process_query(query, interactive=True, run_id=run_id)
+            if result["status"] != "ok":
                 continue
 
-            # Save the final version of the code
-            filename = input("Enter the filename (without extension) for the final code: ")
-            extension = language_extensions.get(primary_language, 'txt')
-            filepath = f"{filename}.{extension}"
-            save_code(optimized_code, filepath, self.verbose)
-
-            # Execute the Generated Code
-            execute_code(filepath, primary_language, self.verbose)
-
-            # Clean up temporary files
-            temp_files = [temp_code_filepath, "test_generated_code.py"]
-            for temp_file in temp_files:
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
-
-            # Fetch a code reference
-            reference_query = query
-            reference = self.fetch_code_reference(reference_query)
-            print(reference)
-
-
-
-
-    
+            # The code reference was fetched concurrently with the other stages
+            print(result["reference"])
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Interactive coding agent.")
+    parser.add_argument("--resume", metavar="RUN_ID", default=None, help="continue an interrupted run from its first unfinished stage")
+    args = parser.parse_args()
+
     model = "llama3.1:8b"
     model_tool = "llama3.1:8b"
     model_qa = "llama3.1:8b"
@@ -397,6 +860,9 @@ if __name__ == '__main__':
         verbose=True,
         iterations=3
     )
-    agent.execute()
+    try:
+        agent.execute(resume=args.resume)
+    finally:
+        agent.close()
 
 
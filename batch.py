@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import argparse
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from agent import CoderAgent
+from journal import new_run_id
+from prompts import (
+    coding_planning_agent_prompt,
+    coding_integration_agent_prompt,
+    coding_testing_agent_prompt,
+    coding_documentation_agent_prompt,
+    coding_optimization_agent_prompt
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+def load_requests(filepath):
+    requests_list = []
+    with open(filepath, 'r') as file:
+        for line_number, line in enumerate(file, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.error(f"Skipping line {line_number} of {filepath}: {e}")
+                continue
+            query = record.get('query') or record.get('prompt') or record.get('body')
+            if not query:
+                logger.error(f"Skipping line {line_number} of {filepath}: no query field")
+                continue
+            languages = record.get('languages') or record.get('language')
+            if isinstance(languages, str):
+                languages = [language.strip().lower() for language in languages.split(',') if language.strip()]
+            requests_list.append({
+                "id": str(record.get('id') or record.get('request_id') or line_number),
+                "query": query,
+                "languages": languages,
+                "filename": record.get('filename'),
+                "feedback": record.get('feedback'),
+            })
+    return requests_list
+
+
+def run_request(agent, request, output_dir, run_code, run_id=None):
+    filename = request["filename"] or request["id"]
+    filename = os.path.join(output_dir, filename)
+    try:
+        result = agent.process_query(
+            request["query"],
+            languages=request["languages"],
+            feedback=request["feedback"] or "",
+            filename=filename,
+            interactive=False,
+            run_code=run_code,
+            # One journal per request, so a resumed batch skips finished stages
+            run_id=f"{run_id}-{request['id']}" if run_id else None
+        )
+    except Exception as e:
+        logger.error(f"Request {request['id']} raised: {e}")
+        result = {"query": request["query"], "status": "failed", "error": str(e)}
+    result["id"] = request["id"]
+    return result
+
+
+def finished_ids(output_path):
+    # Ids of the requests that already have a result line in output_path
+    ids = set()
+    if not os.path.exists(output_path):
+        return ids
+    with open(output_path, 'r') as file:
+        for line in file:
+            try:
+                ids.add(str(json.loads(line)["id"]))
+            except (json.JSONDecodeError, KeyError, TypeError):
+                # A line cut short by the interruption
+                continue
+    return ids
+
+
+def ends_with_newline(path):
+    with open(path, 'rb') as file:
+        file.seek(-1, os.SEEK_END)
+        return file.read(1) == b"\n"
+
+
+def run_batch(agent, requests_list, output_path, workers=4, output_dir='batch_output', run_code=False, run_id=None, resume=False):
+    started = time.perf_counter()
+    write_lock = threading.Lock()
+    summary = {"run_id": run_id, "total": len(requests_list), "ok": 0, "failed": 0, "reused": 0, "skipped": 0}
+    if resume:
+        # Requests finished before the interruption keep their result line
+        done = finished_ids(output_path)
+        remaining = [request for request in requests_list if request["id"] not in done]
+        summary["skipped"] = len(requests_list) - len(remaining)
+        requests_list = remaining
+
+    with open(output_path, 'a') as output, ThreadPoolExecutor(max_workers=workers) as executor:
+        if resume and output.tell() and not ends_with_newline(output_path):
+            # Keep the first new result off the line cut short
+            output.write("\n")
+        futures = [executor.submit(run_request, agent, request, output_dir, run_code, run_id) for request in requests_list]
+        # Results are written as they finish, so a long batch can be followed with tail -f
+        for future in as_completed(futures):
+            result = future.result()
+            with write_lock:
+                output.write(json.dumps(result) + "\n")
+                output.flush()
+            summary["ok" if result["status"] == "ok" else "failed"] += 1
+            if result.get("reused"):
+                summary["reused"] += 1
+            logger.info(f"Request {result['id']} finished: {result['status']} in {result.get('elapsed', 0)}s")
+
+    summary["elapsed"] = round(time.perf_counter() - started, 3)
+    processed = summary["total"] - summary["skipped"]
+    summary["throughput_per_minute"] = round(60 * processed / summary["elapsed"], 2) if summary["elapsed"] else 0.0
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run coding queries from a JSONL file without user interaction.")
+    parser.add_argument("input", help="JSONL file with one query per line")
+    parser.add_argument("-o", "--output", default="batch_results.jsonl", help="JSONL file to append per-query results to")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="number of queries processed concurrently")
+    parser.add_argument("--output-dir", default="batch_output", help="directory for the final generated code files")
+    parser.add_argument("--run-code", action="store_true", help="execute each final program after saving it")
+    parser.add_argument("--model", default="llama3.1:8b")
+    parser.add_argument("--model-tool", default=None)
+    parser.add_argument("--endpoint", default="http://localhost:11434/api/generate")
+    parser.add_argument("--metrics-jsonl", default=None, help="write every recorded metric to this JSONL file")
+    parser.add_argument("--metrics-prom", default=None, help="write aggregated metrics in Prometheus text format to this file")
+    parser.add_argument("--reuse-context", action="store_true", help="continue code and test requests from the planning request's context")
+    parser.add_argument("--web-references", action="store_true", help="search the web when the local reference index has nothing relevant")
+    parser.add_argument("--plan-reuse-threshold", type=float, default=None, help="reuse the plan of an earlier query at least this similar (e.g. 0.75); off by default")
+    parser.add_argument("--code-reuse-threshold", type=float, default=None, help="reuse the tested code of an earlier query at least this similar")
+    parser.add_argument("--index-url", default=None, help="package index for the generated code's dependencies")
+    parser.add_argument("--find-links", default=None, help="local directory of wheels to install dependencies from")
+    parser.add_argument("--offline", action="store_true", help="install dependencies from --find-links and the wheel cache only")
+    parser.add_argument("--test-timeout", type=float, default=15, help="seconds before a test run is killed")
+    parser.add_argument("--test-shards", type=int, default=None, help="workers a large test suite is split across; defaults to all of them")
+    parser.add_argument("--optimization-rounds", type=int, default=1, help="optimization attempts, each shown the measurements of the last")
+    parser.add_argument("--no-measure-optimization", action="store_true", help="keep the optimized code without timing it against the original")
+    parser.add_argument("--resume", metavar="RUN_ID", default=None, help="continue an interrupted batch; requests with a result line in --output and finished stages of the others are not run again")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    agent = CoderAgent(
+        model=args.model,
+        model_tool=args.model_tool or args.model,
+        model_qa=args.model,
+        model_endpoint=args.endpoint,
+        planning_agent_prompt=coding_planning_agent_prompt,
+        integration_agent_prompt=coding_integration_agent_prompt,
+        testing_agent_prompt=coding_testing_agent_prompt,
+        documentation_agent_prompt=coding_documentation_agent_prompt,
+        optimization_agent_prompt=coding_optimization_agent_prompt,
+        verbose=args.verbose,
+        # Every worker can have a request in flight
+        max_concurrency=max(args.workers, 4),
+        pool_maxsize=max(args.workers * 2, 16),
+        test_workers=max(args.workers, 2),
+        test_timeout=args.test_timeout,
+        test_shards=args.test_shards,
+        measure_optimization=not args.no_measure_optimization,
+        optimization_rounds=args.optimization_rounds,
+        reuse_context=args.reuse_context,
+        web_references=args.web_references,
+        plan_reuse_threshold=args.plan_reuse_threshold,
+        code_reuse_threshold=args.code_reuse_threshold,
+        index_url=args.index_url,
+        find_links=args.find_links,
+        offline_dependencies=args.offline
+    )
+
+    if args.metrics_jsonl:
+        # Streamed as they are recorded: the recorder only keeps recent queries
+        open(args.metrics_jsonl, 'w').close()
+        agent.metrics.jsonl_path = args.metrics_jsonl
+
+    requests_list = load_requests(args.input)
+    run_id = args.resume or new_run_id()
+    logger.info(f"Batch run {run_id}; continue it with --resume {run_id} if interrupted")
+    try:
+        summary = run_batch(agent, requests_list, args.output, args.workers, args.output_dir, args.run_code, run_id, resume=bool(args.resume))
+    finally:
+        agent.close()
+    if args.metrics_prom:
+        agent.metrics.export_prometheus(args.metrics_prom)
+    print(json.dumps(summary))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import logging
+from agent import CoderAgent
+from batch import run_batch
+from execution_manager import run_tests
+from mock_ollama import MockOllamaServer, RecordedResponder, load_recordings, tokenize
+from ndjson_stream import consume_stream
+from runner_pool import TestRunnerPool
+from prompts import (
+    coding_planning_agent_prompt,
+    coding_integration_agent_prompt,
+    coding_testing_agent_prompt,
+    coding_documentation_agent_prompt,
+    coding_optimization_agent_prompt
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+FIXTURE_CODE = '''def fibonacci(n):
+    if n < 0:
+        raise ValueError("n must be non-negative")
+    a, b = 0, 1
+    for _ in range(n):
+        a, b = b, a + b
+    return a
+
+
+def fibonacci_sequence(count):
+    return [fibonacci(i) for i in range(count)]'''
+
+FIXTURE_TESTS = '''class TestFibonacci(unittest.TestCase):
+    def test_base_cases(self):
+        self.assertEqual(fibonacci(0), 0)
+        self.assertEqual(fibonacci(1), 1)
+
+    def test_sequence(self):
+        self.assertEqual(fibonacci_sequence(8), [0, 1, 1, 2, 3, 5, 8, 13])
+
+    def test_negative(self):
+        with self.assertRaises(ValueError):
+            fibonacci(-1)'''
+
+# Outputs that pass the pipeline's own test stage, so every scenario run
+# exercises the full plan -> code -> tests -> docs -> optimize path once.
+PIPELINE_FIXTURES = {
+    "code": [FIXTURE_CODE],
+    "tests": [FIXTURE_TESTS],
+    "documentation": ['"""Fibonacci helpers."""\n\n' + FIXTURE_CODE],
+    "optimize": [FIXTURE_CODE],
+    "feedback": [FIXTURE_CODE],
+}
+
+BENCH_QUERY = "Write a recursive fibonacci function in python"
+
+TRAILING_PARSE_TEXT = "The code above is explained in detail below.\n" * 20
+
+
+def make_agent(endpoint, **kwargs):
+    # Caches, the reference index, query reuse and run journals would make
+    # repeated runs incomparable (and fill .agent_cache/runs)
+    options = {"retry_delay": 0, "use_cache": False, "use_index": False, "plan_reuse_threshold": None, "journal_dir": None}
+    options.update(kwargs)
+    return CoderAgent(
+        model="codeqwen:latest",
+        model_tool="codeqwen:latest",
+        model_qa="codeqwen:latest",
+        model_endpoint=endpoint,
+        planning_agent_prompt=coding_planning_agent_prompt,
+        integration_agent_prompt=coding_integration_agent_prompt,
+        testing_agent_prompt=coding_testing_agent_prompt,
+        documentation_agent_prompt=coding_documentation_agent_prompt,
+        optimization_agent_prompt=coding_optimization_agent_prompt,
+        **options
+    )
+
+
+def pipeline_responder(recordings):
+    fixtures = dict(PIPELINE_FIXTURES)
+    fixtures["plan"] = recordings.get("plan") or ["Objective: implement fibonacci in Python."]
+    return RecordedResponder(fixtures)
+
+
+def describe(samples):
+    return {
+        "mean_s": round(statistics.mean(samples), 4),
+        "median_s": round(statistics.median(samples), 4),
+        "max_s": round(max(samples), 4),
+    }
+
+
+def bench_pipeline(args, recordings, output_dir):
+    with MockOllamaServer(pipeline_responder(recordings), tokens_per_sec=args.token_rate, latency=args.latency) as server:
+        agent = make_agent(server.url, test_workers=2)
+        try:
+            walls = []
+            model_seconds = []
+            for i in range(args.repeat):
+                before = server.model_seconds
+                started = time.perf_counter()
+                result = agent.process_query(BENCH_QUERY, feedback="", filename=os.path.join(output_dir, f"pipeline_{i}"), run_code=False)
+                walls.append(time.perf_counter() - started)
+                model_seconds.append(server.model_seconds - before)
+                if result["status"] != "ok":
+                    logger.error(f"Pipeline run {i} failed: {result.get('error')}")
+        finally:
+            agent.close()
+
+    metrics = {"wall_" + key: value for key, value in describe(walls).items()}
+    metrics["model_time_mean_s"] = round(statistics.mean(model_seconds), 4)
+    # Model time is summed over overlapping stages, so this is a lower bound on overhead
+    metrics["overhead_mean_s"] = round(max(0.0, statistics.mean(walls) - statistics.mean(model_seconds)), 4)
+    return metrics
+
+
+class _ReplayResponse:
+    def __init__(self, lines):
+        self._lines = lines
+
+    def iter_lines(self, decode_unicode=False):
+        return iter(self._lines)
+
+    def close(self):
+        pass
+
+
+def bench_parse(args, recordings):
+    texts = [text for stage_texts in recordings.values() for text in stage_texts] or [FIXTURE_CODE]
+    body = "```python\n" + "\n".join(texts) + "\n```\n" + TRAILING_PARSE_TEXT
+    target = int(args.parse_mb * 1024 * 1024)
+    lines = []
+    size = 0
+    # Repeat the recorded text, token by token, until the stream reaches the target size
+    while size < target:
+        for token in tokenize(body):
+            line = json.dumps({"model": "codeqwen:latest", "response": token, "done": False})
+            lines.append(line)
+            size += len(line) + 1
+    lines.append(json.dumps({"model": "codeqwen:latest", "response": "", "done": True}))
+    raw = "\n".join(lines)
+
+    agent = make_agent("http://127.0.0.1:9/api/generate", test_workers=0)
+    try:
+        whole = []
+        streamed = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            agent.extract_code(agent.parse_ndjson(raw))
+            whole.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            consume_stream(_ReplayResponse(lines), stop_at_code_fence=False)
+            streamed.append(time.perf_counter() - started)
+    finally:
+        agent.close()
+
+    megabytes = size / (1024 * 1024)
+    return {
+        "stream_mb": round(megabytes, 2),
+        "parse_extract_mean_s": round(statistics.mean(whole), 4),
+        "consume_stream_mean_s": round(statistics.mean(streamed), 4),
+        "parse_extract_mb_per_s": round(megabytes / statistics.mean(whole), 2),
+    }
+
+
+def bench_run_tests(args):
+    metrics = {}
+    pool = TestRunnerPool(size=2)
+    try:
+        # Start the workers before timing so the pool is measured warm
+        run_tests(FIXTURE_CODE, FIXTURE_TESTS, "python", pool=pool)
+        for name, runner_pool in (("pool", pool), ("subprocess", None)):
+            samples = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                result = run_tests(FIXTURE_CODE, FIXTURE_TESTS, "python", pool=runner_pool)
+                samples.append(time.perf_counter() - started)
+                if not result.passed:
+                    logger.error(f"Fixture tests failed under {name}: {result.failure_summary()}")
+            metrics[f"{name}_mean_s"] = round(statistics.mean(samples), 4)
+            metrics[f"{name}_median_s"] = round(statistics.median(samples), 4)
+    finally:
+        pool.close()
+    return metrics
+
+
+def bench_batch(args, recordings, output_dir):
+    requests_list = [
+        {"id": f"bench-{i}", "query": BENCH_QUERY, "languages": ["python"], "filename": None, "feedback": ""}
+        for i in range(args.batch_size)
+    ]
+    results_path = os.path.join(output_dir, "batch_results.jsonl")
+    with MockOllamaServer(pipeline_responder(recordings), tokens_per_sec=args.token_rate, latency=args.latency) as server:
+        agent = make_agent(server.url, test_workers=args.workers, max_concurrency=args.workers, pool_maxsize=args.workers * 2)
+        try:
+            summary = run_batch(agent, requests_list, results_path, workers=args.workers, output_dir=output_dir)
+        finally:
+            agent.close()
+    return {
+        "elapsed_s": summary["elapsed"],
+        "failed": summary["failed"],
+        "throughput_per_min": summary["throughput_per_minute"],
+    }
+
+
+def find_regressions(result, history, threshold):
+    previous = [entry for entry in history if entry["scenario"] == result["scenario"] and entry["config"] == result["config"]]
+    if not previous:
+        return []
+    baseline = previous[-1]["metrics"]
+    regressions = []
+    for name, value in result["metrics"].items():
+        old = baseline.get(name)
+        if not isinstance(value, (int, float)) or not old:
+            continue
+        if name.endswith("_per_s") or name.endswith("_per_min"):
+            change = (old - value) / old
+        elif name.endswith("_s"):
+            change = (value - old) / old
+        else:
+            continue
+        if change > threshold:
+            regressions.append(f"{result['scenario']}.{name}: {old} -> {value} ({change:+.0%})")
+    return regressions
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the agent against a local mock Ollama server.")
+    parser.add_argument("scenarios", nargs="*", default=["pipeline", "parse", "run_tests", "batch"])
+    parser.add_argument("--log", default="agent.log", help="agent log to take recorded streams from")
+    parser.add_argument("--token-rate", type=float, default=None, help="tokens per second; defaults to the recorded rate")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds before the first token")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--parse-mb", type=float, default=2.0, help="size of the synthetic stream for the parse scenario")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--results", default="benchmark_results.jsonl", help="JSONL file results are appended to")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative slowdown reported as a regression")
+    args = parser.parse_args()
+
+    recordings, interval = load_recordings(args.log) if os.path.exists(args.log) else ({}, None)
+    if args.token_rate is None:
+        args.token_rate = round(1.0 / interval, 1) if interval else 60.0
+
+    history = load_history(args.results)
+    output_dir = tempfile.mkdtemp(prefix="agent_bench_")
+    config = {"token_rate": args.token_rate, "latency": args.latency, "repeat": args.repeat}
+    regressions = []
+    try:
+        for scenario in args.scenarios:
+            if scenario == "pipeline":
+                metrics = bench_pipeline(args, recordings, output_dir)
+            elif scenario == "parse":
+                metrics = bench_parse(args, recordings)
+            elif scenario == "run_tests":
+                metrics = bench_run_tests(args)
+            elif scenario == "batch":
+                metrics = bench_batch(args, recordings, output_dir)
+            else:
+                parser.error(f"unknown scenario: {scenario}")
+
+            result = {"timestamp": time.time(), "scenario": scenario, "config": config, "metrics": metrics}
+            regressions.extend(find_regressions(result, history, args.threshold))
+            with open(args.results, 'a') as file:
+                file.write(json.dumps(result) + "\n")
+            print(json.dumps({"scenario": scenario, **metrics}))
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    if regressions:
+        print("Regressions against the previous run:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
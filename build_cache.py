@@ -0,0 +1,151 @@
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import threading
+import subprocess
+import logging
+from functools import lru_cache
+
+
+logger = logging.getLogger(__name__)
+
+
+LANGUAGE_ALIASES = {"c++": "cpp", "c#": "csharp"}
+
+# Compiler and default flags per language
+TOOLCHAINS = {
+    "c": ("gcc", ["-O2"]),
+    "cpp": ("g++", ["-O2"]),
+    "java": ("javac", []),
+    "csharp": ("csc", []),
+}
+
+JAVA_MAIN_CLASS = re.compile(r"public\s+(?:final\s+)?class\s+(\w+)")
+
+
+@lru_cache(maxsize=None)
+def compiler_identity(compiler):
+    # Path and version banner, so a compiler upgrade invalidates old artifacts
+    path = shutil.which(compiler)
+    if path is None:
+        return None
+    flag = "-version" if compiler == "javac" else "--version"
+    try:
+        completed = subprocess.run([path, flag], capture_output=True, text=True, timeout=30)
+        banner = (completed.stdout or completed.stderr).strip().splitlines()
+    except (OSError, subprocess.SubprocessError):
+        banner = []
+    return f"{path} {banner[0] if banner else ''}"
+
+
+class BuildCache:
+    # Compiled artifacts stored under root/<hash of source, compiler and
+    # flags>, never next to the source. Builds of different sources from
+    # concurrent queries run in parallel; a second build of the same source
+    # waits for the first and reuses its result. Least recently used artifacts go past max_bytes.
+    def __init__(self, root='.agent_cache/builds', max_bytes=512 * 1024 * 1024, flags=None):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        # Per-language flag overrides, e.g. {"cpp": ["-O2", "-std=c++17"]}
+        self.flags = flags or {}
+        self.hits = 0
+        self.misses = 0
+        self._locks = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def key(self, language, source, compiler, flags):
+        digest = hashlib.sha256()
+        digest.update(json.dumps([language, compiler_identity(compiler), flags]).encode("utf-8"))
+        digest.update(source)
+        return digest.hexdigest()[:24]
+
+    def build(self, filepath, language):
+        # Returns (command that runs the program, whether it came from the cache)
+        language = LANGUAGE_ALIASES.get(language, language)
+        compiler, default_flags = TOOLCHAINS[language]
+        flags = self.flags.get(language, default_flags)
+        with open(filepath, "rb") as file:
+            source = file.read()
+        key = self.key(language, source, compiler, flags)
+        directory = os.path.join(self.root, key)
+        marker = os.path.join(directory, ".artifact")
+
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if os.path.exists(marker):
+                self.hits += 1
+                os.utime(marker)
+                with open(marker, "r") as file:
+                    return json.load(file)["command"], True
+
+            self.misses += 1
+            tmp = f"{directory}.tmp{threading.get_ident()}"
+            shutil.rmtree(tmp, ignore_errors=True)
+            os.makedirs(tmp)
+            try:
+                # The source is compiled from a copy so the artifact does not depend on filepath
+                name = os.path.basename(filepath)
+                if language == "java":
+                    match = JAVA_MAIN_CLASS.search(source.decode("utf-8", errors="replace"))
+                    name = f"{match.group(1) if match else os.path.splitext(name)[0]}.java"
+                copy = os.path.join(tmp, name)
+                shutil.copyfile(filepath, copy)
+                compile_command, command = self._commands(language, compiler, flags, copy, directory)
+                subprocess.run(compile_command, check=True, cwd=tmp)
+                size = sum(os.path.getsize(os.path.join(tmp, entry)) for entry in os.listdir(tmp))
+                with open(os.path.join(tmp, ".artifact"), "w") as file:
+                    json.dump({"command": command, "size": size, "language": language, "created": time.time()}, file)
+                shutil.rmtree(directory, ignore_errors=True)
+                os.rename(tmp, directory)
+            finally:
+                shutil.rmtree(tmp, ignore_errors=True)
+        self._evict()
+        return command, False
+
+    def _commands(self, language, compiler, flags, source, directory):
+        # The run command points into the final directory the build is renamed to
+        build_dir = os.path.dirname(source)
+        if language in ("c", "cpp"):
+            return [compiler, *flags, source, "-o", os.path.join(build_dir, "program")], [os.path.join(directory, "program")]
+        if language == "java":
+            main_class = os.path.splitext(os.path.basename(source))[0]
+            return [compiler, *flags, "-d", build_dir, source], ["java", "-cp", directory, main_class]
+        return [compiler, *flags, f"-out:{os.path.join(build_dir, 'program.exe')}", source], ["mono", os.path.join(directory, "program.exe")]
+
+    def _evict(self):
+        artifacts = []
+        for name in os.listdir(self.root):
+            marker = os.path.join(self.root, name, ".artifact")
+            try:
+                with open(marker, "r") as file:
+                    size = json.load(file)["size"]
+                artifacts.append((os.path.getmtime(marker), size, name))
+            except (OSError, ValueError, KeyError):
+                continue
+        total = sum(size for _, size, _ in artifacts)
+        for _, size, name in sorted(artifacts):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+            total -= size
+            logger.debug(f"Evicted build artifact {name}")
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_build_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = BuildCache()
+        return _cache
@@ -0,0 +1,208 @@
+import os
+import re
+import sys
+import ast
+import json
+import time
+import shutil
+import hashlib
+import threading
+import subprocess
+import importlib.util
+import logging
+from importlib import metadata
+
+
+logger = logging.getLogger(__name__)
+
+
+# Import names that differ from the distribution that provides them
+IMPORT_TO_DISTRIBUTION = {
+    "bs4": "beautifulsoup4",
+    "cv2": "opencv-python",
+    "PIL": "pillow",
+    "sklearn": "scikit-learn",
+    "skimage": "scikit-image",
+    "yaml": "PyYAML",
+    "dateutil": "python-dateutil",
+    "dotenv": "python-dotenv",
+    "jwt": "PyJWT",
+    "serial": "pyserial",
+    "Crypto": "pycryptodome",
+    "docx": "python-docx",
+    "magic": "python-magic",
+    "attr": "attrs",
+}
+
+REQUIREMENT_NAME = re.compile(r"^\s*([A-Za-z0-9][A-Za-z0-9._-]*)")
+
+
+def requirement_name(requirement):
+    match = REQUIREMENT_NAME.match(requirement)
+    return match.group(1) if match else requirement
+
+
+def imported_modules(code):
+    # Top-level names of absolute imports; empty if the code does not parse
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return set()
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module.split(".")[0])
+    return names
+
+
+class DependencyManager:
+    # Installs a dependency set once, with a single pip call, into a target
+    # directory keyed by the sorted set; later runs with the same set reuse
+    # the directory without touching pip. Wheels are built into a shared
+    # local directory first, so a new set that overlaps an old one installs
+    # from disk. Nothing is installed into the agent's own interpreter.
+    def __init__(self, root='.agent_cache/envs', wheel_dir='.agent_cache/wheels', index_url=None, find_links=None, offline=False, max_envs=16, timeout=600):
+        self.root = os.path.abspath(root)
+        self.wheel_dir = os.path.abspath(wheel_dir)
+        self.index_url = index_url
+        self.find_links = find_links
+        self.offline = offline
+        self.max_envs = max_envs
+        self.timeout = timeout
+        self.installs = 0
+        self.reused = 0
+        self._locks = {}
+        # Sets that failed to install; not retried for the life of the manager
+        self._failed = set()
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        os.makedirs(self.wheel_dir, exist_ok=True)
+
+    def resolve(self, code, requirements=()):
+        # Declared requirements plus imports that the interpreter cannot find
+        wanted = {requirement_name(requirement).lower(): requirement for requirement in requirements}
+        for module in imported_modules(code):
+            if module in sys.builtin_module_names or module in sys.stdlib_module_names:
+                continue
+            if importlib.util.find_spec(module) is not None:
+                continue
+            distribution = IMPORT_TO_DISTRIBUTION.get(module, module)
+            wanted.setdefault(distribution.lower(), distribution)
+        resolved = []
+        for name, requirement in wanted.items():
+            # Bare names already installed in this interpreter need no environment
+            if requirement.strip() == requirement_name(requirement) and self._installed(name):
+                continue
+            resolved.append(requirement)
+        return sorted(resolved)
+
+    def _installed(self, name):
+        try:
+            metadata.distribution(name)
+            return True
+        except metadata.PackageNotFoundError:
+            return False
+
+    def distribution_for_module(self, module):
+        return IMPORT_TO_DISTRIBUTION.get(module, module)
+
+    def key(self, requirements):
+        material = json.dumps(sorted(set(requirements)))
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()[:16]
+
+    def ensure(self, requirements):
+        # Returns the directory to put on sys.path, or None when nothing is needed
+        requirements = sorted(set(requirements))
+        if not requirements:
+            return None
+        key = self.key(requirements)
+        path = os.path.join(self.root, key)
+        marker = os.path.join(path, ".complete")
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if os.path.exists(marker):
+                self.reused += 1
+                os.utime(marker)
+                return path
+            if key in self._failed:
+                return None
+            started = time.perf_counter()
+            if not self._install(requirements, path):
+                self._failed.add(key)
+                return None
+            self.installs += 1
+            logger.info(f"Installed {len(requirements)} dependencies into {path} in {time.perf_counter() - started:.1f}s")
+        self._evict()
+        return path
+
+    def _sources(self):
+        args = ["--find-links", self.wheel_dir]
+        if self.find_links:
+            args += ["--find-links", self.find_links]
+        if self.offline:
+            args.append("--no-index")
+        elif self.index_url:
+            args += ["--index-url", self.index_url]
+        return args
+
+    def _pip(self, args):
+        command = [sys.executable, "-m", "pip", "--disable-pip-version-check", "--no-input"] + args
+        try:
+            completed = subprocess.run(command, capture_output=True, text=True, timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            logger.error(f"pip timed out after {self.timeout}s: {' '.join(args)}")
+            return False
+        if completed.returncode != 0:
+            logger.error(f"pip {args[0]} failed:\n{completed.stderr[-2000:]}")
+            return False
+        return True
+
+    def _install(self, requirements, path):
+        # Build (or reuse) wheels for the whole set, then install them from
+        # the wheel directory alone, into a fresh directory renamed into place
+        installable = requirements
+        if not self._pip(["wheel", "--wheel-dir", self.wheel_dir] + self._sources() + requirements):
+            # One unknown name (often a hallucinated import) fails the whole
+            # call; keep whatever can be built on its own
+            installable = [requirement for requirement in requirements if len(requirements) > 1 and self._pip(["wheel", "--wheel-dir", self.wheel_dir] + self._sources() + [requirement])]
+            if not installable:
+                return False
+        tmp = f"{path}.tmp{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not self._pip(["install", "--no-index", "--find-links", self.wheel_dir, "--target", tmp] + installable):
+            shutil.rmtree(tmp, ignore_errors=True)
+            return False
+        with open(os.path.join(tmp, ".complete"), "w") as file:
+            json.dump({"requested": requirements, "installed": installable}, file)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp, path)
+        return True
+
+    def _evict(self):
+        environments = []
+        for name in os.listdir(self.root):
+            marker = os.path.join(self.root, name, ".complete")
+            if os.path.exists(marker):
+                environments.append((os.path.getmtime(marker), name))
+        # Least recently used first
+        for _, name in sorted(environments)[:max(0, len(environments) - self.max_envs)]:
+            shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+            logger.debug(f"Removed dependency environment {name}")
+
+    def stats(self):
+        return {"installs": self.installs, "reused": self.reused}
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_dependency_manager():
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = DependencyManager()
+        return _manager
@@ -1,18 +1,26 @@
+import time
 import subprocess
-import importlib.util
 import logging
 from file_manager import save_code
+from workspace import Workspace
+from runner_pool import run_job_in_subprocess
+from suite_results import SuiteResult
+from metrics import get_recorder
+from dependency_manager import get_dependency_manager
+from static_checks import prevalidate, test_names
+from build_cache import get_build_cache, LANGUAGE_ALIASES, TOOLCHAINS
 
 
 logger = logging.getLogger(__name__)
 
 
-def install_dependencies(dependencies):
-    for dependency in dependencies:
-        try:
-            subprocess.run(["pip", "install", dependency], check=True)
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Failed to install {dependency}: {e}")
+MIN_TESTS_PER_SHARD = 4
+
+
+def install_dependencies(dependencies, manager=None):
+    # One batched install into a reusable environment keyed by the set;
+    # returns the directory to put on sys.path, or None
+    return (manager or get_dependency_manager()).ensure(dependencies)
 
 def extract_dependencies(code):
     # A simple heuristic to find 'pip install' lines and extract package names
@@ -23,20 +31,14 @@ def extract_dependencies(code):
             dependencies.extend(parts[2:])  # Extract package names after 'pip install'
     return dependencies
 
-def correct_indentation(code):
-    lines = code.splitlines()
-    corrected_lines = []
-    indentation_level = 0
-    for line in lines:
-        stripped_line = line.lstrip()
-        if stripped_line.startswith('except') or stripped_line.startswith('elif') or stripped_line.startswith('else'):
-            indentation_level -= 1
-        corrected_lines.append('    ' * indentation_level + stripped_line)
-        if stripped_line.endswith(':'):
-            indentation_level += 1
-    return '\n'.join(corrected_lines)
-
-def execute_code(filepath, language, verbose=False):
+def dependency_paths(code, deps=None):
+    # Directories holding the code's installed dependencies, for a job's "paths"
+    deps = deps or get_dependency_manager()
+    cleaned_code = "\n".join([line for line in code.splitlines() if not line.startswith("pip install")])
+    env_path = install_dependencies(deps.resolve(cleaned_code, extract_dependencies(code)), deps)
+    return [env_path] if env_path else []
+
+def execute_code(filepath, language, verbose=False, build_cache=None):
     if not filepath:
         logger.error("No code file path provided; skipping code execution.")
         return
@@ -45,59 +47,91 @@ def execute_code(filepath, language, verbose=False):
         logger.info(f"{language.upper()} code generated and saved to {filepath}. Please open it in a web browser to view.")
         return
 
+    recorder = get_recorder()
+    language = LANGUAGE_ALIASES.get(language, language)
     try:
         if language == "python":
-            subprocess.run(["python", filepath], check=True)
+            command = ["python", filepath]
         elif language == "javascript":
-            subprocess.run(["node", filepath], check=True)
-        elif language == "java":
-            subprocess.run(["javac", filepath], check=True)
-            subprocess.run(["java", filepath], check=True)
-        elif language == "csharp":
-            subprocess.run(["csc", filepath], check=True)
-            subprocess.run(["mono", f"{filepath}.exe"], check=True)
-        elif language == "c":
-            subprocess.run(["gcc", filepath, "-o", filepath], check=True)
-            subprocess.run([f"./{filepath}"], check=True)
-        elif language == "cpp":
-            subprocess.run(["g++", filepath, "-o", filepath], check=True)
-            subprocess.run([f"./{filepath}"], check=True)
-        # Add more languages as needed
+            command = ["node", filepath]
+        elif language in TOOLCHAINS:
+            # Compiled once per distinct source, compiler and flags; re-running
+            # unchanged code goes straight to the cached artifact
+            started = time.perf_counter()
+            command, cached = (build_cache or get_build_cache()).build(filepath, language)
+            recorder.record_timing("compile", time.perf_counter() - started, language=language, cache_hit=cached)
+        else:
+            # Add more languages as needed
+            return
+        with recorder.timer("run", language=language):
+            subprocess.run(command, check=True)
     except subprocess.CalledProcessError as e:
         logger.error(f"Execution Error: {e}")
 
-def run_tests(code, tests, language, verbose=False):
+def run_tests(code, tests, language, verbose=False, workspace=None, pool=None, only=None, deps=None, timeout=None, limits=None):
     if language in ["html", "css"]:
         logger.info(f"Skipping tests for non-executable language: {language.upper()}")
-        return 0  # Return 0 indicating all tests passed (since there are no tests to run)
+        return SuiteResult(0)  # All tests passed (since there are no tests to run)
 
     if language == "python":
-        code_filename = "temp_generated_code"
-        code_filepath = f"{code_filename}.py"
-        test_filepath = "test_generated_code.py"
-
-        # Extract and install dependencies
-        dependencies = extract_dependencies(code)
-        if dependencies:
-            install_dependencies(dependencies)
-        
-        # Clean the code from 'pip install' lines and correct indentation
-        cleaned_code = "\n".join([line for line in code.splitlines() if not line.startswith("pip install")])
-        cleaned_code = correct_indentation(cleaned_code)
-        
-        # Save the cleaned code to a file
-        save_code(cleaned_code, code_filepath, verbose)
-
-        spec = importlib.util.spec_from_file_location(code_filename, code_filepath)
-        generated_module = importlib.util.module_from_spec(spec)
-        try:
-            spec.loader.exec_module(generated_module)
-        except ModuleNotFoundError as e:
-            logger.error(f"ModuleNotFoundError: {e}. Attempting to install the missing module.")
-            subprocess.run(["pip", "install", e.name], check=True)
-            spec.loader.exec_module(generated_module)
+        # Without a caller-provided workspace the run gets a throwaway one
+        owns_workspace = workspace is None
+        if owns_workspace:
+            workspace = Workspace()
 
-        test_code = f"""
+        started = time.perf_counter()
+        result = None
+        try:
+            result = _run_python_tests(code, tests, verbose, workspace, pool, only, deps, timeout, limits)
+            return result
+        finally:
+            get_recorder().record_timing(
+                "test_run", time.perf_counter() - started,
+                language=language,
+                passed=result.passed if result is not None else False,
+                partial=bool(only)
+            )
+            if owns_workspace:
+                workspace.cleanup()
+
+def shard_jobs(job, tests, code, shards):
+    # Round-robin split of the suite into at most `shards` jobs, each with
+    # enough tests to be worth a process of its own
+    if shards < 2 or "TestCase" in code:
+        # Test classes defined in the code are star-imported into the suite too
+        return [job]
+    names = job["only"] or test_names(tests)
+    count = min(shards, len(names or ()) // MIN_TESTS_PER_SHARD)
+    if count < 2:
+        return [job]
+    return [dict(job, only=names[i::count]) for i in range(count)]
+
+def _run_python_tests(code, tests, verbose, workspace, pool=None, only=None, deps=None, timeout=None, limits=None):
+    code_filename = workspace.module_name
+    code_filepath = workspace.module_path
+    test_filepath = workspace.test_path
+    deps = deps or get_dependency_manager()
+
+    # Clean the code from 'pip install' lines, then check code and tests
+    # statically: a candidate that cannot import is rejected in milliseconds
+    # instead of after an install, two file writes and a test run
+    cleaned_code = "\n".join([line for line in code.splitlines() if not line.startswith("pip install")])
+    started = time.perf_counter()
+    cleaned_code, tests, problems = prevalidate(cleaned_code, tests, code_filename)
+    get_recorder().record_timing("prevalidate", time.perf_counter() - started, passed=not problems)
+    if problems:
+        result = SuiteResult(1, error="Static checks failed", problems=problems)
+        logger.error(f"Static checks failed:\n{result.failure_summary()}")
+        return result
+
+    # Declared and imported dependencies are installed together, once per set
+    requirements = deps.resolve(cleaned_code, extract_dependencies(code))
+    env_path = install_dependencies(requirements, deps)
+
+    # Save the cleaned code to a file
+    save_code(cleaned_code, code_filepath, verbose)
+
+    test_code = f"""
 import unittest
 from {code_filename} import *
 
@@ -106,12 +140,36 @@ from {code_filename} import *
 if __name__ == "__main__":
     unittest.main()
 """
-        # Save the test code to a file
-        save_code(test_code, test_filepath, verbose)
-
-        try:
-            result = subprocess.run(["python", test_filepath], check=True)
-            return result.returncode  # Return the return code from the test run
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Test Execution Error: {e}")
-            return e.returncode  # Return the return code from the failed test run
+    # Save the test code to a file
+    save_code(test_code, test_filepath, verbose)
+
+    job = {
+        "root": workspace.root,
+        "module_name": workspace.module_name,
+        "test_module_name": workspace.test_module_name,
+        "only": only,
+        "paths": [env_path] if env_path else [],
+        # None leaves the pool's (or run_job_in_subprocess's) defaults
+        "limits": limits
+    }
+    # With a pool, a large suite is split across its workers
+    jobs = shard_jobs(job, tests, cleaned_code, pool.shards) if pool is not None else [job]
+    if pool is not None:
+        run = lambda jobs: pool.run_many(jobs, timeout)
+    else:
+        run = lambda jobs: [run_job_in_subprocess(job, timeout or 60, limits) for job in jobs]
+    result = SuiteResult.merge([SuiteResult.from_dict(data) for data in run(jobs)])
+    if result.missing_module:
+        logger.error(f"ModuleNotFoundError: {result.missing_module}. Attempting to install the missing module.")
+        requirements = sorted(set(requirements) | {deps.distribution_for_module(result.missing_module)})
+        env_path = install_dependencies(requirements, deps)
+        if env_path:
+            for job in jobs:
+                job["paths"] = [env_path]
+            result = SuiteResult.merge([SuiteResult.from_dict(data) for data in run(jobs)])
+
+    if result.passed:
+        logger.info(f"Tests passed: {result.counts()}")
+    else:
+        logger.error(f"Test Execution Error: {result.counts()}\n{result.failure_summary()}")
+    return result
@@ -0,0 +1,75 @@
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# Request-level names used by the generate_* methods, mapped to Ollama option names
+OLLAMA_OPTION_NAMES = {
+    "temperature": "temperature",
+    "max_tokens": "num_predict",
+    "stop": "stop",
+    "seed": "seed",
+    "num_ctx": "num_ctx",
+    "top_p": "top_p",
+    "top_k": "top_k",
+    "repeat_penalty": "repeat_penalty",
+}
+
+# Completion token budgets per stage. Code-producing stages also stop at the
+# closing fence, so these mainly bound runaway generations.
+DEFAULT_STAGE_BUDGETS = {
+    "plan": 768,
+    "code": 1536,
+    "tests": 1536,
+    "documentation": 2048,
+    "optimize": 1536,
+    "feedback": 1536,
+}
+
+
+class GenerationOptions:
+    def __init__(self, stage_budgets=None, stage_options=None, default_budget=1000, num_ctx=8192, keep_alive="10m"):
+        self.stage_budgets = dict(DEFAULT_STAGE_BUDGETS)
+        self.stage_budgets.update(stage_budgets or {})
+        # e.g. {"plan": {"temperature": 0.2, "num_ctx": 4096}, "code": {"stop": ["\nif __name__"]}}
+        self.stage_options = stage_options or {}
+        self.default_budget = default_budget
+        self.num_ctx = num_ctx
+        self.keep_alive = keep_alive
+
+    def budget(self, stage):
+        return self.stage_options.get(stage, {}).get("max_tokens", self.stage_budgets.get(stage, self.default_budget))
+
+    def value(self, stage, name, default=None):
+        return self.stage_options.get(stage, {}).get(name, default)
+
+    def build_payload(self, data, stream=True):
+        stage = data.get("stage")
+        settings = {"num_ctx": self.num_ctx}
+        settings.update(self.stage_options.get(stage, {}))
+        # Values on the request itself win over the stage configuration
+        settings.update({k: v for k, v in data.items() if v is not None})
+
+        options = {}
+        for name, value in settings.items():
+            option_name = OLLAMA_OPTION_NAMES.get(name)
+            if option_name is None or value is None:
+                continue
+            if option_name == "stop" and isinstance(value, str):
+                value = [value]
+            options[option_name] = value
+
+        payload = {
+            "model": data["model"],
+            "prompt": data["prompt"],
+            "stream": stream,
+            "options": options
+        }
+        if data.get("context"):
+            # Token ids from an earlier response; the prompt continues after them
+            payload["context"] = data["context"]
+        keep_alive = settings.get("keep_alive", self.keep_alive)
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        return payload
@@ -0,0 +1,175 @@
+import re
+import codecs
+from html.parser import HTMLParser
+
+
+# Content that never helps as a code reference; skipped with everything inside it
+SKIPPED_TAGS = {"script", "style", "noscript", "nav", "header", "footer", "aside", "form", "svg", "iframe", "template", "button", "title"}
+
+# Tags that end a line of text
+BLOCK_TAGS = {
+    "p", "div", "br", "li", "ul", "ol", "dl", "dt", "dd", "tr", "table", "section", "article",
+    "main", "blockquote", "h1", "h2", "h3", "h4", "h5", "h6", "hr", "pre"
+}
+
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+CHARSET = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?([\w.:-]+)""", re.IGNORECASE)
+
+# How far into a page to look for a <meta> charset, as browsers do
+SNIFF_BYTES = 1024
+
+
+class StreamingHtmlExtractor(HTMLParser):
+    # Fed a page chunk by chunk, keeps at most max_chars of code (from <pre>
+    # and multi-line <code> blocks) and max_chars of prose. Nothing beyond
+    # that is stored, so memory stays bounded however large the page is.
+    def __init__(self, max_chars=20000, min_code_chars=40):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.min_code_chars = min_code_chars
+        self.code_blocks = []
+        self._code_chars = 0
+        self._code_parts = None
+        self._block_is_pre = False
+        self._code_depth = 0
+        self._in_pre = 0
+        self._skip_depth = 0
+        self._lines = []
+        # Raw text of the current line; whitespace is collapsed once the line ends
+        self._line = []
+        self._line_chars = 0
+        self._text_chars = 0
+
+    @property
+    def full(self):
+        return self._code_chars >= self.max_chars and self._text_chars >= self.max_chars
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            if tag not in VOID_TAGS:
+                self._skip_depth += 1
+            return
+        if self._skip_depth:
+            return
+        if tag in BLOCK_TAGS:
+            self._end_line()
+        if tag == "pre":
+            self._in_pre += 1
+        if tag in ("pre", "code"):
+            if self._code_depth == 0:
+                self._code_parts = []
+                self._block_is_pre = tag == "pre"
+            self._code_depth += 1
+
+    def handle_startendtag(self, tag, attrs):
+        if not self._skip_depth and tag in BLOCK_TAGS:
+            self._end_line()
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+            return
+        if self._skip_depth:
+            return
+        if tag in ("pre", "code") and self._code_depth:
+            self._code_depth -= 1
+            if tag == "pre":
+                self._in_pre = max(0, self._in_pre - 1)
+            if self._code_depth == 0:
+                self._end_code_block()
+        if tag in BLOCK_TAGS:
+            self._end_line()
+
+    def handle_data(self, data):
+        if self._skip_depth:
+            return
+        if self._code_depth:
+            if self._code_chars < self.max_chars:
+                self._code_parts.append(data)
+                self._code_chars += len(data)
+            if self._in_pre:
+                return
+        # Inline code and prose become text. Data can end mid-word, at a chunk
+        # boundary or an inline tag, so it is kept as is until the line ends.
+        if self._text_chars + self._line_chars < self.max_chars:
+            self._line.append(data)
+            self._line_chars += len(data)
+
+    def _end_line(self):
+        text = " ".join("".join(self._line).split())
+        self._line = []
+        self._line_chars = 0
+        if text:
+            self._lines.append(text)
+            self._text_chars += len(text) + 1
+
+    def _end_code_block(self):
+        block = "".join(self._code_parts).strip("\n")
+        self._code_parts = None
+        # Inline <code> only counts as a block when it looks like one
+        if block.strip() and (self._block_is_pre or "\n" in block or len(block) >= self.min_code_chars):
+            self.code_blocks.append(block)
+        else:
+            self._code_chars -= len(block)
+
+    def result(self):
+        # Code blocks first, then prose, within max_chars overall
+        self._end_line()
+        parts = []
+        remaining = self.max_chars
+        for block in self.code_blocks:
+            if remaining <= 0:
+                break
+            block = block[:remaining]
+            parts.append(f"```\n{block}\n```")
+            remaining -= len(block)
+        if remaining > 0 and self._lines:
+            parts.append("\n".join(self._lines)[:remaining])
+        return "\n\n".join(parts)
+
+
+def charset_from_content_type(content_type):
+    # The charset parameter of a Content-Type header, if Python knows it
+    match = re.search(r"charset\s*=\s*[\"']?([\w.:-]+)", content_type or "", re.IGNORECASE)
+    return _known_encoding(match.group(1)) if match else None
+
+
+def _known_encoding(name):
+    try:
+        return codecs.lookup(name if isinstance(name, str) else name.decode("ascii")).name
+    except (LookupError, UnicodeDecodeError):
+        return None
+
+
+def extract_text(chunks, max_chars=20000, encoding=None):
+    # chunks: bytes as they come off the wire; multi-byte characters split
+    # across chunk boundaries are decoded correctly. Without an encoding
+    # (from the response's Content-Type) the page's own <meta> charset is
+    # used, and UTF-8 when it declares none.
+    decoder = None
+    pending = b""
+    extractor = StreamingHtmlExtractor(max_chars)
+    for chunk in chunks:
+        if decoder is None:
+            pending += chunk
+            if encoding is None and len(pending) < SNIFF_BYTES:
+                continue
+            decoder = _decoder(encoding, pending)
+            chunk, pending = pending, b""
+        extractor.feed(decoder.decode(chunk))
+        if extractor.full:
+            break
+    else:
+        if decoder is None:
+            decoder = _decoder(encoding, pending)
+        extractor.feed(decoder.decode(pending, final=True))
+    extractor.close()
+    return extractor.result()
+
+
+def _decoder(encoding, head):
+    if encoding is None:
+        match = CHARSET.search(head[:SNIFF_BYTES])
+        encoding = (match and _known_encoding(match.group(1))) or "utf-8"
+    return codecs.getincrementaldecoder(encoding)(errors='replace')
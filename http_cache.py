@@ -0,0 +1,204 @@
+import os
+import time
+import json
+import sqlite3
+import threading
+import logging
+from urllib.parse import urlsplit
+from email.utils import formatdate
+import requests
+from requests.adapters import HTTPAdapter
+
+
+logger = logging.getLogger(__name__)
+
+
+class HttpCache:
+    # On-disk store of fetched pages with their validators, so an expired
+    # entry can be revalidated with a conditional request instead of fetched
+    # again in full.
+    def __init__(self, path='.agent_cache/http.sqlite', max_bytes=128 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " url TEXT PRIMARY KEY, body BLOB, headers TEXT, etag TEXT, last_modified TEXT,"
+            " size INTEGER, fetched REAL, last_access REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pages_last_access ON pages (last_access)")
+        self._conn.commit()
+
+    def get(self, url):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, headers, etag, last_modified, fetched FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE pages SET last_access = ? WHERE url = ?", (time.time(), url))
+            self._conn.commit()
+        body, headers, etag, last_modified, fetched = row
+        return {"body": body, "headers": json.loads(headers), "etag": etag, "last_modified": last_modified, "fetched": fetched}
+
+    def put(self, url, body, headers):
+        now = time.time()
+        kept = {name: headers[name] for name in ("Content-Type", "ETag", "Last-Modified") if name in headers}
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages (url, body, headers, etag, last_modified, size, fetched, last_access) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, body, json.dumps(kept), headers.get("ETag"), headers.get("Last-Modified"), len(body), now, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def touch(self, url):
+        # A 304 answer: the stored body is current again
+        with self._lock:
+            now = time.time()
+            self._conn.execute("UPDATE pages SET fetched = ?, last_access = ? WHERE url = ?", (now, now, url))
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for url, size in self._conn.execute("SELECT url, size FROM pages ORDER BY last_access").fetchall():
+            self._conn.execute("DELETE FROM pages WHERE url = ?", (url,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+        logger.debug(f"Evicted HTTP cache entries down to {total} bytes")
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages").fetchone()
+        return {"hits": self.hits, "revalidated": self.revalidated, "misses": self.misses, "entries": entries, "bytes": size}
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM pages")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class HostRateLimiter:
+    # Spaces out requests to the same host: at most `rate` requests per second,
+    # per host, across all threads. Hosts without an entry in `rates` get the
+    # default rate; a rate of 0 disables limiting.
+    def __init__(self, default_rate=2.0, rates=None):
+        self.default_rate = default_rate
+        self.rates = rates or {}
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        host = urlsplit(url).netloc
+        rate = self.rates.get(host, self.default_rate)
+        if not rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, 0.0))
+            self._next_slot[host] = slot + 1.0 / rate
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+class CachingFetcher:
+    # GETs over one pooled session, through the rate limiter and the cache.
+    # Within `ttl` seconds a cached page is returned without a request; after
+    # that it is revalidated with If-None-Match / If-Modified-Since.
+    def __init__(self, cache=None, rate_limiter=None, headers=None, timeout=15, pool_maxsize=8):
+        self.cache = cache
+        self.rate_limiter = rate_limiter or HostRateLimiter()
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(headers or {})
+
+    def get(self, url, ttl=0, params=None, max_bytes=None):
+        return b"".join(self.iter_get(url, ttl, params, max_bytes))
+
+    def iter_get(self, url, ttl=0, params=None, max_bytes=None, chunk_size=64 * 1024, response_headers=None):
+        # Yields the body in chunks as it arrives, stopping after max_bytes. A
+        # body is cached only when the consumer reads it to the end; one cut
+        # at max_bytes is not, so the cache never stands in for a full page.
+        # response_headers, if given, is filled in before the first chunk.
+        if response_headers is None:
+            response_headers = {}
+        if params:
+            url = requests.Request('GET', url, params=params).prepare().url
+        entry = self.cache.get(url) if self.cache is not None else None
+        if entry is not None and ttl and time.time() - entry["fetched"] < ttl:
+            self.cache.hits += 1
+            response_headers.update(entry["headers"])
+            yield from _chunks(entry["body"], chunk_size)
+            return
+
+        headers = {}
+        if entry is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+            elif not entry["etag"]:
+                headers["If-Modified-Since"] = formatdate(entry["fetched"], usegmt=True)
+
+        self.rate_limiter.wait(url)
+        response = self.session.get(url, headers=headers, timeout=self.timeout, stream=True)
+        try:
+            if response.status_code == 304 and entry is not None:
+                self.cache.revalidated += 1
+                self.cache.touch(url)
+                response_headers.update(entry["headers"])
+                yield from _chunks(entry["body"], chunk_size)
+                return
+            response.raise_for_status()
+            response_headers.update(response.headers)
+
+            body = []
+            size = 0
+            truncated = False
+            for chunk in response.iter_content(chunk_size):
+                if max_bytes is not None and size + len(chunk) > max_bytes:
+                    chunk = chunk[:max_bytes - size]
+                body.append(chunk)
+                size += len(chunk)
+                yield chunk
+                if max_bytes is not None and size >= max_bytes:
+                    logger.debug(f"Stopped reading {url} at {max_bytes} bytes")
+                    truncated = True
+                    break
+            if self.cache is not None:
+                self.cache.misses += 1
+                if not truncated:
+                    self.cache.put(url, b"".join(body), response.headers)
+        finally:
+            response.close()
+
+    def close(self):
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+def _chunks(body, chunk_size):
+    for start in range(0, len(body), chunk_size):
+        yield body[start:start + chunk_size]
@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# Journal of the query being processed, for code running in its stage threads
+current_journal = contextvars.ContextVar("current_journal", default=None)
+
+
+def new_run_id():
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+class RunJournal:
+    # Append-only JSON lines, one file per run: what the run was asked,
+    # every stage result as the stage finishes, and events such as code
+    # candidates and their test results. Each line is written through to
+    # the OS at once, so a crashed process loses nothing; fsync is batched
+    # to every fsync_every lines or fsync_interval seconds and on close.
+    def __init__(self, run_id=None, root='.agent_cache/runs', fsync_every=16, fsync_interval=1.0):
+        self.run_id = run_id or new_run_id()
+        self.path = self.path_for(self.run_id, root)
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.meta = {}
+        self.stages = {}
+        self.events = []
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        if os.path.exists(self.path):
+            self._load()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    @staticmethod
+    def path_for(run_id, root='.agent_cache/runs'):
+        return os.path.join(root, f"{run_id}.jsonl")
+
+    @property
+    def resumed(self):
+        return bool(self.meta)
+
+    def _load(self):
+        with open(self.path, "r", encoding="utf-8") as file:
+            lines = file.readlines()
+        valid = 0
+        for line in lines:
+            try:
+                if not line.endswith("\n"):
+                    raise ValueError("unterminated line")
+                entry = json.loads(line)
+            except ValueError:
+                # A line cut short by a crash; everything before it is kept
+                break
+            valid += len(line.encode("utf-8"))
+            if entry["type"] == "meta":
+                self.meta.update(entry["value"])
+            elif entry["type"] == "stage":
+                self.stages[entry["name"]] = entry["value"]
+            else:
+                self.events.append(entry)
+        if valid < os.path.getsize(self.path):
+            with open(self.path, "r+b") as file:
+                file.truncate(valid)
+        logger.info(f"Loaded run {self.run_id}: {len(self.stages)} completed stages")
+
+    def _append(self, entry):
+        entry["time"] = round(time.time(), 3)
+        line = json.dumps(entry, separators=(",", ":"), default=str) + "\n"
+        with self._lock:
+            try:
+                self._file.write(line)
+                self._file.flush()
+                self._unsynced += 1
+                if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+                    self._sync()
+            except OSError as e:
+                # A run that cannot be journaled still runs
+                logger.error(f"Could not write to journal {self.path}: {e}")
+
+    def _sync(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def record_meta(self, **values):
+        self.meta.update(values)
+        self._append({"type": "meta", "value": values})
+
+    def record_stage(self, name, value):
+        self.stages[name] = value
+        self._append({"type": "stage", "name": name, "value": value})
+
+    def record_event(self, kind, **values):
+        entry = {"type": kind, **values}
+        self.events.append(entry)
+        self._append(entry)
+
+    def close(self):
+        with self._lock:
+            if self._file.closed:
+                return
+            if self._unsynced:
+                self._sync()
+            self._file.close()
+
+
+def prune_journals(root='.agent_cache/runs', keep=200):
+    # Removes the oldest journals beyond the newest `keep`
+    if not os.path.isdir(root):
+        return
+    paths = [os.path.join(root, name) for name in os.listdir(root) if name.endswith(".jsonl")]
+    paths.sort(key=os.path.getmtime)
+    for path in paths[:max(0, len(paths) - keep)]:
+        os.remove(path)
+
+
+def record_event(kind, **values):
+    # No-op outside a journaled run
+    journal = current_journal.get()
+    if journal is not None:
+        journal.record_event(kind, **values)
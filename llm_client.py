@@ -0,0 +1,96 @@
+import threading
+import logging
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+
+
+logger = logging.getLogger(__name__)
+
+
+class LLMClient:
+    def __init__(self, headers=None, pool_connections=4, pool_maxsize=16, max_concurrency=4, endpoint_limits=None, timeout=180):
+        self.headers = headers or {}
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        # Per-endpoint overrides, keyed by "scheme://host:port"
+        self.endpoint_limits = endpoint_limits or {}
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+        # A single session keeps connections to the model server alive between stages
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(self.headers)
+
+    def _endpoint_key(self, url):
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def _semaphore(self, url):
+        key = self._endpoint_key(url)
+        with self._lock:
+            if key not in self._semaphores:
+                limit = self.endpoint_limits.get(key, self.max_concurrency)
+                self._semaphores[key] = threading.BoundedSemaphore(limit)
+                logger.debug(f"Concurrency limit for {key}: {limit}")
+            return self._semaphores[key]
+
+    def post(self, url, payload, stream=True):
+        semaphore = self._semaphore(url)
+        semaphore.acquire()
+        try:
+            response = self.session.post(url, json=payload, stream=stream, timeout=self.timeout)
+            response.raise_for_status()
+        except Exception:
+            semaphore.release()
+            raise
+        if not stream:
+            semaphore.release()
+            return response
+        # Hold the slot until the streamed body has been consumed or closed
+        return _SlotResponse(response, semaphore)
+
+    def close(self):
+        self.session.close()
+
+
+class _SlotResponse:
+    def __init__(self, response, semaphore):
+        self._response = response
+        self._semaphore = semaphore
+        self._released = False
+        self._release_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    @property
+    def text(self):
+        try:
+            return self._response.text
+        finally:
+            self._release()
+
+    def iter_lines(self, *args, **kwargs):
+        try:
+            yield from self._response.iter_lines(*args, **kwargs)
+        finally:
+            self._release()
+
+    def close(self):
+        try:
+            self._response.close()
+        finally:
+            self._release()
+
+    def _release(self):
+        with self._release_lock:
+            if not self._released:
+                self._released = True
+                self._semaphore.release()
+
+    def __del__(self):
+        self._release()
@@ -1,17 +1,89 @@
-import logging
 import os
+import queue
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Longest payload (generated code, model output) written to the log as-is;
+# anything longer keeps its head and tail. None logs payloads in full.
+DEFAULT_PAYLOAD_LIMIT = 4000
+
+_listener = None
+_queue_handler = None
+_payload_limit = DEFAULT_PAYLOAD_LIMIT
+
+
+class Payload:
+    # Wraps a large blob passed as a logging argument. Nothing is copied,
+    # repr'd or truncated until a handler actually formats the record, so a
+    # disabled level costs only the wrapper.
+    __slots__ = ("text", "limit", "use_repr")
+
+    def __init__(self, text, limit=None, use_repr=False):
+        self.text = text
+        self.limit = limit
+        self.use_repr = use_repr
+
+    def __str__(self):
+        text = repr(self.text) if self.use_repr else str(self.text)
+        limit = self.limit if self.limit is not None else _payload_limit
+        if not limit or len(text) <= limit:
+            return text
+        head = limit * 3 // 4
+        tail = limit - head
+        return f"{text[:head]}\n... [{len(text) - limit} chars omitted] ...\n{text[-tail:]}"
+
 
-def setup_logging(log_file='test_agent.log', verbose=False):
-    log_dir = os.path.dirname(log_file)
-    if log_dir and not os.path.exists(log_dir):
-        os.makedirs(log_dir)
+def payload(text, limit=None, use_repr=False):
+    return Payload(text, limit, use_repr)
+
+
+class _DeferredQueueHandler(QueueHandler):
+    # The stock QueueHandler formats the message in the calling thread before
+    # queueing it. Records never leave this process, so hand them over as they
+    # are and let the listener thread do the formatting.
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(log_file='test_agent.log', verbose=False, max_bytes=10 * 1024 * 1024, backup_count=3, payload_limit=DEFAULT_PAYLOAD_LIMIT):
+    global _listener, _queue_handler, _payload_limit
 
     level = logging.DEBUG if verbose else logging.INFO
-    logging.basicConfig(
-        filename=log_file,
-        filemode='a',
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        level=level
-    )
+    root = logging.getLogger()
+    # Several agents may share the process; the most verbose one wins
+    if _listener is None or level < root.level:
+        root.setLevel(level)
+    _payload_limit = payload_limit
+
+    if _listener is None and not root.handlers:
+        log_dir = os.path.dirname(log_file)
+        if log_dir and not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+
+        file_handler = RotatingFileHandler(log_file, mode='a', maxBytes=max_bytes, backupCount=backup_count)
+        file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+        # Callers only enqueue records; a background thread formats and writes them
+        records = queue.SimpleQueue()
+        _queue_handler = _DeferredQueueHandler(records)
+        root.addHandler(_queue_handler)
+        _listener = QueueListener(records, file_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+
     logger = logging.getLogger(__name__)
     return logger
+
+
+def stop_logging():
+    # Flushes queued records and stops the writer thread
+    global _listener, _queue_handler
+    if _listener is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _listener.stop()
+        _listener = None
+        _queue_handler = None
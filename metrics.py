@@ -0,0 +1,207 @@
+import json
+import time
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+
+current_query = contextvars.ContextVar("current_query", default=None)
+
+
+@contextmanager
+def query_scope(query_id):
+    # Tags every record made in this context (and in stage threads started
+    # with a copy of it) with the query id
+    token = current_query.set(query_id)
+    try:
+        yield query_id
+    finally:
+        current_query.reset(token)
+
+
+class MetricsRecorder:
+    # Records are kept per query, for the last max_queries queries (and the
+    # last max_unscoped records made outside any query); older ones are only
+    # in jsonl_path, when set. The Prometheus totals cover every record.
+    def __init__(self, jsonl_path=None, max_queries=256, max_unscoped=10000):
+        self.jsonl_path = jsonl_path
+        self.max_queries = max_queries
+        self._queries = OrderedDict()
+        self._unscoped = deque(maxlen=max_unscoped)
+        self._generations = {}
+        self._timings = {}
+        self._lock = threading.Lock()
+
+    def _add(self, record):
+        record["timestamp"] = time.time()
+        record["query_id"] = current_query.get()
+        with self._lock:
+            if record["query_id"] is None:
+                self._unscoped.append(record)
+            else:
+                if record["query_id"] not in self._queries:
+                    self._queries[record["query_id"]] = []
+                    while len(self._queries) > self.max_queries:
+                        self._queries.popitem(last=False)
+                self._queries[record["query_id"]].append(record)
+            self._aggregate(record)
+            if self.jsonl_path:
+                with open(self.jsonl_path, 'a') as file:
+                    file.write(json.dumps(record) + "\n")
+        return record
+
+    def _aggregate(self, record):
+        if record["type"] == "generation":
+            key = (record["stage"], record["model"])
+            entry = self._generations.setdefault(key, {"count": 0, "seconds": 0.0, "ttft": 0.0, "prompt": 0, "completion": 0, "retries": 0, "hits": 0, "saved": 0})
+            entry["count"] += 1
+            entry["seconds"] += record["wall_time"]
+            entry["ttft"] += record["ttft"] or 0.0
+            entry["prompt"] += record["prompt_tokens"] or 0
+            entry["completion"] += record["completion_tokens"] or 0
+            entry["retries"] += record["retries"]
+            entry["hits"] += int(record["cache_hit"])
+            entry["saved"] += record.get("prefill_saved") or 0
+        else:
+            entry = self._timings.setdefault(record["kind"], {"count": 0, "seconds": 0.0})
+            entry["count"] += 1
+            entry["seconds"] += record["duration"]
+
+    def record_generation(self, stage, model, wall_time, ttft=None, prompt_tokens=None, completion_tokens=None, tokens_per_sec=None, retries=0, cache_hit=False, **extra):
+        record = {
+            "type": "generation",
+            "stage": stage,
+            "model": model,
+            "wall_time": round(wall_time, 4),
+            "ttft": round(ttft, 4) if ttft is not None else None,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "tokens_per_sec": round(tokens_per_sec, 2) if tokens_per_sec else None,
+            "retries": retries,
+            "cache_hit": cache_hit,
+        }
+        record.update(extra)
+        return self._add(record)
+
+    def record_timing(self, kind, duration, **labels):
+        record = {"type": "timing", "kind": kind, "duration": round(duration, 4)}
+        record.update(labels)
+        return self._add(record)
+
+    @contextmanager
+    def timer(self, kind, **labels):
+        started = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.record_timing(kind, time.perf_counter() - started, **labels)
+
+    def snapshot(self, query_id=None):
+        with self._lock:
+            if query_id is not None:
+                return list(self._queries.get(query_id, ()))
+            records = list(self._unscoped) + [record for records in self._queries.values() for record in records]
+        return sorted(records, key=lambda record: record["timestamp"])
+
+    def summary(self, query_id=None):
+        stages = {}
+        timings = {}
+        for record in self.snapshot(query_id):
+            if record["type"] == "generation":
+                stage = stages.setdefault(record["stage"], {
+                    "calls": 0, "wall_time": 0.0, "ttft": 0.0, "prompt_tokens": 0, "estimated_prompts": 0,
+                    "completion_tokens": 0, "retries": 0, "cache_hits": 0, "prefill_saved": 0,
+                    "live_wall_time": 0.0, "live_completion_tokens": 0
+                })
+                stage["calls"] += 1
+                stage["wall_time"] += record["wall_time"]
+                stage["ttft"] += record["ttft"] or 0.0
+                stage["prompt_tokens"] += record["prompt_tokens"] or 0
+                # Calls whose prompt count is the tokenizer's, not the server's
+                stage["estimated_prompts"] += int(bool(record.get("prompt_tokens_estimated")))
+                stage["completion_tokens"] += record["completion_tokens"] or 0
+                stage["retries"] += record["retries"]
+                stage["cache_hits"] += int(record["cache_hit"])
+                stage["prefill_saved"] += record.get("prefill_saved") or 0
+                if not record["cache_hit"]:
+                    stage["live_wall_time"] += record["wall_time"]
+                    stage["live_completion_tokens"] += record["completion_tokens"] or 0
+            else:
+                timing = timings.setdefault(record["kind"], {"count": 0, "duration": 0.0})
+                timing["count"] += 1
+                timing["duration"] += record["duration"]
+
+        for stage in stages.values():
+            live = stage["calls"] - stage["cache_hits"]
+            # Cached replies take no generation time; only live calls count
+            live_wall_time = stage.pop("live_wall_time")
+            live_completion_tokens = stage.pop("live_completion_tokens")
+            stage["tokens_per_sec"] = round(live_completion_tokens / live_wall_time, 2) if live_wall_time else None
+            stage["mean_ttft"] = round(stage.pop("ttft") / live, 4) if live else None
+            stage["wall_time"] = round(stage["wall_time"], 4)
+        for timing in timings.values():
+            timing["duration"] = round(timing["duration"], 4)
+        return {"stages": stages, "timings": timings}
+
+    def format_summary(self, query_id=None):
+        summary = self.summary(query_id)
+        lines = ["Metrics summary:"]
+        for name, stage in summary["stages"].items():
+            lines.append(
+                f"  {name:<14} calls {stage['calls']:>2}  wall {stage['wall_time']:7.2f}s  ttft {stage['mean_ttft'] or 0:5.2f}s  "
+                f"tokens {'~' if stage['estimated_prompts'] else ' '}{stage['prompt_tokens']:>6}/{stage['completion_tokens']:<6}  {stage['tokens_per_sec'] or 0:7.1f} tok/s  "
+                f"retries {stage['retries']}  cache hits {stage['cache_hits']}  prefill saved {stage['prefill_saved']}"
+            )
+        for kind, timing in summary["timings"].items():
+            lines.append(f"  {kind:<14} count {timing['count']:>2}  total {timing['duration']:7.2f}s")
+        return "\n".join(lines)
+
+    def export_jsonl(self, path, query_id=None):
+        with open(path, 'w') as file:
+            for record in self.snapshot(query_id):
+                file.write(json.dumps(record) + "\n")
+
+    def to_prometheus(self):
+        with self._lock:
+            generations = {key: dict(entry) for key, entry in self._generations.items()}
+            timings = {key: dict(entry) for key, entry in self._timings.items()}
+
+        metrics = [
+            ("agent_generation_seconds", "summary", "Wall time of model generations", "seconds"),
+            ("agent_generation_ttft_seconds", "summary", "Time to first token of model generations", "ttft"),
+            ("agent_prompt_tokens_total", "counter", "Prompt tokens evaluated by the model", "prompt"),
+            ("agent_completion_tokens_total", "counter", "Completion tokens generated by the model", "completion"),
+            ("agent_request_retries_total", "counter", "Retried model requests", "retries"),
+            ("agent_cache_hits_total", "counter", "Generations served from the response cache", "hits"),
+            ("agent_prefill_tokens_saved_total", "counter", "Estimated prompt tokens the server did not have to prefill again", "saved"),
+        ]
+        lines = []
+        for name, metric_type, help_text, field in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for (stage, model), entry in sorted(generations.items()):
+                labels = f'stage="{stage}",model="{model}"'
+                if metric_type == "summary":
+                    lines.append(f"{name}_sum{{{labels}}} {entry[field]:.6f}")
+                    lines.append(f"{name}_count{{{labels}}} {entry['count']}")
+                else:
+                    lines.append(f"{name}{{{labels}}} {entry[field]}")
+
+        lines.append("# HELP agent_timing_seconds Duration of test runs, compiles and executions")
+        lines.append("# TYPE agent_timing_seconds summary")
+        for kind, entry in sorted(timings.items()):
+            lines.append(f'agent_timing_seconds_sum{{kind="{kind}"}} {entry["seconds"]:.6f}')
+            lines.append(f'agent_timing_seconds_count{{kind="{kind}"}} {entry["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def export_prometheus(self, path):
+        with open(path, 'w') as file:
+            file.write(self.to_prometheus())
+
+
+_recorder = MetricsRecorder()
+
+
+def get_recorder():
+    return _recorder
@@ -0,0 +1,228 @@
+import re
+import json
+import time
+import threading
+import logging
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+logger = logging.getLogger(__name__)
+
+
+TOKEN_PATTERN = re.compile(r" ?[A-Za-z]+| ?\d+| ?[^\sA-Za-z\d]+|\s+")
+
+# Phrases from the templates in prompts.py, used to tell which stage a request is for
+STAGE_MARKERS = [
+    ("feedback", "The user has provided valuable feedback"),
+    ("tests", "Generate comprehensive tests"),
+    ("documentation", "Generate high-quality documentation"),
+    ("optimize", "Optimize the provided code"),
+    ("code", "Generate high-quality code"),
+    ("plan", "planning a software development project"),
+]
+
+LOG_STAGE_HEADERS = {
+    "Generated Plan:": "plan",
+    "Generated Code:": "code",
+    "Generated Tests:": "tests",
+    "Generated Documentation:": "documentation",
+    "Optimized Code:": "optimize",
+}
+
+LOG_LINE = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3} - \S+ - [A-Z]+ - (.*)$")
+
+TRAILING_EXPLANATION = (
+    "\n\nThis implementation follows the plan above. Each function is small and "
+    "documented, edge cases are handled explicitly, and the code has no external "
+    "dependencies, so it can be run directly with the standard interpreter.\n"
+)
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text)
+
+
+def detect_stage(prompt):
+    for stage, marker in STAGE_MARKERS:
+        if marker in prompt:
+            return stage
+    return "code"
+
+
+def load_recordings(log_path='agent.log'):
+    # Rebuilds model outputs from an agent log: the "Generated X:" blocks give
+    # the text and the raw NDJSON chunk lines give the inter-token interval.
+    recordings = {}
+    intervals = []
+    current_stage = None
+    current_lines = []
+    previous_created = None
+
+    def flush():
+        if current_stage and current_lines:
+            recordings.setdefault(current_stage, []).append("\n".join(current_lines).strip("\n"))
+
+    with open(log_path, 'r') as file:
+        for raw_line in file:
+            line = raw_line.rstrip("\n")
+            match = LOG_LINE.match(line)
+            if match:
+                flush()
+                current_stage = LOG_STAGE_HEADERS.get(match.group(1).strip())
+                current_lines = []
+                previous_created = None
+                continue
+            if line.startswith('{"model"'):
+                try:
+                    chunk = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                created = _parse_created_at(chunk.get("created_at"))
+                if created is not None and previous_created is not None:
+                    intervals.append(created - previous_created)
+                previous_created = created
+                continue
+            if current_stage:
+                current_lines.append(line)
+        flush()
+
+    interval = sorted(intervals)[len(intervals) // 2] if intervals else None
+    return recordings, interval
+
+
+def _parse_created_at(value):
+    # "2024-05-26T09:15:48.618787657Z" -> seconds within the day
+    if not value:
+        return None
+    match = re.search(r"T(\d{2}):(\d{2}):(\d{2}(?:\.\d+)?)", value)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+class RecordedResponder:
+    # Replays recorded outputs per stage, cycling through them. Code-producing
+    # stages are wrapped in a fence followed by an explanation, the way models
+    # usually answer.
+    def __init__(self, recordings, language='python'):
+        self.recordings = recordings
+        self.language = language
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, body):
+        stage = detect_stage(body.get("prompt", ""))
+        texts = self.recordings.get(stage) or self.recordings.get("code") or [""]
+        with self._lock:
+            index = self._counters.get(stage, 0)
+            self._counters[stage] = index + 1
+        text = texts[index % len(texts)]
+        if stage == "plan":
+            return text
+        return f"```{self.language}\n{text}\n```" + TRAILING_EXPLANATION
+
+
+class MockOllamaServer:
+    # A local stand-in for Ollama's /api/generate that streams NDJSON at a
+    # configurable token rate, after a configurable prompt-processing delay.
+    def __init__(self, responder, tokens_per_sec=60.0, latency=0.05, host='127.0.0.1', port=0):
+        self.responder = responder
+        self.tokens_per_sec = tokens_per_sec
+        self.latency = latency
+        self.requests = 0
+        self.tokens_sent = 0
+        self.model_seconds = 0.0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._server.handle_error = lambda request, client_address: None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api/generate"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _account(self, tokens, seconds):
+        with self._lock:
+            self.requests += 1
+            self.tokens_sent += tokens
+            self.model_seconds += seconds
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                if self.path != "/api/generate":
+                    self.send_error(404)
+                    return
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b"{}")
+                text = server.responder(body)
+                tokens = tokenize(text)
+                num_predict = body.get("options", {}).get("num_predict")
+                if num_predict:
+                    tokens = tokens[:num_predict]
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+
+                started = time.perf_counter()
+                delay = 1.0 / server.tokens_per_sec if server.tokens_per_sec else 0.0
+                sent = 0
+                try:
+                    time.sleep(server.latency)
+                    prompt_done = time.perf_counter()
+                    for token in tokens:
+                        self._write_chunk({"model": body.get("model"), "response": token, "done": False})
+                        sent += 1
+                        if delay:
+                            time.sleep(delay)
+                    finished = time.perf_counter()
+                    self._write_chunk({
+                        "model": body.get("model"),
+                        "response": "",
+                        "done": True,
+                        "prompt_eval_count": len(body.get("prompt", "")) // 4,
+                        "prompt_eval_duration": int((prompt_done - started) * 1e9),
+                        "eval_count": sent,
+                        "eval_duration": int((finished - prompt_done) * 1e9),
+                        "total_duration": int((finished - started) * 1e9),
+                        "context": list(range(len(body.get("prompt", "")) // 4 + sent))
+                    })
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client cancelled the generation, as it does after a closing code fence
+                    pass
+                finally:
+                    server._account(sent, time.perf_counter() - started)
+
+            def _write_chunk(self, chunk):
+                line = (json.dumps(chunk) + "\n").encode('utf-8')
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                self.wfile.flush()
+
+        return Handler
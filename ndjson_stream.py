@@ -0,0 +1,101 @@
+import json
+import time
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+def iter_ndjson(lines):
+    for line in lines:
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            logger.error(f"JSON Decode Error: {e}")
+            continue
+
+
+class CodeFenceExtractor:
+    # Incremental version of CoderAgent.extract_code: fed text fragments as they
+    # arrive, it reports when the first fenced block has been closed.
+    def __init__(self):
+        self._partial = ""
+        self._code_lines = []
+        self.in_code_block = False
+        self.blocks_closed = 0
+
+    @property
+    def done(self):
+        return self.blocks_closed > 0
+
+    @property
+    def code(self):
+        return "\n".join(self._code_lines)
+
+    def feed(self, fragment):
+        if self.done:
+            return
+        self._partial += fragment
+        while "\n" in self._partial and not self.done:
+            line, self._partial = self._partial.split("\n", 1)
+            self._process_line(line)
+
+    def finish(self):
+        if self._partial and not self.done:
+            self._process_line(self._partial)
+        self._partial = ""
+        return self.code
+
+    def _process_line(self, line):
+        if line.strip().startswith("```"):
+            self.in_code_block = not self.in_code_block
+            if not self.in_code_block:
+                self.blocks_closed += 1
+            return
+        if self.in_code_block:
+            self._code_lines.append(line)
+
+
+def consume_stream(response, stop_at_code_fence=False, cancel_event=None, stats=None):
+    # Reads an Ollama /api/generate NDJSON stream chunk by chunk. Returns the
+    # concatenated response text, the extracted code (or None when no
+    # extraction was requested) and the final chunk carrying server stats.
+    # When a stats dict is given it receives first_token_at and chunk counts.
+    if stats is None:
+        stats = {}
+    stats.setdefault("chunks", 0)
+    fragments = []
+    extractor = CodeFenceExtractor() if stop_at_code_fence else None
+    final_chunk = {}
+    try:
+        for chunk in iter_ndjson(response.iter_lines(decode_unicode=True)):
+            if cancel_event is not None and cancel_event.is_set():
+                logger.debug("Generation cancelled by caller")
+                # A cut-off stream must not be cached as a complete answer
+                discard = getattr(response, 'discard', None)
+                if discard is not None:
+                    discard()
+                break
+            fragment = chunk.get('response')
+            if fragment:
+                if not fragments:
+                    stats["first_token_at"] = time.perf_counter()
+                stats["chunks"] += 1
+                fragments.append(fragment)
+                if extractor is not None:
+                    extractor.feed(fragment)
+                    if extractor.done:
+                        logger.debug("Closing code fence seen; cancelling generation")
+                        stats["stopped_early"] = True
+                        break
+            if chunk.get('done'):
+                final_chunk = chunk
+                break
+    finally:
+        response.close()
+
+    content = ''.join(fragments)
+    code = extractor.finish() if extractor is not None else None
+    return content, code, final_chunk
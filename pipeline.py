@@ -0,0 +1,123 @@
+import time
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+logger = logging.getLogger(__name__)
+
+
+class Stage:
+    def __init__(self, name, func, depends_on=(), after=()):
+        self.name = name
+        self.func = func
+        self.depends_on = tuple(depends_on)
+        # Stages that only have to be finished, whether or not they succeeded
+        self.after = tuple(after)
+        self.start = None
+        self.end = None
+        self.status = "pending"
+
+    @property
+    def duration(self):
+        if self.start is None or self.end is None:
+            return 0.0
+        return self.end - self.start
+
+
+class StageGraph:
+    # Runs stages as soon as all of their dependencies have produced a result.
+    # A stage whose function returns None (or raises) counts as failed, and
+    # every stage depending on it is skipped.
+    def __init__(self, max_workers=4, on_complete=None):
+        self.max_workers = max_workers
+        # Called with (name, result) as each stage succeeds
+        self.on_complete = on_complete
+        self.stages = {}
+        self.results = {}
+        self._origin = None
+
+    def add(self, name, func, depends_on=(), after=()):
+        for dependency in tuple(depends_on) + tuple(after):
+            if dependency not in self.stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dependency}'")
+        self.stages[name] = Stage(name, func, depends_on, after)
+        return self
+
+    def run(self, completed=None):
+        # completed: results of stages finished by an earlier run, which are
+        # not run again
+        self._origin = time.perf_counter()
+        pending = dict(self.stages)
+        running = {}
+        for name, result in (completed or {}).items():
+            if name in pending:
+                pending.pop(name).status = "done"
+                self.results[name] = result
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    statuses = [self.stages[d].status for d in stage.depends_on]
+                    if any(status in ("failed", "skipped") for status in statuses):
+                        stage.status = "skipped"
+                        logger.info(f"Skipping stage '{name}': a dependency did not complete")
+                        del pending[name]
+                    elif all(status == "done" for status in statuses) and all(self.stages[d].status in ("done", "failed", "skipped") for d in stage.after):
+                        stage.status = "running"
+                        stage.start = time.perf_counter()
+                        # Each stage runs in a copy of the caller's context (query id, etc.)
+                        context = contextvars.copy_context()
+                        running[executor.submit(context.run, stage.func, self.results)] = stage
+                        del pending[name]
+
+                if not running:
+                    continue
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage = running.pop(future)
+                    stage.end = time.perf_counter()
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.error(f"Stage '{stage.name}' raised: {e}")
+                        result = None
+                    if result is None:
+                        stage.status = "failed"
+                    else:
+                        stage.status = "done"
+                        self.results[stage.name] = result
+                        if self.on_complete is not None:
+                            self.on_complete(stage.name, result)
+                    logger.debug(f"Stage '{stage.name}' {stage.status} in {stage.duration:.2f}s")
+
+        return self.results
+
+    def critical_path(self):
+        finished = [stage for stage in self.stages.values() if stage.end is not None]
+        if not finished:
+            return []
+        # Walk back from the last stage to finish through the predecessor,
+        # by depends_on or after, that finished last at each step: that
+        # chain bounds the wall time.
+        stage = max(finished, key=lambda s: s.end)
+        path = [stage]
+        while stage.depends_on or stage.after:
+            stage = max((self.stages[d] for d in stage.depends_on + stage.after), key=lambda s: s.end or 0)
+            path.append(stage)
+        return list(reversed(path))
+
+    def report(self):
+        lines = ["Stage timings:"]
+        for stage in sorted(self.stages.values(), key=lambda s: s.start or float('inf')):
+            if stage.start is None:
+                lines.append(f"  {stage.name:<16} {stage.status}")
+                continue
+            offset = stage.start - self._origin
+            lines.append(f"  {stage.name:<16} {stage.status:<8} start +{offset:6.2f}s  duration {stage.duration:6.2f}s")
+        path = self.critical_path()
+        if path:
+            total = path[-1].end - self._origin
+            lines.append(f"Critical path ({total:.2f}s): " + " -> ".join(stage.name for stage in path))
+        return "\n".join(lines)
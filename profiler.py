@@ -0,0 +1,149 @@
+import time
+import statistics
+import logging
+from workspace import Workspace
+from execution_manager import run_tests, dependency_paths
+from runner_pool import run_job_in_subprocess
+from metrics import get_recorder
+
+
+logger = logging.getLogger(__name__)
+
+
+# Timeout of the paired timing job, as a multiple of the test timeout
+TIMING_TIMEOUT_FACTOR = 4
+
+
+class Measurement:
+    # Per-pass timings of a test suite against one version of the code
+    def __init__(self, code, passed, times=None, loops=0, peak_memory=None, failure=None):
+        self.code = code
+        self.passed = passed
+        self.times = times or []
+        self.loops = loops
+        self.peak_memory = peak_memory
+        self.failure = failure
+
+    @property
+    def measured(self):
+        return self.passed and bool(self.times)
+
+    @property
+    def best(self):
+        return min(self.times) if self.times else None
+
+    @property
+    def median(self):
+        return statistics.median(self.times) if self.times else None
+
+    def describe(self):
+        if not self.passed:
+            return f"fails its tests: {self.failure}"
+        if not self.times:
+            return "passes its tests, but could not be timed"
+        memory = f", peak memory {self.peak_memory / 1024:.1f} KiB" if self.peak_memory is not None else ""
+        return f"{self.median * 1000:.3f} ms per pass over the tests (best {self.best * 1000:.3f} ms over {len(self.times)} runs){memory}"
+
+    def to_dict(self):
+        return {
+            "passed": self.passed,
+            "best": self.best,
+            "median": self.median,
+            "runs": len(self.times),
+            "loops": self.loops,
+            "peak_memory": self.peak_memory
+        }
+
+
+class Comparison:
+    # Two versions timed pass for pass in the same process; each pair of
+    # passes gives one ratio, so a result rests on every pair and not on
+    # two numbers taken at different times
+    def __init__(self, baseline, candidate):
+        self.baseline = baseline
+        self.candidate = candidate
+
+    @property
+    def measured(self):
+        return self.baseline.measured and self.candidate.measured
+
+    @property
+    def ratios(self):
+        # How many times faster the candidate was in each pair
+        if not self.measured:
+            return []
+        return [before / after for before, after in zip(self.baseline.times, self.candidate.times) if after > 0]
+
+    @property
+    def speedup(self):
+        ratios = self.ratios
+        return statistics.median(ratios) if ratios else None
+
+    @property
+    def wins(self):
+        # Share of pairs the candidate was faster in
+        ratios = self.ratios
+        return sum(1 for ratio in ratios if ratio > 1) / len(ratios) if ratios else 0.0
+
+    def faster(self, min_speedup):
+        # Faster in every pair, and by at least min_speedup at the median
+        return self.candidate.passed and bool(self.ratios) and self.wins == 1.0 and self.speedup >= 1 + min_speedup
+
+    def to_dict(self):
+        return {"speedup": self.speedup, "wins": self.wins, "ratios": self.ratios}
+
+
+class Profiler:
+    # Runs two versions of the code under the same tests in the test pool,
+    # then times them against each other in one worker; the tests are the
+    # only entry points into the generated code known to work, so they
+    # double as the benchmark workload.
+    def __init__(self, pool=None, deps=None, repeat=5, min_time=0.01, timeout=15, limits=None, workspace_dir=None, use_tmpfs=False):
+        self.pool = pool
+        self.deps = deps
+        self.repeat = repeat
+        self.min_time = min_time
+        self.timeout = timeout
+        self.limits = limits
+        self.workspace_dir = workspace_dir
+        self.use_tmpfs = use_tmpfs
+
+    def compare(self, baseline_code, candidate_code, tests):
+        started = time.perf_counter()
+        with Workspace(self.workspace_dir, use_tmpfs=self.use_tmpfs) as baseline_workspace, Workspace(self.workspace_dir, use_tmpfs=self.use_tmpfs) as candidate_workspace:
+            versions = [(baseline_code, baseline_workspace), (candidate_code, candidate_workspace)]
+            measurements = []
+            for code, workspace in versions:
+                result = run_tests(code, tests, "python", workspace=workspace, pool=self.pool, deps=self.deps, timeout=self.timeout, limits=self.limits)
+                measurements.append(Measurement(code, result.passed, failure=None if result.passed else result.failure_summary(max_traceback_lines=3)))
+            if all(measurement.passed for measurement in measurements):
+                self._time(versions, measurements)
+        comparison = Comparison(*measurements)
+        get_recorder().record_timing("profile", time.perf_counter() - started, passed=comparison.candidate.passed, speedup=comparison.speedup, wins=comparison.wins)
+        return comparison
+
+    def _time(self, versions, measurements):
+        paths = []
+        for code, _ in versions:
+            paths += [path for path in dependency_paths(code, self.deps) if path not in paths]
+        job = {
+            "variants": [{"root": workspace.root, "module_name": workspace.module_name, "test_module_name": workspace.test_module_name} for _, workspace in versions],
+            "paths": paths,
+            "repeat": self.repeat,
+            "min_time": self.min_time
+        }
+        # The paired passes run both suites many times over
+        timeout = self.timeout * TIMING_TIMEOUT_FACTOR
+        if self.pool is not None:
+            data = self.pool.run(job, timeout)
+        else:
+            data = run_job_in_subprocess(job, timeout, self.limits)
+        if data.get("returncode"):
+            logger.warning(f"Could not time the code: {data.get('error')}")
+            return
+        pairs = data.get("pairs") or []
+        peak_memory = data.get("peak_memory") or [None] * len(measurements)
+        for index, measurement in enumerate(measurements):
+            measurement.times = [pair[index] for pair in pairs]
+            measurement.loops = data.get("loops", 0)
+            measurement.peak_memory = peak_memory[index]
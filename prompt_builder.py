@@ -0,0 +1,167 @@
+import re
+import logging
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+
+class ApproximateTokenizer:
+    # Fast estimate for when no real tokenizer is configured: BPE vocabularies
+    # average roughly four characters of English or code per token.
+    def __init__(self, chars_per_token=4.0):
+        self.chars_per_token = chars_per_token
+
+    def count(self, text):
+        if not text:
+            return 0
+        return int(len(text) / self.chars_per_token) + 1
+
+
+class CallableTokenizer:
+    # Adapts anything with an encode() method (tiktoken, a HF tokenizer) or a
+    # plain function returning tokens or a count.
+    def __init__(self, tokenizer):
+        self.encode = tokenizer.encode if hasattr(tokenizer, "encode") else tokenizer
+
+    def count(self, text):
+        if not text:
+            return 0
+        tokens = self.encode(text)
+        return tokens if isinstance(tokens, int) else len(tokens)
+
+
+def make_tokenizer(tokenizer=None):
+    if tokenizer is None:
+        return ApproximateTokenizer()
+    if hasattr(tokenizer, "count"):
+        return tokenizer
+    return CallableTokenizer(tokenizer)
+
+
+_VOLATILE = [
+    (re.compile(r"0x[0-9a-fA-F]+"), "0x?"),
+    (re.compile(r"line \d+"), "line ?"),
+    (re.compile(r"\d+\.\d+s"), "?s"),
+    (re.compile(r"\s+"), " "),
+]
+
+
+def _normalize(message):
+    for pattern, replacement in _VOLATILE:
+        message = pattern.sub(replacement, message)
+    return message.strip()
+
+
+def _summary_line(message):
+    # The last non-empty line of a failure summary is usually the exception
+    lines = [line.strip() for line in message.strip().splitlines() if line.strip()]
+    return lines[-1] if lines else ""
+
+
+class FeedbackLog:
+    # Feedback accumulated over repair attempts. Repeats of an earlier message
+    # (ignoring addresses, line numbers and timings) are merged into it, only
+    # the newest entry is kept in full and older ones shrink to one line.
+    def __init__(self, max_entries=4):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, message):
+        message = str(message).strip()
+        if not message:
+            return
+        key = _normalize(message)
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            entry = {"message": message, "count": 0}
+        entry["message"] = message
+        entry["count"] += 1
+        self._entries[key] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def render(self, builder=None, max_tokens=None):
+        if not self._entries:
+            return ""
+        entries = list(self._entries.values())
+        lines = []
+        for entry in entries[:-1]:
+            repeats = f" (seen {entry['count']} times)" if entry["count"] > 1 else ""
+            lines.append(f"- Earlier attempt: {_summary_line(entry['message'])}{repeats}")
+        latest = entries[-1]
+        repeats = f" (seen {latest['count']} times)" if latest["count"] > 1 else ""
+        lines.append(f"- Latest attempt{repeats}: {latest['message']}")
+        text = "Additional feedback:\n" + "\n".join(lines)
+        if builder is not None and max_tokens is not None:
+            text = builder.truncate(text, max_tokens)
+        return text
+
+
+class PromptBuilder:
+    # Fills prompt templates so the whole prompt fits the stage's context
+    # budget: num_ctx minus the completion budget, unless set explicitly.
+    # When it does not fit, the largest fields are cut down to their head and
+    # tail.
+    def __init__(self, generation, tokenizer=None, context_budgets=None, feedback_budget=512, untrimmed_fields=("languages",)):
+        self.generation = generation
+        self.tokenizer = make_tokenizer(tokenizer)
+        self.context_budgets = context_budgets or {}
+        self.feedback_budget = feedback_budget
+        self.untrimmed_fields = set(untrimmed_fields)
+
+    def count(self, text):
+        return self.tokenizer.count(text)
+
+    def budget(self, stage):
+        if stage in self.context_budgets:
+            return self.context_budgets[stage]
+        num_ctx = self.generation.value(stage, "num_ctx", self.generation.num_ctx)
+        return max(256, num_ctx - self.generation.budget(stage))
+
+    def truncate(self, text, max_tokens):
+        tokens = self.count(text)
+        if tokens <= max_tokens:
+            return text
+        marker = "\n... [{} tokens omitted] ...\n"
+        # Scale by the text's own characters-per-token, then shrink until it fits
+        keep = int(len(text) * max_tokens / tokens)
+        while keep > 0:
+            head = keep * 2 // 3
+            tail = keep - head
+            candidate = text[:head] + marker.format(tokens - max_tokens) + (text[-tail:] if tail else "")
+            if self.count(candidate) <= max_tokens:
+                return candidate
+            keep = int(keep * 0.9)
+        return ""
+
+    def with_feedback(self, plan, feedback_log):
+        feedback = feedback_log.render(self, self.feedback_budget) if feedback_log else ""
+        return f"{plan}\n{feedback}" if feedback else plan
+
+    def build(self, stage, template, used=0, **fields):
+        # used: tokens already taken by a context the request continues from
+        fields = {name: "" if value is None else str(value) for name, value in fields.items()}
+        budget = self.budget(stage) - used
+        fixed = self.count(template.format(**{name: "" for name in fields}))
+        sizes = {name: self.count(value) for name, value in fields.items()}
+        total = fixed + sum(sizes.values())
+        if total <= budget:
+            return template.format(**fields)
+
+        # Share what is left after the fixed text evenly: fields smaller than
+        # their share stay whole, the rest are cut down to an equal cap
+        trimmable = sorted((name for name in fields if name not in self.untrimmed_fields), key=lambda name: sizes[name])
+        available = budget - fixed - sum(size for name, size in sizes.items() if name not in trimmable)
+        for index, name in enumerate(trimmable):
+            share = max(0, available) // (len(trimmable) - index)
+            if sizes[name] > share:
+                fields[name] = self.truncate(fields[name], share)
+                sizes[name] = self.count(fields[name])
+            available -= sizes[name]
+        total = fixed + sum(sizes.values())
+        logger.info("Trimmed the %s prompt to about %d tokens (budget %d)", stage, total, budget)
+        return template.format(**fields)
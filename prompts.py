@@ -13,8 +13,11 @@ The project plan should include the following essential components:
 Please provide a detailed plan based on these specifications.
 """
 
+# The templates below open with the same text wherever they share inputs
+# (plan first, then code), so a server that caches prompt prefixes can reuse
+# the previous stage's prefill.
 coding_integration_agent_prompt = """
-Based on the provided project plan:
+Based on the project plan:
 {plan}
 
 Generate high-quality code in the following programming languages: {languages}. Ensure the code is:
@@ -68,11 +71,26 @@ Optimize the provided code in the specified programming languages: {languages}.
 The optimized code should be designed to improve performance, reduce complexity, and enhance overall maintainability.
 """
 
+# Sent for another optimization round, with the measurements of the last one
+coding_optimization_followup_prompt = """
+Based on the following code:
+{code}
+
+It was timed by running its tests repeatedly:
+{measurements}
+
+Optimize the provided code further in the specified programming languages: {languages}. Keep its behaviour and public names unchanged so the same tests still pass. Ensure the optimized code is:
+
+*   Clean and properly formatted
+*   Free from installation commands like 'pip install'
+*   Measurably faster or lighter on memory than the code above
+"""
+
 feedback_prompt = """
-The user has provided valuable feedback on the generated code and tests. Here is the original code:
+Based on the following code:
 {code}
 
-And here is the user's feedback:
+The user has provided valuable feedback on the generated code and tests. Here is the user's feedback:
 {feedback}
 
 Please refine the code based on this feedback, ensuring it is corrected and improved according to the user's suggestions. Additionally, generate updated tests to verify the new code. Ensure the refined code and tests are:
@@ -83,3 +101,32 @@ Please refine the code based on this feedback, ensuring it is corrected and impr
 
 Dependencies should be handled separately and not included in the generated code or tests.
 """
+
+# Follow-ups sent together with the context returned by the planning request,
+# which already holds the plan; only what comes after it is sent again.
+coding_integration_followup_prompt = """
+Based on the project plan above:{feedback}
+
+Generate high-quality code in the following programming languages: {languages}. Ensure the code is:
+
+*   Clean and properly formatted
+*   Free from installation commands like 'pip install'
+*   Ready to execute without further modification
+
+Dependencies should be handled separately and not included in the generated code. Always use real URLs for placeholders, as they may return actual answers during testing.
+"""
+
+coding_testing_followup_prompt = """
+Based on the project plan above:{feedback}
+
+And the following code:
+{code}
+
+Generate comprehensive tests in the specified programming languages: {languages}. Ensure the tests are:
+
+*   Clean and properly formatted
+*   Free from installation commands like 'pip install'
+*   Ready to execute without further modification
+
+Dependencies should be handled separately and not included in the generated tests.
+"""
@@ -0,0 +1,188 @@
+import os
+import re
+import time
+import random
+import sqlite3
+import hashlib
+import threading
+import logging
+from array import array
+
+
+logger = logging.getLogger(__name__)
+
+
+STOP_WORDS = {
+    "a", "an", "the", "in", "on", "of", "for", "and", "or", "with", "using", "use", "that", "which",
+    "me", "my", "i", "please", "can", "you", "need", "want", "create", "make", "implement",
+    "generate", "build", "code", "program", "script", "some", "simple", "function", "method",
+}
+
+# Compared separately, through the detected language, so they are left out of the shingles
+LANGUAGE_WORDS = {"python", "javascript", "java", "csharp", "c", "cpp", "html", "css", "react", "js", "py"}
+
+SUFFIXES = ("ations", "ation", "ions", "ion", "ives", "ive", "ing", "ers", "er", "ed", "es", "s")
+
+MERSENNE_PRIME = (1 << 61) - 1
+
+
+def _stem(word):
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 4:
+            return word[:-len(suffix)]
+    return word
+
+
+def normalize(query):
+    words = re.findall(r"[a-z0-9#+]+", query.lower())
+    return [_stem(word) for word in words if word not in STOP_WORDS and word not in LANGUAGE_WORDS]
+
+
+# Copies of each kind of shingle in the set, so MinHash weighs them
+# accordingly: word order and numbers decide meaning ("celsius to
+# fahrenheit" is not "fahrenheit to celsius", "up to 10" is not "up to
+# 100"); character trigrams only smooth over wording
+WORD_WEIGHT = 2
+NUMBER_WEIGHT = 8
+BIGRAM_WEIGHT = 6
+TRIGRAM_WEIGHT = 1
+
+
+def _weighted(shingle, weight):
+    return {f"{shingle}|{copy}" for copy in range(weight)}
+
+
+def shingles(query):
+    # Words, ordered word pairs and character trigrams of each word.
+    # Numbers are matched whole: "up to 10" and "up to 100" differ.
+    words = normalize(query)
+    result = set()
+    for word in words:
+        result |= _weighted(f"w:{word}", NUMBER_WEIGHT if word.isdigit() else WORD_WEIGHT)
+        if word.isalpha():
+            padded = f"#{word}#"
+            for i in range(len(padded) - 2):
+                result |= _weighted(f"t:{padded[i:i + 3]}", TRIGRAM_WEIGHT)
+    for first, second in zip(words, words[1:]):
+        result |= _weighted(f"b:{first} {second}", BIGRAM_WEIGHT)
+    return result
+
+
+class MinHasher:
+    def __init__(self, num_perm=64, seed=1):
+        generator = random.Random(seed)
+        self.num_perm = num_perm
+        self._params = [(generator.randrange(1, MERSENNE_PRIME), generator.randrange(0, MERSENNE_PRIME)) for _ in range(num_perm)]
+
+    def signature(self, items):
+        hashes = [int.from_bytes(hashlib.blake2b(item.encode("utf-8"), digest_size=8).digest(), "little") for item in items]
+        if not hashes:
+            return array("Q", [MERSENNE_PRIME] * self.num_perm)
+        return array("Q", [min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in self._params])
+
+
+def similarity(first, second):
+    # Share of equal MinHash values estimates the Jaccard similarity of the shingle sets
+    return sum(1 for x, y in zip(first, second) if x == y) / len(first)
+
+
+class QueryMemory:
+    # Remembers the plan, tested code and tests of every successful query.
+    # Lookups use MinHash with LSH banding to find earlier queries whose
+    # shingles overlap by at least `threshold` and that targeted the same
+    # languages.
+    def __init__(self, path='.agent_cache/queries.sqlite', threshold=0.75, num_perm=64, bands=16):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.path = path
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS queries ("
+            " id INTEGER PRIMARY KEY, query TEXT, languages TEXT, signature BLOB,"
+            " plan TEXT, code TEXT, tests TEXT, created REAL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS bands (band INTEGER, bucket TEXT, query_id INTEGER)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS bands_bucket ON bands (band, bucket)")
+        self._conn.commit()
+
+    def _buckets(self, signature):
+        for band in range(self.bands):
+            values = signature[band * self.rows:(band + 1) * self.rows]
+            yield band, hashlib.blake2b(values.tobytes(), digest_size=8).hexdigest()
+
+    def lookup(self, query, languages, threshold=None):
+        threshold = self.threshold if threshold is None else threshold
+        items = shingles(query)
+        if not items:
+            # Nothing left after normalizing: every such query would look the same
+            return None
+        signature = self.hasher.signature(items)
+        key = ",".join(languages)
+        with self._lock:
+            candidates = set()
+            for band, bucket in self._buckets(signature):
+                rows = self._conn.execute("SELECT query_id FROM bands WHERE band = ? AND bucket = ?", (band, bucket)).fetchall()
+                candidates.update(row[0] for row in rows)
+
+            best = None
+            for query_id in candidates:
+                row = self._conn.execute(
+                    "SELECT query, languages, signature, plan, code, tests FROM queries WHERE id = ?", (query_id,)
+                ).fetchone()
+                if row is None or row[1] != key:
+                    continue
+                stored = array("Q")
+                stored.frombytes(row[2])
+                score = similarity(signature, stored)
+                if score >= threshold and (best is None or score > best["similarity"]):
+                    best = {"similarity": score, "query": row[0], "plan": row[3], "code": row[4], "tests": row[5]}
+
+            if best is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return best
+
+    def remember(self, query, languages, plan, code=None, tests=None):
+        items = shingles(query)
+        if not items:
+            return False
+        signature = self.hasher.signature(items)
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO queries (query, languages, signature, plan, code, tests, created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (query, ",".join(languages), signature.tobytes(), plan, code, tests, time.time())
+            )
+            self._conn.executemany(
+                "INSERT INTO bands (band, bucket, query_id) VALUES (?, ?, ?)",
+                [(band, bucket, cursor.lastrowid) for band, bucket in self._buckets(signature)]
+            )
+            self._conn.commit()
+        return True
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM queries").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
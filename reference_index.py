@@ -0,0 +1,303 @@
+import os
+import re
+import json
+import math
+import mmap
+import time
+import shutil
+import hashlib
+import threading
+import logging
+from array import array
+from collections import Counter
+
+
+logger = logging.getLogger(__name__)
+
+
+TOKEN_PATTERN = re.compile(r"[a-z][a-z0-9]*|\d+")
+CAMEL_BOUNDARY = re.compile(r"(?<=[a-z0-9])(?=[A-Z])")
+# snake_case and camelCase identifiers, the ones made of several parts
+COMPOUND_PATTERN = re.compile(r"\b[A-Za-z][A-Za-z0-9]*(?:_+[A-Za-z0-9]+)+\b|\b[a-z][a-z0-9]*[A-Z][A-Za-z0-9]*\b")
+
+
+def tokenize(text):
+    # Identifiers are indexed whole and by their parts, so an exact name
+    # outranks its words appearing apart: "parse_json" -> parse, json,
+    # parse_json; "parseJson" -> parse, json, parsejson
+    parts = TOKEN_PATTERN.findall(CAMEL_BOUNDARY.sub("_", text).lower())
+    return parts + [name.lower() for name in COMPOUND_PATTERN.findall(text)]
+
+
+def document_key(text, source, url=None):
+    return url or f"{source}:{hashlib.sha256(text.encode('utf-8')).hexdigest()[:24]}"
+
+
+class MemorySegment:
+    # Documents added since the last flush
+    def __init__(self):
+        self.docs = []
+        self.lengths = []
+        self.postings = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, doc, tokens):
+        doc_id = len(self.docs)
+        self.docs.append(doc)
+        self.lengths.append(len(tokens))
+        self.total_length += len(tokens)
+        for term, tf in Counter(tokens).items():
+            self.postings.setdefault(term, []).append((doc_id, tf))
+
+    def term_postings(self, term):
+        return self.postings.get(term, ())
+
+    def doc_frequency(self, term):
+        return len(self.postings.get(term, ()))
+
+    def length(self, doc_id):
+        return self.lengths[doc_id]
+
+    def doc(self, doc_id):
+        return self.docs[doc_id]
+
+    def keys(self):
+        return {doc["key"] for doc in self.docs}
+
+    def write(self, directory):
+        # Postings are flat uint32 (doc id, tf) pairs, per term in term order;
+        # documents are JSON lines addressed by a uint64 offset table
+        tmp = directory + ".tmp"
+        os.makedirs(tmp)
+        terms = {}
+        postings = array("I")
+        for term in sorted(self.postings):
+            entries = self.postings[term]
+            terms[term] = [len(postings) // 2, len(entries)]
+            for doc_id, tf in entries:
+                postings.append(doc_id)
+                postings.append(tf)
+        offsets = array("Q")
+        with open(os.path.join(tmp, "docs.bin"), "wb") as file:
+            for doc in self.docs:
+                offsets.append(file.tell())
+                file.write(json.dumps(doc).encode("utf-8") + b"\n")
+            offsets.append(file.tell())
+        with open(os.path.join(tmp, "postings.bin"), "wb") as file:
+            postings.tofile(file)
+        with open(os.path.join(tmp, "offsets.bin"), "wb") as file:
+            offsets.tofile(file)
+        with open(os.path.join(tmp, "lengths.bin"), "wb") as file:
+            array("I", self.lengths).tofile(file)
+        with open(os.path.join(tmp, "terms.json"), "w") as file:
+            json.dump(terms, file, separators=(",", ":"))
+        with open(os.path.join(tmp, "meta.json"), "w") as file:
+            json.dump({"docs": len(self.docs), "total_length": self.total_length, "keys": sorted(self.keys())}, file)
+        os.rename(tmp, directory)
+
+
+class DiskSegment:
+    # A flushed segment. Only the term table and the document keys are read
+    # into memory; postings, lengths and documents stay in mmapped files.
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json"), "r") as file:
+            meta = json.load(file)
+        with open(os.path.join(directory, "terms.json"), "r") as file:
+            self.terms = json.load(file)
+        self.doc_count = meta["docs"]
+        self.total_length = meta["total_length"]
+        self._keys = set(meta["keys"])
+        self._files = []
+        self._maps = []
+        self._postings = self._map("postings.bin", "I")
+        self._offsets = self._map("offsets.bin", "Q")
+        self._lengths = self._map("lengths.bin", "I")
+        self._docs = self._map("docs.bin", None)
+
+    def _map(self, name, typecode):
+        file = open(os.path.join(self.directory, name), "rb")
+        self._files.append(file)
+        if os.fstat(file.fileno()).st_size == 0:
+            return memoryview(b"").cast(typecode) if typecode else b""
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mapped)
+        return memoryview(mapped).cast(typecode) if typecode else mapped
+
+    def __len__(self):
+        return self.doc_count
+
+    def term_postings(self, term):
+        entry = self.terms.get(term)
+        if entry is None:
+            return ()
+        start, count = entry
+        pairs = self._postings[start * 2:(start + count) * 2]
+        return zip(pairs[0::2], pairs[1::2])
+
+    def doc_frequency(self, term):
+        entry = self.terms.get(term)
+        return entry[1] if entry else 0
+
+    def length(self, doc_id):
+        return self._lengths[doc_id]
+
+    def doc(self, doc_id):
+        return json.loads(self._docs[self._offsets[doc_id]:self._offsets[doc_id + 1]])
+
+    def docs(self):
+        for doc_id in range(self.doc_count):
+            yield self.doc(doc_id)
+
+    def keys(self):
+        return self._keys
+
+    def close(self):
+        for view in (self._postings, self._offsets, self._lengths):
+            if isinstance(view, memoryview):
+                view.release()
+        for mapped in self._maps:
+            mapped.close()
+        for file in self._files:
+            file.close()
+
+
+class ReferenceIndex:
+    # BM25 over scraped reference pages and tested code from earlier queries.
+    # New documents are searchable at once and written out as an immutable
+    # segment every flush_every documents; once there are more than
+    # max_segments, they are merged into one.
+    def __init__(self, path='.agent_cache/index', flush_every=16, max_segments=8, k1=1.2, b=0.75):
+        self.path = path
+        self.flush_every = flush_every
+        self.max_segments = max_segments
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+        self.segments = []
+        for name in sorted(os.listdir(path)):
+            directory = os.path.join(path, name)
+            if name.endswith(".tmp"):
+                # Left behind by a write that did not finish
+                shutil.rmtree(directory, ignore_errors=True)
+            elif name.startswith("segment_"):
+                self.segments.append(DiskSegment(directory))
+        self.buffer = MemorySegment()
+        self._keys = set()
+        for segment in self.segments:
+            self._keys.update(segment.keys())
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(segment) for segment in self.segments) + len(self.buffer)
+
+    def add(self, text, source, query=None, languages=None, url=None):
+        if not text or not text.strip():
+            return False
+        key = document_key(text, source, url)
+        tokens = tokenize(text)
+        if query:
+            # Match on the request the text was found or written for, too
+            tokens += tokenize(query)
+        doc = {"key": key, "source": source, "query": query, "languages": list(languages or []), "url": url, "text": text, "added": time.time()}
+        with self._lock:
+            if key in self._keys:
+                return False
+            self._keys.add(key)
+            self.buffer.add(doc, tokens)
+            if len(self.buffer) >= self.flush_every:
+                self.flush()
+        return True
+
+    def flush(self):
+        with self._lock:
+            if not len(self.buffer):
+                return
+            directory = os.path.join(self.path, f"segment_{time.time_ns():020d}")
+            self.buffer.write(directory)
+            self.segments.append(DiskSegment(directory))
+            self.buffer = MemorySegment()
+            if len(self.segments) > self.max_segments:
+                self.merge()
+
+    def merge(self):
+        with self._lock:
+            if len(self.segments) < 2:
+                return
+            merged = MemorySegment()
+            for segment in self.segments:
+                for doc in segment.docs():
+                    tokens = tokenize(doc["text"]) + (tokenize(doc["query"]) if doc.get("query") else [])
+                    merged.add(doc, tokens)
+            directory = os.path.join(self.path, f"segment_{time.time_ns():020d}")
+            merged.write(directory)
+            old = self.segments
+            self.segments = [DiskSegment(directory)]
+            for segment in old:
+                segment.close()
+                shutil.rmtree(segment.directory, ignore_errors=True)
+            logger.info(f"Merged {len(old)} index segments into one")
+
+    def search(self, query, k=5, source=None, language=None):
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        with self._lock:
+            segments = self.segments + [self.buffer]
+            total_docs = sum(len(segment) for segment in segments)
+            if not total_docs:
+                return []
+            average_length = sum(segment.total_length for segment in segments) / total_docs
+            scores = {}
+            for term in terms:
+                df = sum(segment.doc_frequency(term) for segment in segments)
+                if not df:
+                    continue
+                idf = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+                for index, segment in enumerate(segments):
+                    for doc_id, tf in segment.term_postings(term):
+                        norm = self.k1 * (1 - self.b + self.b * segment.length(doc_id) / average_length)
+                        scores[(index, doc_id)] = scores.get((index, doc_id), 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+            results = []
+            for (index, doc_id), score in sorted(scores.items(), key=lambda item: item[1], reverse=True):
+                doc = segments[index].doc(doc_id)
+                if source and doc["source"] != source:
+                    continue
+                if language and doc["languages"] and language not in doc["languages"]:
+                    continue
+                results.append({"score": score, **doc})
+                if len(results) >= k:
+                    break
+        return results
+
+    def snippets(self, query, k=3, max_chars=2000, source=None, language=None):
+        # The best matching paragraphs or code blocks of the top documents
+        terms = set(tokenize(query))
+        parts = []
+        budget = max_chars
+        for hit in self.search(query, k, source, language):
+            if budget <= 0:
+                break
+            if hit["source"] == "code":
+                # Generated code reads top to bottom; keep it in order
+                text = hit["text"][:budget]
+            else:
+                passages = [passage for passage in re.split(r"\n\s*\n", hit["text"]) if passage.strip()]
+                passages.sort(key=lambda passage: len(terms & set(tokenize(passage))), reverse=True)
+                text = "\n\n".join(passages)[:budget]
+            label = hit["url"] or f"code written for: {hit['query']}"
+            parts.append(f"[{label}]\n{text}")
+            budget -= len(text)
+        return "\n\n".join(parts)
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            for segment in self.segments:
+                segment.close()
+            self.segments = []
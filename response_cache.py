@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(model, prompt, options=None, context=None):
+    material = {"model": model, "prompt": prompt, "options": options or {}}
+    if context:
+        # A follow-up prompt means nothing without the context it continues
+        material["context"] = context
+    material = json.dumps(material, sort_keys=True)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path='.agent_cache/responses.sqlite', max_bytes=256 * 1024 * 1024, max_age=7 * 24 * 3600, bypass=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, model TEXT, content TEXT, final TEXT,"
+            " size INTEGER, created REAL, last_access REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._conn.commit()
+
+    def get(self, key):
+        if self.bypass:
+            return None
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT content, final, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.max_age and now - row[2] > self.max_age):
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return row[0], json.loads(row[1])
+
+    def put(self, key, model, content, final_chunk):
+        now = time.time()
+        final = json.dumps(final_chunk)
+        size = len(content.encode('utf-8')) + len(final)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, content, final, size, created, last_access) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model, content, final, size, now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        if self.max_age:
+            self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.max_age,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop least recently used entries until the cache fits again
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+        logger.debug(f"Evicted response cache entries down to {total} bytes")
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": size
+        }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def replay(self, key):
+        cached = self.get(key)
+        if cached is None:
+            return None
+        return CachedResponse(*cached)
+
+    def record(self, key, model, response):
+        return RecordingResponse(self, key, model, response)
+
+
+class CachedResponse:
+    # Mimics a streamed requests.Response so cached text goes through the same
+    # parsing path as a live generation.
+    status_code = 200
+    headers = {'Content-Type': 'application/x-ndjson', 'X-Agent-Cache': 'hit'}
+    from_cache = True
+
+    def __init__(self, content, final_chunk):
+        self.content = content
+        self.final_chunk = final_chunk
+
+    def iter_lines(self, decode_unicode=False, **kwargs):
+        yield json.dumps({"response": self.content, "done": False})
+        yield json.dumps(dict(self.final_chunk, response="", done=True))
+
+    def close(self):
+        pass
+
+
+class RecordingResponse:
+    # Tees the streamed NDJSON lines of a live response and stores the
+    # generated text once the consumer is finished with it. Streams that
+    # fail part-way are not stored.
+    from_cache = False
+
+    def __init__(self, cache, key, model, response):
+        self._cache = cache
+        self._key = key
+        self._model = model
+        self._response = response
+        self._fragments = []
+        self._final_chunk = {}
+        self._failed = False
+        self._stored = False
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def iter_lines(self, *args, **kwargs):
+        try:
+            for line in self._response.iter_lines(*args, **kwargs):
+                if line:
+                    try:
+                        chunk = json.loads(line)
+                    except (json.JSONDecodeError, TypeError):
+                        chunk = {}
+                    if chunk.get('response'):
+                        self._fragments.append(chunk['response'])
+                    if chunk.get('done'):
+                        self._final_chunk = {k: v for k, v in chunk.items() if k not in ('response', 'context')}
+                yield line
+        except Exception:
+            self._failed = True
+            raise
+
+    def discard(self):
+        self._failed = True
+
+    def close(self):
+        try:
+            self._response.close()
+        finally:
+            if not self._failed and not self._stored and self._fragments:
+                self._stored = True
+                self._cache.put(self._key, self._model, ''.join(self._fragments), self._final_chunk)
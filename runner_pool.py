@@ -0,0 +1,391 @@
+import io
+import os
+import sys
+import json
+import time
+import select
+import signal
+import subprocess
+import queue
+import importlib
+import traceback
+import threading
+import logging
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+logger = logging.getLogger(__name__)
+
+
+# Per-job limits: CPU seconds and address space in bytes
+DEFAULT_LIMITS = {"cpu": 30, "memory": 2 * 1024 ** 3}
+
+
+def _worker_main(conn, preload):
+    # Its own process group, so killing the worker also kills a job fork
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()
+    # Imports are paid once per worker instead of once per test attempt
+    for module_name in ("unittest", "suite_results") + tuple(preload):
+        try:
+            importlib.import_module(module_name)
+        except Exception:
+            pass
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        conn.send(run_isolated(job))
+
+
+def apply_limits(limits):
+    if resource is None or not limits:
+        return
+    for name, limit in (("cpu", resource.RLIMIT_CPU), ("memory", resource.RLIMIT_AS)):
+        if limits.get(name):
+            _, hard = resource.getrlimit(limit)
+            value = int(limits[name])
+            if hard != resource.RLIM_INFINITY:
+                value = min(value, hard)
+            resource.setrlimit(limit, (value, hard))
+
+
+def run_isolated(job):
+    # Runs the job in a fork of this (warm) worker, so its limits apply to
+    # that job alone and a runaway job is killed without losing the worker
+    run = compare_suites if "variants" in job else run_job
+    if not hasattr(os, "fork"):
+        return run(job)
+    timeout = job.get("timeout") or 60
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            apply_limits(job.get("limits"))
+            data = json.dumps(run(job))
+        except BaseException:
+            data = json.dumps({"returncode": 1, "error": traceback.format_exc()})
+        with os.fdopen(write_fd, "w") as file:
+            file.write(data)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(0)
+
+    os.close(write_fd)
+    chunks = []
+    deadline = time.monotonic() + timeout
+    timed_out = False
+    with os.fdopen(read_fd, "rb") as file:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([file], [], [], remaining)[0]:
+                timed_out = True
+                os.kill(pid, signal.SIGKILL)
+                break
+            chunk = os.read(file.fileno(), 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    _, status = os.waitpid(pid, 0)
+
+    if timed_out:
+        return {"returncode": 1, "timed_out": True, "error": f"Timed out after {timeout}s"}
+    try:
+        return json.loads(b"".join(chunks))
+    except json.JSONDecodeError:
+        if os.WIFSIGNALED(status) and os.WTERMSIG(status) == signal.SIGXCPU:
+            return {"returncode": 1, "timed_out": True, "error": f"CPU time limit of {job['limits']['cpu']}s exceeded"}
+        return {"returncode": 1, "error": f"Test process died with status {status}"}
+
+
+def run_job(job):
+    import unittest
+    from suite_results import RecordingTestResult
+
+    root = job["root"]
+    module_names = [job["module_name"], job["test_module_name"]]
+    # Directories holding the job's installed dependencies
+    paths = job.get("paths") or []
+    previous_cwd = os.getcwd()
+    sys.path[0:0] = [root] + paths
+    os.chdir(root)
+    stream = io.StringIO()
+    started = time.perf_counter()
+    try:
+        importlib.invalidate_caches()
+        try:
+            importlib.import_module(job["module_name"])
+            test_module = importlib.import_module(job["test_module_name"])
+        except ModuleNotFoundError as e:
+            return {"returncode": 1, "missing_module": e.name, "error": traceback.format_exc()}
+        except BaseException:
+            return {"returncode": 1, "error": traceback.format_exc()}
+
+        loader = unittest.defaultTestLoader
+        if job.get("only"):
+            suite = loader.loadTestsFromNames(job["only"], test_module)
+        else:
+            suite = loader.loadTestsFromModule(test_module)
+        runner = unittest.TextTestRunner(
+            stream=stream,
+            verbosity=1,
+            resultclass=lambda *args: RecordingTestResult(*args, module_name=job["test_module_name"])
+        )
+        result = runner.run(suite)
+        data = {
+            "returncode": 0 if result.wasSuccessful() else 1,
+            "outcomes": [outcome.to_dict() for outcome in result.outcomes],
+            "output": stream.getvalue(),
+            "duration": time.perf_counter() - started
+        }
+        return data
+    except BaseException:
+        return {"returncode": 1, "output": stream.getvalue(), "error": traceback.format_exc()}
+    finally:
+        # Generated modules must not leak into the next job
+        for name in module_names:
+            sys.modules.pop(name, None)
+        for name, module in list(sys.modules.items()):
+            if any((getattr(module, "__file__", None) or "").startswith(path) for path in paths):
+                sys.modules.pop(name, None)
+        for path in [root] + paths:
+            if path in sys.path:
+                sys.path.remove(path)
+        os.chdir(previous_cwd)
+
+
+def compare_suites(job):
+    # Times two versions of the code under their tests in one process, the
+    # way timeit does: every pass runs a suite `loops` times, with loops
+    # calibrated so a pass of either version lasts min_time. The passes
+    # alternate, baseline first in even repetitions and candidate first in
+    # odd ones, so drift in the machine's speed hits both sides of a pair
+    # alike. Peak memory comes from one extra pass each under tracemalloc.
+    import gc
+    import unittest
+    import tracemalloc
+    import contextlib
+
+    variants = job["variants"]
+    paths = job.get("paths") or []
+    module_names = [name for variant in variants for name in (variant["module_name"], variant["test_module_name"])]
+    budget = (job.get("timeout") or 60) / 2
+    previous_cwd = os.getcwd()
+    sys.path[0:0] = [variant["root"] for variant in variants] + paths
+    started = time.perf_counter()
+    try:
+        importlib.invalidate_caches()
+        test_modules = []
+        for variant in variants:
+            os.chdir(variant["root"])
+            importlib.import_module(variant["module_name"])
+            test_modules.append(importlib.import_module(variant["test_module_name"]))
+
+        def run_pass(index, loops):
+            os.chdir(variants[index]["root"])
+            # A suite drops its tests as it runs them; all are loaded up front
+            suites = [unittest.defaultTestLoader.loadTestsFromModule(test_modules[index]) for _ in range(loops)]
+            begin = time.perf_counter()
+            for suite in suites:
+                suite.run(unittest.TestResult())
+            return (time.perf_counter() - begin) / loops
+
+        pairs = []
+        gc_enabled = gc.isenabled()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+            gc.disable()
+            try:
+                loops = 1
+                while True:
+                    elapsed = min(run_pass(index, loops) for index in range(len(variants))) * loops
+                    if elapsed >= job.get("min_time", 0.01) or elapsed * 4 > budget:
+                        break
+                    loops *= 2
+                for repetition in range(job.get("repeat", 5)):
+                    if time.perf_counter() - started > budget:
+                        break
+                    order = range(len(variants)) if repetition % 2 == 0 else reversed(range(len(variants)))
+                    times = {}
+                    for index in order:
+                        gc.collect()
+                        times[index] = run_pass(index, loops)
+                    pairs.append([times[index] for index in range(len(variants))])
+            finally:
+                if gc_enabled:
+                    gc.enable()
+            peak_memory = []
+            for index in range(len(variants)):
+                tracemalloc.start()
+                try:
+                    run_pass(index, 1)
+                    peak_memory.append(tracemalloc.get_traced_memory()[1])
+                finally:
+                    tracemalloc.stop()
+        return {"returncode": 0, "pairs": pairs, "loops": loops, "peak_memory": peak_memory}
+    except BaseException:
+        return {"returncode": 1, "error": traceback.format_exc()}
+    finally:
+        for name in module_names:
+            sys.modules.pop(name, None)
+        for name, module in list(sys.modules.items()):
+            if any((getattr(module, "__file__", None) or "").startswith(path) for path in paths):
+                sys.modules.pop(name, None)
+        for path in [variant["root"] for variant in variants] + paths:
+            if path in sys.path:
+                sys.path.remove(path)
+        os.chdir(previous_cwd)
+
+
+def run_job_in_subprocess(job, timeout=60, limits=None):
+    # Same job format as the pool, for callers that do without one
+    job = dict(job, timeout=timeout, limits=job.get("limits") or limits or DEFAULT_LIMITS)
+    command = [sys.executable, os.path.abspath(__file__)]
+    try:
+        completed = subprocess.run(command, input=json.dumps(job), capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {"returncode": 1, "timed_out": True, "error": f"Timed out after {timeout}s"}
+    try:
+        return json.loads(completed.stdout)
+    except json.JSONDecodeError:
+        if completed.returncode == -signal.SIGXCPU:
+            return {"returncode": 1, "timed_out": True, "error": f"CPU time limit of {job['limits']['cpu']}s exceeded"}
+        return {"returncode": completed.returncode or 1, "error": completed.stderr or completed.stdout}
+
+
+class _Worker:
+    def __init__(self, context, preload):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, preload), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=1)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except (AttributeError, OSError):
+                self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class TestRunnerPool:
+    # Keeps warm Python interpreters around for running generated test
+    # suites. Each job runs in a fork of a worker under its own rlimits and
+    # wall-clock timeout; workers are replaced after max_jobs jobs, on a
+    # crash, or when a job gets past the timeout anyway. A suite can be split
+    # into up to `shards` jobs that run side by side.
+    def __init__(self, size=2, max_jobs=20, timeout=60, preload=(), limits=None, shards=None):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.timeout = timeout
+        self.preload = tuple(preload)
+        self.limits = limits or DEFAULT_LIMITS
+        self.shards = shards or size
+        # forkserver gives clean children even when the agent is multi-threaded
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self._context = multiprocessing.get_context(method)
+        self._idle = queue.Queue()
+        # Workers with a job in flight; close() waits for them
+        self._busy = set()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+        for _ in range(size):
+            self._idle.put(self._spawn())
+
+    def _spawn(self):
+        return _Worker(self._context, self.preload)
+
+    def run(self, job, timeout=None):
+        if self._closed:
+            raise RuntimeError("TestRunnerPool is closed")
+        timeout = timeout or self.timeout
+        job = dict(job, timeout=timeout, limits=job.get("limits") or self.limits)
+        worker = self._idle.get()
+        with self._lock:
+            self._busy.add(worker)
+        try:
+            worker.conn.send(job)
+            # The worker enforces the timeout itself; this is the backstop
+            if worker.conn.poll(timeout + 5):
+                result = worker.conn.recv()
+                worker.jobs += 1
+            else:
+                logger.error(f"Test job timed out after {timeout}s; recycling worker")
+                worker.kill()
+                result = {"returncode": 1, "timed_out": True, "error": f"Timed out after {timeout}s"}
+        except (EOFError, OSError) as e:
+            if not self._closed:
+                logger.error(f"Test worker crashed: {e}; starting a new one")
+            worker.kill()
+            result = {"returncode": 1, "error": f"Test worker crashed: {e}"}
+        finally:
+            self._release(worker)
+        return result
+
+    def run_many(self, jobs, timeout=None):
+        # Results in the order of jobs; they run on as many workers as are idle
+        if len(jobs) == 1:
+            return [self.run(jobs[0], timeout)]
+        with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+            return list(executor.map(lambda job: self.run(job, timeout), jobs))
+
+    def _release(self, worker):
+        with self._lock:
+            self._busy.discard(worker)
+            self._released.notify_all()
+            closed = self._closed
+        if closed:
+            worker.stop()
+            return
+        if worker.jobs >= self.max_jobs or not worker.process.is_alive():
+            worker.stop()
+            worker = self._spawn()
+        self._idle.put(worker)
+
+    def close(self, timeout=5):
+        # Jobs still running get up to timeout seconds to finish; their
+        # workers are killed after that
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        while not self._idle.empty():
+            self._idle.get().stop()
+        with self._lock:
+            self._released.wait_for(lambda: not self._busy, timeout)
+            busy = list(self._busy)
+        for worker in busy:
+            logger.warning("Killing a test worker that was still running a job")
+            worker.kill()
+
+
+if __name__ == '__main__':
+    # Generated code may print; keep stdout for the JSON result alone
+    result_stream = sys.stdout
+    sys.stdout = sys.stderr
+    job = json.loads(sys.stdin.read())
+    apply_limits(job.get("limits"))
+    run = compare_suites if "variants" in job else run_job
+    result_stream.write(json.dumps(run(job)) + "\n")
@@ -1,34 +1,69 @@
+import itertools
 import requests
+from urllib.parse import urlsplit, parse_qs
 from bs4 import BeautifulSoup
+from http_cache import CachingFetcher
+from html_extract import extract_text, charset_from_content_type
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
 
 class WebSearcher:
-    def __init__(self, model):
+    def __init__(self, model, fetcher=None, search_url="https://www.google.com/search", search_ttl=6 * 3600, page_ttl=3600, max_page_bytes=2 * 1024 * 1024, max_chars=20000):
         self.model = model
+        self.fetcher = fetcher or CachingFetcher(headers={'User-Agent': USER_AGENT})
+        self.search_url = search_url
+        # First label of the search engine's host ("google" for www.google.com);
+        # the engine's other sites and services are never results
+        host = (urlsplit(search_url).hostname or "").lower()
+        labels = host.removeprefix("www.").split(".")
+        self.engine_name = None if host.replace(".", "").isdigit() or len(labels) < 2 else labels[0]
+        self.search_ttl = search_ttl
+        self.page_ttl = page_ttl
+        # Pages are read up to max_page_bytes and reduced to max_chars of text
+        self.max_page_bytes = max_page_bytes
+        self.max_chars = max_chars
 
     def fetch_search_results(self, query):
-        search_url = f"https://www.google.com/search?q={query}"
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(search_url, headers=headers)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        search_results = soup.select('.BVG0Nb')
-        return [result.get_text() for result in search_results]
+        # Search result pages change slowly, so they are served from the cache for search_ttl
+        body = self.fetcher.get(self.search_url, ttl=self.search_ttl, params={"q": query})
+        soup = BeautifulSoup(body, 'html.parser')
+        results = []
+        for link in soup.select('a[href]'):
+            url = self._result_url(link['href'])
+            if url and not self._engine_host(url) and url not in results:
+                results.append(url)
+        return results
+
+    def _engine_host(self, url):
+        # maps.google.com, accounts.google.com, webcache.googleusercontent.com, ...
+        host = (urlsplit(url).hostname or "").lower()
+        if host == urlsplit(self.search_url).hostname:
+            return True
+        return self.engine_name is not None and any(label.startswith(self.engine_name) for label in host.split("."))
+
+    def _result_url(self, href):
+        # Google wraps result links as /url?q=<target>&...
+        if href.startswith('/url?'):
+            href = parse_qs(urlsplit(href).query).get('q', [''])[0]
+        return href if href.startswith(('http://', 'https://')) else None
 
     def get_search_page(self, search_results, query):
         return search_results[0] if search_results else None
 
+    def get_search_pages(self, search_results, query, top_n=3):
+        return search_results[:top_n]
+
     def scrape_website_content(self, website_url):
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
+        headers = {}
+        chunks = self.fetcher.iter_get(website_url, ttl=self.page_ttl, max_bytes=self.max_page_bytes, response_headers=headers)
         try:
-            response = requests.get(website_url, headers=headers, timeout=15)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.content, 'html.parser')
-            text = soup.get_text(separator='\n')
-            clean_text = '\n'.join([line.strip() for line in text.splitlines() if line.strip()])
-            return {website_url: clean_text}
+            # The first chunk comes with the headers, and so with the charset
+            first = next(chunks, b"")
+            encoding = charset_from_content_type(headers.get("Content-Type"))
+            # Parsed as it downloads; code blocks come first in the result
+            return {website_url: extract_text(itertools.chain([first], chunks), self.max_chars, encoding)}
         except requests.exceptions.RequestException as e:
             print(f"Error retrieving content from {website_url}: {e}")
             return {website_url: f"Failed to retrieve content due to an error: {e}"}
+        finally:
+            chunks.close()
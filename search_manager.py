@@ -1,28 +1,60 @@
-from search import WebSearcher
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from search import WebSearcher, USER_AGENT
+from http_cache import HttpCache, HostRateLimiter, CachingFetcher
 from termcolor import colored
 class SearchManager:
-    def __init__(self, model_qa):
+    def __init__(self, model_qa, verbose=False, top_n=3, max_workers=4, cache_path='.agent_cache/http.sqlite', use_cache=True, host_rates=None, default_rate=2.0, search_url="https://www.google.com/search", search_ttl=6 * 3600, page_ttl=3600, index=None):
         self.model_qa = model_qa
+        self.verbose = verbose
+        self.top_n = top_n
+        self.index = index
+        # One fetcher (session, cache and per-host limits) shared by every lookup
+        self.fetcher = CachingFetcher(
+            cache=HttpCache(cache_path) if use_cache else None,
+            rate_limiter=HostRateLimiter(default_rate, host_rates),
+            headers={'User-Agent': USER_AGENT},
+            pool_maxsize=max_workers * 2
+        )
+        self.searcher = WebSearcher(self.model_qa, self.fetcher, search_url, search_ttl, page_ttl)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def iter_code_references(self, query):
+        # Yields {url: text} for each of the top pages as soon as it has been fetched
+        try:
+            search_results = self.searcher.fetch_search_results(query)
+        except Exception as e:
+            print(colored(f"Search failed: {e}", 'red'))
+            return
 
-    def fetch_code_reference(self, query):
-        search = WebSearcher(self.model_qa)
-        search_results = search.fetch_search_results(query)
-        
         if not search_results:
             print(colored("No search results found; skipping reference fetching.", 'red'))
-            return {}
-        
-        best_page = search.get_search_page(search_results, query)
-        
-        if not best_page:
-            print(colored("No valid search page found; skipping reference fetching.", 'red'))
-            return {}
-
-        results_dict = search.scrape_website_content(best_page)
+            return
 
+        pages = self.searcher.get_search_pages(search_results, query, self.top_n)
         if self.verbose:
             print(colored(f"SEARCH RESULTS {search_results}", 'yellow'))
+
+        futures = [self.executor.submit(self.searcher.scrape_website_content, page) for page in pages]
+        for future in as_completed(futures):
+            page = future.result()
+            if self.index is not None:
+                for url, text in page.items():
+                    if not text.startswith("Failed to retrieve content"):
+                        self.index.add(text, "web", query=query, url=url)
+            yield page
+
+    def fetch_code_reference(self, query):
+        results_dict = {}
+        for page in self.iter_code_references(query):
+            results_dict.update(page)
+
+        if self.verbose:
             print(colored(f"RESULTS DICT {results_dict}", 'yellow'))
 
         return results_dict
 
+    def close(self):
+        # Fetches already running still use the session and the cache, so
+        # they are waited for (queued ones are dropped) before those close
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.fetcher.close()
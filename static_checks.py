@@ -0,0 +1,347 @@
+import re
+import ast
+import sys
+import builtins
+import textwrap
+import importlib.util
+
+
+MODULE_NAMES = {"__name__", "__file__", "__doc__", "__builtins__", "__spec__", "__loader__", "__package__", "__path__", "__annotations__", "__class__"}
+BUILTIN_NAMES = set(dir(builtins)) | MODULE_NAMES
+
+# Clause keywords and the statements they have to line up with
+CLAUSE_OPENERS = {
+    "elif": ("if", "elif"),
+    "else": ("if", "elif", "for", "while", "try", "except"),
+    "except": ("try", "except"),
+    "finally": ("try", "except", "else"),
+}
+
+INDENT = 4
+
+
+def _indent(line):
+    return len(line) - len(line.lstrip(" "))
+
+
+def _is_code(line):
+    stripped = line.strip()
+    return bool(stripped) and not stripped.startswith("#")
+
+
+def _previous(lines, index):
+    for i in range(index - 1, -1, -1):
+        if _is_code(lines[i]):
+            return i
+    return None
+
+
+def _shift_block(lines, index, new_indent, siblings=True):
+    # Moves lines[index] to new_indent together with the lines nested under
+    # it and, with siblings, the lines that follow it at the same level
+    old_indent = _indent(lines[index])
+    delta = new_indent - old_indent
+    if not delta:
+        return False
+    for i in range(index, len(lines)):
+        if i > index and _is_code(lines[i]) and (_indent(lines[i]) < old_indent or (_indent(lines[i]) == old_indent and not siblings)):
+            break
+        if lines[i].strip():
+            lines[i] = " " * max(0, _indent(lines[i]) + delta) + lines[i].lstrip(" ")
+    return True
+
+
+def _open_levels(lines, index):
+    # Indentation levels of the blocks still open at lines[index]
+    levels = [0]
+    for line in lines[:index]:
+        if not _is_code(line):
+            continue
+        indent = _indent(line)
+        while levels and levels[-1] > indent:
+            levels.pop()
+        if not levels or levels[-1] < indent:
+            levels.append(indent)
+    return levels
+
+
+def _align_clause(lines, index):
+    # else/elif/except/finally at the wrong level: line it up with the
+    # nearest statement further out that it can belong to
+    words = lines[index].strip().split(None, 1)
+    keyword = words[0].rstrip(":") if words else ""
+    openers = CLAUSE_OPENERS.get(keyword)
+    if openers is None:
+        return False
+    indent = _indent(lines[index])
+    for i in range(index - 1, -1, -1):
+        if not _is_code(lines[i]):
+            continue
+        first = re.split(r"[\s:(]", lines[i].strip(), 1)[0]
+        if first in openers and _indent(lines[i]) != indent and lines[i].rstrip().endswith(":"):
+            return _shift_block(lines, index, _indent(lines[i]))
+    return False
+
+
+def repair_indentation(code, max_fixes=50):
+    # Returns code unchanged when it already parses. Otherwise lets the
+    # parser point at each indentation error in turn and fixes just that
+    # line and its block; the repair is only used if the result parses, so
+    # code is never made worse.
+    try:
+        ast.parse(code)
+        return code
+    except SyntaxError:
+        pass
+
+    text = textwrap.dedent(code.expandtabs(INDENT))
+    lines = text.splitlines()
+    for _ in range(max_fixes):
+        source = "\n".join(lines)
+        try:
+            ast.parse(source)
+            return source
+        except SyntaxError as e:
+            if not e.lineno or e.lineno > len(lines):
+                break
+            index = e.lineno - 1
+            message = e.msg or ""
+            if message.startswith("expected an indented block"):
+                previous = _previous(lines, index)
+                fixed = _shift_block(lines, index, (_indent(lines[previous]) if previous is not None else 0) + INDENT, siblings=False)
+            elif message.startswith("unexpected indent"):
+                previous = _previous(lines, index)
+                fixed = _shift_block(lines, index, _indent(lines[previous]) if previous is not None else 0)
+            elif message.startswith("unindent does not match"):
+                # Snap to the closest enclosing level, the outer one on a tie
+                indent = _indent(lines[index])
+                fixed = _shift_block(lines, index, min(_open_levels(lines, index), key=lambda level: (abs(level - indent), level)))
+            else:
+                fixed = _align_clause(lines, index)
+            if not fixed:
+                break
+    return code
+
+
+def problem(kind, where, line, message):
+    return {"kind": kind, "file": where, "line": line, "message": message}
+
+
+def _binds(node):
+    # Names bound by this node itself, not by its children
+    if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+        return {node.id}
+    if isinstance(node, ast.arg):
+        return {node.arg}
+    if isinstance(node, (ast.Import, ast.ImportFrom)):
+        return {alias.asname or alias.name.split(".")[0] for alias in node.names if alias.name != "*"}
+    if isinstance(node, (ast.Global, ast.Nonlocal)):
+        return set(node.names)
+    names = set()
+    if not isinstance(node, ast.alias) and isinstance(getattr(node, "name", None), str):
+        # Functions, classes, except ... as, match captures, type parameters
+        names.add(node.name)
+    if isinstance(getattr(node, "rest", None), str):
+        names.add(node.rest)
+    return names
+
+
+def bound_names(tree):
+    # Every name the code binds anywhere. Scopes are ignored on purpose:
+    # a name counts as defined if anything defines it, so only names that
+    # can never resolve are reported.
+    names = set()
+    for node in ast.walk(tree):
+        names.update(_binds(node))
+    return names
+
+
+def top_level_names(tree):
+    # Names a module binds at import time, outside function and class bodies
+    names = set()
+    pending = list(ast.iter_child_nodes(tree))
+    while pending:
+        node = pending.pop()
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif not isinstance(node, ast.Lambda):
+            names.update(_binds(node))
+            pending.extend(ast.iter_child_nodes(node))
+    return names
+
+
+def _star_imports(tree):
+    return [node for node in ast.walk(tree) if isinstance(node, ast.ImportFrom) and any(alias.name == "*" for alias in node.names)]
+
+
+def declared_all(tree):
+    # The names a literal __all__ lists, or None when there is no __all__ or
+    # it is built in a way that cannot be read without running the code
+    names = None
+    for node in tree.body:
+        if isinstance(node, (ast.Assign, ast.AugAssign, ast.AnnAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            if not any(isinstance(target, ast.Name) and target.id == "__all__" for target in targets):
+                continue
+            if not isinstance(node.value, (ast.List, ast.Tuple)) or not all(isinstance(item, ast.Constant) and isinstance(item.value, str) for item in node.value.elts):
+                return None
+            listed = {item.value for item in node.value.elts}
+            names = (names or set()) | listed if isinstance(node, ast.AugAssign) else listed
+        elif isinstance(node, ast.Expr) and isinstance(node.value, ast.Call) and isinstance(node.value.func, ast.Attribute):
+            # __all__.append(...) / __all__.extend(...)
+            if isinstance(node.value.func.value, ast.Name) and node.value.func.value.id == "__all__":
+                return None
+    return names
+
+
+def _annotation_nodes(tree):
+    # With postponed evaluation, names in annotations are never looked up
+    if not any(isinstance(node, ast.ImportFrom) and node.module == "__future__" and any(alias.name == "annotations" for alias in node.names) for node in tree.body):
+        return set()
+    annotations = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.arg) and node.annotation is not None:
+            annotations.append(node.annotation)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.returns is not None:
+            annotations.append(node.returns)
+        elif isinstance(node, ast.AnnAssign):
+            annotations.append(node.annotation)
+    return {id(child) for annotation in annotations for child in ast.walk(annotation)}
+
+
+def undefined_names(tree, where, available=(), star_modules=()):
+    # star_modules: modules whose star imports `available` already accounts for
+    if any(node.module not in star_modules or node.level for node in _star_imports(tree)):
+        return []
+    known = bound_names(tree) | BUILTIN_NAMES | set(available)
+    skipped = _annotation_nodes(tree)
+    problems = []
+    reported = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Name) or not isinstance(node.ctx, ast.Load) or id(node) in skipped:
+            continue
+        if node.id in known or node.id in reported:
+            continue
+        reported.add(node.id)
+        if node.id in sys.stdlib_module_names:
+            problems.append(problem("missing_import", where, node.lineno, f"'{node.id}' is used but never imported; add 'import {node.id}'"))
+        else:
+            problems.append(problem("undefined_name", where, node.lineno, f"'{node.id}' is used but never defined or imported"))
+    return sorted(problems, key=lambda item: item["line"])
+
+
+def _resolvable(module):
+    top = module.split(".")[0]
+    if top in sys.builtin_module_names or top in sys.stdlib_module_names:
+        return True
+    try:
+        return importlib.util.find_spec(top) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def _syntax_problem(error, where):
+    text = (error.text or "").strip()
+    message = f"{error.msg}: {text}" if text else error.msg
+    return problem("syntax", where, error.lineno, message)
+
+
+def prevalidate(code, tests, module_name):
+    # Parses the code and tests and checks them against each other without
+    # running anything. Returns (code, tests, problems): the code with its
+    # indentation repaired, the tests with imports of a guessed module name
+    # pointed at the real one, and what would still fail.
+    code = repair_indentation(code)
+    try:
+        code_tree = ast.parse(code)
+    except SyntaxError as e:
+        return code, tests, [_syntax_problem(e, "code")]
+    problems = undefined_names(code_tree, "code")
+
+    if tests is None:
+        return code, tests, problems
+    tests = repair_indentation(textwrap.dedent(tests))
+    try:
+        tests_tree = ast.parse(tests)
+    except SyntaxError as e:
+        return code, tests, problems + [_syntax_problem(e, "tests")]
+
+    module_names = top_level_names(code_tree)
+    # Defined here rather than imported: what a test's "from <module> import ..." is after
+    defined = {node.name for node in code_tree.body if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))} | {
+        target.id for node in code_tree.body if isinstance(node, (ast.Assign, ast.AnnAssign))
+        for target in (node.targets if isinstance(node, ast.Assign) else [node.target]) if isinstance(target, ast.Name)
+    }
+    lines = tests.splitlines()
+    # The module under test under every name the tests import it by
+    guessed = {module_name}
+    for node in ast.walk(tests_tree):
+        if isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names = [alias.name for alias in node.names if alias.name != "*"]
+            if node.module != module_name:
+                # A star import of a module that does not exist can only mean the module under test
+                if _resolvable(node.module) or not (len(names) < len(node.names) or any(name in defined for name in names)):
+                    continue
+                # The tests guessed a name for the module under test
+                lines[node.lineno - 1] = re.sub(rf"\bfrom\s+{re.escape(node.module)}\b", f"from {module_name}", lines[node.lineno - 1], count=1)
+                guessed.add(node.module)
+            for name in names:
+                if name not in module_names:
+                    problems.append(problem("unknown_test_import", "tests", node.lineno, f"the tests import '{name}' from the module under test, which does not define it"))
+        elif isinstance(node, ast.Import) and node.lineno == node.end_lineno:
+            aliases = []
+            for alias in node.names:
+                used = {
+                    child.attr for child in ast.walk(tests_tree)
+                    if isinstance(child, ast.Attribute) and isinstance(child.value, ast.Name) and child.value.id == (alias.asname or alias.name)
+                }
+                if "." not in alias.name and not _resolvable(alias.name) and used & defined:
+                    alias = ast.alias(name=module_name, asname=alias.asname or alias.name)
+                aliases.append(alias)
+            line = lines[node.lineno - 1]
+            rewritten = ast.unparse(ast.Import(names=aliases))
+            if rewritten != ast.unparse(node):
+                lines[node.lineno - 1] = line[:node.col_offset] + rewritten + line[node.end_col_offset:]
+    tests = "\n".join(lines)
+
+    # The test file starts with "import unittest" and "from <module> import *",
+    # which brings in what __all__ lists or else every public name
+    listed = declared_all(code_tree)
+    if listed is not None:
+        exported = listed & module_names
+    elif "__all__" in module_names:
+        exported = module_names
+    else:
+        exported = {name for name in module_names if not name.startswith("_")}
+    if not _star_imports(code_tree):
+        for item in undefined_names(tests_tree, "tests", exported | {"unittest"}, guessed):
+            name = item["message"].split("'")[1]
+            if name in module_names:
+                reason = "not in its __all__" if listed is not None else "private"
+                item["message"] = f"'{name}' is defined by the module under test but {reason}, so the tests' star import does not bring it in"
+            problems.append(item)
+    return code, tests, problems
+
+
+
+def test_names(tests):
+    # "Class.test_method" for every test in the suite, or None when the
+    # loader could find tests this cannot see (inherited or built by load_tests)
+    try:
+        tree = ast.parse(tests)
+    except SyntaxError:
+        return None
+    classes = {node.name: node for node in tree.body if isinstance(node, ast.ClassDef)}
+    if "load_tests" in top_level_names(tree):
+        return None
+    names = []
+    for node in classes.values():
+        bases = [ast.unparse(base) for base in node.bases]
+        if any(base in classes for base in bases):
+            return None
+        if any(base.split(".")[-1] in ("TestCase", "IsolatedAsyncioTestCase") for base in bases):
+            names += [
+                f"{node.name}.{item.name}" for item in node.body
+                if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)) and item.name.startswith("test")
+            ]
+    return names
@@ -0,0 +1,183 @@
+import time
+import unittest
+
+
+class TestOutcome:
+    def __init__(self, name, status, traceback=None, duration=0.0):
+        self.name = name
+        self.status = status
+        self.traceback = traceback
+        self.duration = duration
+
+    def to_dict(self):
+        return {"name": self.name, "status": self.status, "traceback": self.traceback, "duration": self.duration}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["name"], data["status"], data.get("traceback"), data.get("duration", 0.0))
+
+
+class SuiteResult:
+    # Outcome of one test run. returncode mirrors what `python test_file.py`
+    # would have exited with, so callers that only care about pass/fail can
+    # keep comparing it to 0.
+    def __init__(self, returncode, outcomes=None, output="", error=None, timed_out=False, missing_module=None, duration=0.0, problems=None, errors=None):
+        self.returncode = returncode
+        self.outcomes = outcomes or []
+        self.output = output
+        self.error = error
+        self.timed_out = timed_out
+        self.missing_module = missing_module
+        self.duration = duration
+        # Static check findings when the run was stopped before starting
+        self.problems = problems or []
+        # Every shard's error when the suite was run in shards
+        self.errors = errors or ([error] if error else [])
+
+    @property
+    def passed(self):
+        return self.returncode == 0
+
+    @property
+    def failing(self):
+        return [outcome for outcome in self.outcomes if outcome.status in ("failure", "error", "unexpected_success")]
+
+    @property
+    def failing_names(self):
+        return [outcome.name for outcome in self.failing]
+
+    @property
+    def loaded(self):
+        # False when the generated module or the tests could not even be imported
+        return self.error is None or bool(self.outcomes)
+
+    @property
+    def tests_broken(self):
+        # Whether the tests, rather than only the code, need to be rewritten
+        if self.problems:
+            return any(item["file"] == "tests" for item in self.problems)
+        return not self.loaded
+
+    def counts(self):
+        counts = {}
+        for outcome in self.outcomes:
+            counts[outcome.status] = counts.get(outcome.status, 0) + 1
+        return counts
+
+    def failure_summary(self, max_traceback_lines=8):
+        if self.timed_out:
+            return "The test run timed out; the code probably contains an infinite loop or is far too slow."
+        if self.problems:
+            return "Static checks failed before the tests were run:\n" + "\n".join(
+                f"- {item['file']}, line {item['line']}: {item['message']}" for item in self.problems
+            )
+        if not self.loaded:
+            lines = (self.error or self.output).strip().splitlines()
+            return "The code or tests failed to load:\n" + "\n".join(lines[-max_traceback_lines:])
+        parts = []
+        for error in self.errors:
+            # A shard that crashed or failed to load next to ones that ran
+            lines = error.strip().splitlines()
+            parts.append("Part of the suite did not run:\n" + "\n".join(lines[-max_traceback_lines:]))
+        for outcome in self.failing:
+            lines = (outcome.traceback or "").strip().splitlines()
+            parts.append(f"{outcome.name} ({outcome.status}):\n" + "\n".join(lines[-max_traceback_lines:]))
+        return "\n\n".join(parts) or f"Tests failed with return code {self.returncode}"
+
+    def to_dict(self):
+        return {
+            "returncode": self.returncode,
+            "outcomes": [outcome.to_dict() for outcome in self.outcomes],
+            "output": self.output,
+            "error": self.error,
+            "timed_out": self.timed_out,
+            "missing_module": self.missing_module,
+            "duration": self.duration,
+            "problems": self.problems,
+            "errors": self.errors
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data["returncode"],
+            [TestOutcome.from_dict(outcome) for outcome in data.get("outcomes", [])],
+            data.get("output", ""),
+            data.get("error"),
+            data.get("timed_out", False),
+            data.get("missing_module"),
+            data.get("duration", 0.0),
+            data.get("problems"),
+            data.get("errors")
+        )
+
+    @classmethod
+    def merge(cls, results):
+        # One result for a suite that was run in shards
+        if len(results) == 1:
+            return results[0]
+        return cls(
+            max(result.returncode for result in results),
+            [outcome for result in results for outcome in result.outcomes],
+            "".join(result.output for result in results),
+            "\n".join(result.error for result in results if result.error) or None,
+            any(result.timed_out for result in results),
+            next((result.missing_module for result in results if result.missing_module), None),
+            max(result.duration for result in results),
+            [item for result in results for item in result.problems],
+            [error for result in results for error in result.errors]
+        )
+
+    def __repr__(self):
+        return f"SuiteResult(returncode={self.returncode}, counts={self.counts()})"
+
+
+class RecordingTestResult(unittest.TextTestResult):
+    # Keeps a TestOutcome per test next to the usual text output. Names are
+    # relative to the test module so they can be fed back to
+    # loadTestsFromName on a later run.
+    def __init__(self, stream, descriptions, verbosity, module_name=None):
+        super().__init__(stream, descriptions, verbosity)
+        self.module_name = module_name
+        self.outcomes = []
+        self._started = {}
+
+    def _name(self, test):
+        name = test.id()
+        if self.module_name and name.startswith(self.module_name + "."):
+            name = name[len(self.module_name) + 1:]
+        return name
+
+    def _record(self, test, status, err=None):
+        started = self._started.pop(test.id(), None)
+        duration = time.perf_counter() - started if started is not None else 0.0
+        formatted = self._exc_info_to_string(err, test) if err else None
+        self.outcomes.append(TestOutcome(self._name(test), status, formatted, round(duration, 6)))
+
+    def startTest(self, test):
+        self._started[test.id()] = time.perf_counter()
+        super().startTest(test)
+
+    def addSuccess(self, test):
+        super().addSuccess(test)
+        self._record(test, "success")
+
+    def addFailure(self, test, err):
+        super().addFailure(test, err)
+        self._record(test, "failure", err)
+
+    def addError(self, test, err):
+        super().addError(test, err)
+        self._record(test, "error", err)
+
+    def addSkip(self, test, reason):
+        super().addSkip(test, reason)
+        self._record(test, "skipped")
+
+    def addExpectedFailure(self, test, err):
+        super().addExpectedFailure(test, err)
+        self._record(test, "expected_failure")
+
+    def addUnexpectedSuccess(self, test):
+        super().addUnexpectedSuccess(test)
+        self._record(test, "unexpected_success")
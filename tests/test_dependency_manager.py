@@ -0,0 +1,77 @@
+import os
+import sys
+import base64
+import hashlib
+import shutil
+import tempfile
+import zipfile
+import unittest
+from dependency_manager import DependencyManager
+
+
+NAME = "offline_probe_pkg"
+VERSION = "1.0"
+
+
+def build_wheel(directory):
+    # A pure-Python wheel written by hand, so no build backend (and no
+    # network) is needed to make one
+    files = {
+        f"{NAME}.py": "def probe():\n    return 'offline'\n",
+        f"{NAME}-{VERSION}.dist-info/METADATA": f"Metadata-Version: 2.1\nName: {NAME}\nVersion: {VERSION}\n",
+        f"{NAME}-{VERSION}.dist-info/WHEEL": "Wheel-Version: 1.0\nGenerator: test\nRoot-Is-Purelib: true\nTag: py3-none-any\n",
+    }
+    record = []
+    for path, content in files.items():
+        digest = base64.urlsafe_b64encode(hashlib.sha256(content.encode()).digest()).rstrip(b"=").decode()
+        record.append(f"{path},sha256={digest},{len(content.encode())}")
+    record.append(f"{NAME}-{VERSION}.dist-info/RECORD,,")
+    files[f"{NAME}-{VERSION}.dist-info/RECORD"] = "\n".join(record) + "\n"
+    path = os.path.join(directory, f"{NAME}-{VERSION}-py3-none-any.whl")
+    with zipfile.ZipFile(path, "w") as wheel:
+        for name, content in files.items():
+            wheel.writestr(name, content)
+    return path
+
+
+class OfflineInstallTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.find_links = os.path.join(self.directory, "index")
+        os.makedirs(self.find_links)
+        build_wheel(self.find_links)
+        # An index that cannot be reached: offline installs must not try it
+        self.manager = DependencyManager(
+            os.path.join(self.directory, "envs"), os.path.join(self.directory, "wheels"),
+            index_url="http://127.0.0.1:9/simple", find_links=self.find_links, offline=True, timeout=120
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_imported_module_is_resolved_and_installed_from_find_links(self):
+        requirements = self.manager.resolve(f"from {NAME} import probe\nimport os\n")
+        self.assertEqual(requirements, [NAME])
+
+        path = self.manager.ensure(requirements)
+        self.assertIsNotNone(path)
+        self.assertTrue(os.path.exists(os.path.join(path, f"{NAME}.py")))
+        sys.path.insert(0, path)
+        try:
+            module = __import__(NAME)
+            self.assertEqual(module.probe(), "offline")
+        finally:
+            sys.path.remove(path)
+            sys.modules.pop(NAME, None)
+
+        # The same set again is served from the environment without pip
+        self.assertEqual(self.manager.ensure(requirements), path)
+        self.assertEqual(self.manager.stats(), {"installs": 1, "reused": 1})
+
+    def test_unknown_requirement_fails_without_reaching_an_index(self):
+        self.assertIsNone(self.manager.ensure(["no-such-package-anywhere"]))
+        self.assertEqual(os.listdir(self.manager.root), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,204 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from http_cache import HttpCache, HostRateLimiter, CachingFetcher
+from search import WebSearcher
+from search_manager import SearchManager
+
+
+PAGE_DELAY = 0.3
+LAST_MODIFIED = "Wed, 01 Jan 2025 00:00:00 GMT"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # /etag and /dated answer conditional requests with 304, /page/<n> is a
+    # slow page with a code block, /search links to three of them
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, dict(self.headers), time.monotonic()))
+        if self.path == "/etag":
+            if self.headers.get("If-None-Match") == '"v1"':
+                return self._send(304)
+            return self._send(200, b"<p>etag body</p>", {"ETag": '"v1"'})
+        if self.path == "/dated":
+            if self.headers.get("If-Modified-Since") == LAST_MODIFIED:
+                return self._send(304)
+            return self._send(200, b"<p>dated body</p>", {"Last-Modified": LAST_MODIFIED})
+        if self.path.startswith("/page/"):
+            time.sleep(PAGE_DELAY)
+            number = self.path.rsplit("/", 1)[1]
+            return self._send(200, f"<pre>print({number})\n</pre><p>page {number}</p>".encode())
+        if self.path.startswith("/search"):
+            # Results on another host name for the same server, as search results would be
+            links = "".join(f'<a href="http://localhost:{server.server_port}/page/{n}">{n}</a>' for n in range(1, 4))
+            return self._send(200, links.encode())
+        self._send(404)
+
+    def _send(self, status, body=b"", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self.server.requests = []
+        self.server.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.base = f"http://127.0.0.1:{self.server.server_port}"
+        self.directory = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.directory, "http.sqlite")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def requests_for(self, path):
+        return [request for request in self.server.requests if request[0] == path]
+
+
+class CachingFetcherTest(StubServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = HttpCache(self.cache_path)
+        self.fetcher = CachingFetcher(self.cache, HostRateLimiter(default_rate=0))
+
+    def tearDown(self):
+        self.fetcher.close()
+        super().tearDown()
+
+    def test_fresh_entry_is_served_without_a_request(self):
+        first = self.fetcher.get(f"{self.base}/etag", ttl=60)
+        second = self.fetcher.get(f"{self.base}/etag", ttl=60)
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.requests_for("/etag")), 1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_expired_entry_is_revalidated_with_etag(self):
+        self.fetcher.get(f"{self.base}/etag", ttl=0)
+        body = self.fetcher.get(f"{self.base}/etag", ttl=0)
+        self.assertEqual(body, b"<p>etag body</p>")
+        requests = self.requests_for("/etag")
+        self.assertEqual(len(requests), 2)
+        self.assertEqual(requests[1][1].get("If-None-Match"), '"v1"')
+        self.assertEqual(self.cache.revalidated, 1)
+
+    def test_expired_entry_is_revalidated_with_last_modified(self):
+        self.fetcher.get(f"{self.base}/dated", ttl=0)
+        body = self.fetcher.get(f"{self.base}/dated", ttl=0)
+        self.assertEqual(body, b"<p>dated body</p>")
+        self.assertEqual(self.requests_for("/dated")[1][1].get("If-Modified-Since"), LAST_MODIFIED)
+        self.assertEqual(self.cache.revalidated, 1)
+
+    def test_response_headers_come_from_the_cache_too(self):
+        for ttl in (0, 60):
+            headers = {}
+            list(self.fetcher.iter_get(f"{self.base}/etag", ttl=ttl, response_headers=headers))
+            self.assertEqual(headers.get("Content-Type"), "text/html; charset=utf-8")
+
+    def test_body_cut_at_max_bytes_is_not_cached(self):
+        first = self.fetcher.get(f"{self.base}/etag", ttl=60, max_bytes=4)
+        second = self.fetcher.get(f"{self.base}/etag", ttl=60)
+        self.assertEqual(first, b"<p>e")
+        self.assertEqual(second, b"<p>etag body</p>")
+        requests = self.requests_for("/etag")
+        self.assertEqual(len(requests), 2)
+        self.assertIsNone(requests[1][1].get("If-None-Match"))
+
+
+class HostRateLimiterTest(StubServerTestCase):
+    def test_requests_to_one_host_are_spaced(self):
+        fetcher = CachingFetcher(rate_limiter=HostRateLimiter(default_rate=10))
+        try:
+            threads = [threading.Thread(target=fetcher.get, args=(f"{self.base}/etag",)) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            fetcher.close()
+        times = sorted(request[2] for request in self.requests_for("/etag"))
+        self.assertEqual(len(times), 3)
+        for earlier, later in zip(times, times[1:]):
+            self.assertGreaterEqual(later - earlier, 0.08)
+
+    def test_hosts_are_limited_separately(self):
+        limiter = HostRateLimiter(default_rate=1)
+        self.assertEqual(limiter.wait("http://one.example/a"), 0.0)
+        self.assertEqual(limiter.wait("http://two.example/a"), 0.0)
+        self.assertGreater(limiter.wait("http://one.example/b"), 0.5)
+
+
+class SearchManagerTest(StubServerTestCase):
+    def make_manager(self, **kwargs):
+        return SearchManager(None, top_n=3, max_workers=3, cache_path=self.cache_path, default_rate=0, search_url=f"{self.base}/search", **kwargs)
+
+    def test_top_pages_are_fetched_concurrently(self):
+        manager = self.make_manager()
+        try:
+            started = time.monotonic()
+            results = manager.fetch_code_reference("print numbers")
+            elapsed = time.monotonic() - started
+        finally:
+            manager.close()
+        self.assertEqual(len(results), 3)
+        for url, text in results.items():
+            number = url.rsplit("/", 1)[1]
+            self.assertIn(f"print({number})", text)
+        # One page's delay, not three
+        self.assertLess(elapsed, PAGE_DELAY * 2.5)
+
+    def test_close_waits_for_fetches_in_flight(self):
+        manager = self.make_manager()
+        url = f"http://localhost:{self.server.server_port}/page/7"
+        future = manager.executor.submit(manager.searcher.scrape_website_content, url)
+        time.sleep(PAGE_DELAY / 3)
+        manager.close()
+        self.assertTrue(future.done())
+        self.assertIn("print(7)", future.result()[url])
+
+
+class StaticFetcher:
+    def __init__(self, body):
+        self.body = body
+
+    def get(self, url, ttl=0, params=None, max_bytes=None):
+        return self.body
+
+
+class SearchResultsTest(unittest.TestCase):
+    def test_only_pages_off_the_search_engine_are_results(self):
+        links = [
+            "/url?q=https://docs.python.org/3/library/functools.html&sa=U",
+            "/url?q=https://support.google.com/websearch&sa=U",
+            "https://maps.google.com/maps?q=x",
+            "https://accounts.google.co.uk/ServiceLogin",
+            "https://webcache.googleusercontent.com/search?q=cache:x",
+            "/preferences",
+            "https://stackoverflow.com/questions/1",
+        ]
+        body = "".join(f'<a href="{link}">x</a>' for link in links).encode()
+        searcher = WebSearcher(None, fetcher=StaticFetcher(body))
+        self.assertEqual(searcher.fetch_search_results("functools"), [
+            "https://docs.python.org/3/library/functools.html",
+            "https://stackoverflow.com/questions/1",
+        ])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+import ast
+import unittest
+from static_checks import repair_indentation, prevalidate, undefined_names, declared_all
+
+
+CODE = """
+def fib(n):
+    a, b = 0, 1
+    for _ in range(n):
+        a, b = b, a + b
+    return a
+"""
+
+
+class RepairIndentationTest(unittest.TestCase):
+    def test_valid_code_is_returned_unchanged(self):
+        code = "def f():\n    if True:\n        return 1\n    return 2\n\ndef g():\n    return 3\n"
+        self.assertIs(repair_indentation(code), code)
+
+    def test_body_that_is_not_indented_is_moved_under_its_header(self):
+        code = "def f(x):\nreturn x + 1\n"
+        repaired = repair_indentation(code)
+        ast.parse(repaired)
+        self.assertEqual(repaired, "def f(x):\n    return x + 1")
+
+    def test_unexpected_indent_is_lined_up_with_the_previous_statement(self):
+        code = "def f():\n    x = 1\n        y = 2\n    return x + y\n"
+        namespace = {}
+        exec(repair_indentation(code), namespace)
+        self.assertEqual(namespace["f"](), 3)
+
+    def test_misplaced_else_is_aligned_with_its_if(self):
+        code = "def sign(x):\n    if x < 0:\n        return -1\n        else:\n        return 1\n"
+        namespace = {}
+        exec(repair_indentation(code), namespace)
+        self.assertEqual((namespace["sign"](-5), namespace["sign"](5)), (-1, 1))
+
+    def test_dedent_between_levels_snaps_to_an_open_block(self):
+        code = "def f():\n    for i in range(3):\n        pass\n   return 7\n"
+        namespace = {}
+        exec(repair_indentation(code), namespace)
+        self.assertEqual(namespace["f"](), 7)
+
+    def test_dedent_halfway_between_levels_goes_to_the_outer_one(self):
+        code = "def f():\n    for i in range(3):\n        pass\n  x = 7\n"
+        self.assertEqual(repair_indentation(code).splitlines()[-1], "x = 7")
+
+    def test_unrepairable_code_is_returned_as_it_was(self):
+        code = "def f(:\n    return 1\n"
+        self.assertEqual(repair_indentation(code), code)
+
+
+class GuessedImportTest(unittest.TestCase):
+    TESTS = "class T(unittest.TestCase):\n    def test(self):\n        self.assertEqual(fib(10), 55)\n"
+
+    def test_star_import_of_a_guessed_module_is_redirected(self):
+        _, tests, problems = prevalidate(CODE, "from fibonacci import *\n" + self.TESTS, "generated_abc")
+        self.assertEqual(tests.splitlines()[0], "from generated_abc import *")
+        self.assertEqual(problems, [])
+
+    def test_named_import_of_a_guessed_module_is_redirected(self):
+        _, tests, problems = prevalidate(CODE, "from fib_module import fib\n" + self.TESTS, "generated_abc")
+        self.assertEqual(tests.splitlines()[0], "from generated_abc import fib")
+        self.assertEqual(problems, [])
+
+    def test_imports_of_real_modules_are_left_alone(self):
+        _, tests, _ = prevalidate(CODE, "from math import *\nfrom os import path\n" + self.TESTS, "generated_abc")
+        self.assertEqual(tests.splitlines()[:2], ["from math import *", "from os import path"])
+
+    def test_plain_import_of_a_guessed_module_is_aliased(self):
+        tests = "import fibonacci\nclass T(unittest.TestCase):\n    def test(self):\n        self.assertEqual(fibonacci.fib(10), 55)\n"
+        _, tests, problems = prevalidate(CODE, tests, "generated_abc")
+        self.assertEqual(tests.splitlines()[0], "import generated_abc as fibonacci")
+        self.assertEqual(problems, [])
+
+
+class AllTest(unittest.TestCase):
+    TESTS = "class T(unittest.TestCase):\n    def test(self):\n        helper()\n"
+
+    def test_literal_all_is_read(self):
+        self.assertEqual(declared_all(ast.parse("__all__ = ['a']\n__all__ += ('b',)\n")), {"a", "b"})
+
+    def test_dynamic_all_cannot_be_read(self):
+        self.assertIsNone(declared_all(ast.parse("__all__ = [name for name in dir()]\n")))
+        self.assertIsNone(declared_all(ast.parse("__all__ = ['a']\n__all__.append('b')\n")))
+        self.assertIsNone(declared_all(ast.parse("x = 1\n")))
+
+    def test_name_left_out_of_all_is_reported(self):
+        code = "__all__ = ['fib']\n" + CODE + "\ndef helper():\n    return 1\n"
+        _, _, problems = prevalidate(code, self.TESTS, "generated_abc")
+        self.assertEqual(len(problems), 1)
+        self.assertIn("not in its __all__", problems[0]["message"])
+
+    def test_name_listed_in_all_is_exported(self):
+        code = "__all__ = ['fib', 'helper']\n" + CODE + "\ndef helper():\n    return 1\n"
+        self.assertEqual(prevalidate(code, self.TESTS, "generated_abc")[2], [])
+
+    def test_private_name_is_not_exported_without_all(self):
+        code = CODE + "\ndef _helper():\n    return 1\n"
+        _, _, problems = prevalidate(code, self.TESTS.replace("helper", "_helper"), "generated_abc")
+        self.assertIn("private", problems[0]["message"])
+
+    def test_dynamic_all_exports_everything(self):
+        code = "__all__ = [name for name in ('fib',)]\n" + CODE + "\ndef _helper():\n    return 1\n"
+        self.assertEqual(prevalidate(code, self.TESTS.replace("helper", "_helper"), "generated_abc")[2], [])
+
+
+class UndefinedNamesTest(unittest.TestCase):
+    def test_undefined_and_unimported_names_are_reported(self):
+        problems = undefined_names(ast.parse("def f():\n    return math.pi + missing\n"), "code")
+        self.assertEqual({problem["kind"] for problem in problems}, {"missing_import", "undefined_name"})
+
+    def test_star_import_of_a_real_module_disables_the_check(self):
+        tree = ast.parse("from math import *\nprint(pi, anything_at_all)\n")
+        self.assertEqual(undefined_names(tree, "code"), [])
+
+    def test_star_import_of_the_module_under_test_keeps_the_check(self):
+        tree = ast.parse("from generated_abc import *\nprint(fib, anything_at_all)\n")
+        problems = undefined_names(tree, "tests", {"fib"}, {"generated_abc"})
+        self.assertEqual([problem["message"].split("'")[1] for problem in problems], ["anything_at_all"])
+
+    def test_real_star_import_in_the_tests_disables_the_check(self):
+        tests = "from math import *\nclass T(unittest.TestCase):\n    def test(self):\n        self.assertTrue(floor(anything_at_all))\n"
+        self.assertEqual(prevalidate(CODE, tests, "generated_abc")[2], [])
+
+    def test_names_in_postponed_annotations_are_not_looked_up(self):
+        tree = ast.parse("from __future__ import annotations\ndef f(x: Missing) -> Other:\n    return x\n")
+        self.assertEqual(undefined_names(tree, "code"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
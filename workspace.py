@@ -0,0 +1,47 @@
+import os
+import uuid
+import shutil
+import tempfile
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class Workspace:
+    # A private directory for one generation/test run. Generated modules get a
+    # unique import name so concurrent runs never shadow each other.
+    def __init__(self, base_dir=None, use_tmpfs=False, prefix='agent_run_'):
+        if base_dir is None and use_tmpfs and os.path.isdir('/dev/shm'):
+            base_dir = '/dev/shm'
+        if base_dir and not os.path.exists(base_dir):
+            os.makedirs(base_dir)
+        self.root = tempfile.mkdtemp(prefix=prefix, dir=base_dir)
+        self.run_id = os.path.basename(self.root)
+        self.module_name = f"generated_{uuid.uuid4().hex[:12]}"
+        logger.debug(f"Created workspace {self.root}")
+
+    @property
+    def module_path(self):
+        return self.path(f"{self.module_name}.py")
+
+    @property
+    def test_module_name(self):
+        return f"test_{self.module_name}"
+
+    @property
+    def test_path(self):
+        return self.path(f"{self.test_module_name}.py")
+
+    def path(self, filename):
+        return os.path.join(self.root, filename)
+
+    def cleanup(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+        logger.debug(f"Removed workspace {self.root}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cleanup()